@@ -0,0 +1,396 @@
+'''
+------------------------------------------------------------------------
+NumPy aggregation of sensor lines.
+Lines look like ReadingObj.get_solar_str(): 'date,value,value,...'
+They are parsed into one 2-D float array (rows x sensors) with NaN for
+missing values, then reduced column by column. Missing values are
+skipped instead of being counted as 0.
+
+    compress an hour     summarize(parse_lines(lines)[1])
+    daily / weekly       aggregate_windows(timestamps, values, 86400)
+    while logging        PeriodAggregator.update(epoch, values)
+------------------------------------------------------------------------
+'''
+import warnings
+from datetime import datetime, timezone
+from json import dump, load
+from os import fsync, replace
+from time import localtime, monotonic, strftime
+
+import numpy as np
+
+# written for a sensor that has no values at all in the window.
+# same workaround as ReadingObj, the app crashes on None.
+# A sample holding it is a missing value in PeriodAggregator.
+MISSING_VALUE = 0.01
+
+# closed periods kept per period type. only the last hour is read back,
+# the rest is history for debugging. keeps the state file a few tens of kB
+KEEP_CLOSED = {'hour': 48, 'day': 31, 'week': 8}
+
+# longest the state file goes without being saved, seconds
+SAVE_INTERVAL = 300
+
+
+def parse_lines(lines, width=None):
+    """
+    -------------------------------------------------------
+    Parses csv lines into dates and a 2-D float array.
+    Use: dates, values = parse_lines(doc_data.get('lines', []))
+    -------------------------------------------------------
+    Parameters:
+        lines - 'date,value,value,...' strings (list)
+        width - number of values per line. Defaults to the widest line (int)
+    Returns:
+        dates - first field of each line (list)
+        values - float array, rows x width. NaN where missing (ndarray)
+    -------------------------------------------------------
+    """
+    rows = [line.split(',') for line in lines]
+    if width is None:
+        width = max((len(row) - 1 for row in rows), default=0)
+    dates = [row[0] for row in rows]
+    # pad short lines so the cells form one rectangular array
+    cells = np.array([row[1:width + 1] + [''] * (width + 1 - len(row)) for row in rows], dtype=str).reshape(len(rows), width)
+    try:
+        values = cells.astype(float)
+    except ValueError:
+        # some cells are 'None' or empty. only then convert cell by cell.
+        values = np.vectorize(_to_float, otypes=[float])(cells) if cells.size else cells.astype(float)
+    return dates, values
+
+
+def _to_float(cell):
+    try:
+        return float(cell)
+    except ValueError:
+        return np.nan
+
+
+def parse_dates(dates):
+    """
+    -------------------------------------------------------
+    Converts '%Y-%m-%d %H:%M:%S' strings to epoch seconds (local time
+    read as if it were UTC, fine for bucketing by day or week).
+    -------------------------------------------------------
+    """
+    return np.array([d.replace(' ', 'T') for d in dates], dtype='datetime64[s]').astype(np.int64)
+
+
+def summarize(values, percentiles=(), std=False):
+    """
+    -------------------------------------------------------
+    NaN aware mean, max, min for each column of values.
+    Use: summary = summarize(values)
+    -------------------------------------------------------
+    Parameters:
+        values - rows x sensors float array (ndarray)
+        percentiles - also compute these percentiles, i.e. (50, 95) (tuple)
+        std - also compute the standard deviation (bool)
+    Returns:
+        summary - {'mean', 'max', 'min', 'count', ['std'], ['p50', ...]}
+                  each an array with one value per sensor. NaN when a
+                  sensor has no values. (dict)
+    -------------------------------------------------------
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values.reshape(1, -1)
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    total = np.where(valid, values, 0.0).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+    summary = {
+        'mean': mean,
+        # fmax/fmin skip NaN, an all NaN column stays NaN
+        'max': np.fmax.reduce(values, axis=0) if len(values) else np.full(values.shape[1], np.nan),
+        'min': np.fmin.reduce(values, axis=0) if len(values) else np.full(values.shape[1], np.nan),
+        'count': count}
+    if std or percentiles:
+        with warnings.catch_warnings():
+            # all NaN columns warn, they are returned as NaN which is what we want
+            warnings.simplefilter('ignore', RuntimeWarning)
+            if std:
+                summary['std'] = np.nanstd(values, axis=0)
+            for q in percentiles:
+                summary[f'p{q}'] = np.nanpercentile(values, q, axis=0)
+    return summary
+
+
+def aggregate_windows(timestamps, values, window, percentiles=(), std=False):
+    """
+    -------------------------------------------------------
+    Summarizes values in fixed windows, i.e. 3600 hourly, 86400 daily,
+    604800 weekly. mean/max/min/count are computed for every window at
+    once with reduceat, cost grows linearly with the rows.
+    Use: starts, summary = aggregate_windows(epochs, values, 86400)
+    -------------------------------------------------------
+    Parameters:
+        timestamps - epoch seconds for each row (ndarray)
+        values - rows x sensors float array (ndarray)
+        window - window length in seconds (int)
+        percentiles, std - see summarize
+    Returns:
+        starts - start of each window that has rows (ndarray)
+        summary - like summarize but each array is windows x sensors (dict)
+    -------------------------------------------------------
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    values = values[order]
+    buckets = timestamps - np.mod(timestamps, window)
+    starts, first = np.unique(buckets, return_index=True)
+    if len(starts) == 0:
+        empty = np.empty((0, values.shape[1] if values.ndim == 2 else 0))
+        return starts, {'mean': empty, 'max': empty, 'min': empty, 'count': empty}
+
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid.astype(np.int64), first, axis=0)
+    total = np.add.reduceat(np.where(valid, values, 0.0), first, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+    summary = {
+        'mean': mean,
+        'max': np.fmax.reduceat(values, first, axis=0),
+        'min': np.fmin.reduceat(values, first, axis=0),
+        'count': count}
+    if std:
+        squares = np.add.reduceat(np.where(valid, values, 0.0) ** 2, first, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = squares / count - mean ** 2
+        summary['std'] = np.sqrt(np.maximum(variance, 0.0))
+    if percentiles:
+        # percentiles can't be reduced, one call per window
+        bounds = list(first[1:]) + [len(values)]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for q in percentiles:
+                summary[f'p{q}'] = np.array([np.nanpercentile(values[a:b], q, axis=0) for a, b in zip(first, bounds)])
+    return starts, summary
+
+
+def format_summary(time_str, summary):
+    """
+    -------------------------------------------------------
+    Formats a summary as the compressed line stored in the week document.
+    'date,avg,max,min,avg,max,min,...'
+    -------------------------------------------------------
+    """
+    fields = list()
+    for avg, maxm, minm in zip(summary['mean'].tolist(), summary['max'].tolist(), summary['min'].tolist()):
+        if avg != avg:
+            # NaN, no values for this sensor
+            fields.append(f"{MISSING_VALUE},{MISSING_VALUE},{MISSING_VALUE}")
+        else:
+            # +0.001 rounds the .005 up
+            fields.append(f"{round(avg + 0.001, 2)},{maxm},{minm}")
+    return f"{time_str}," + ",".join(fields)
+
+
+class RunningStats:
+    """
+    -------------------------------------------------------
+    Online count, mean, variance (Welford), min and max for each sensor.
+    Updated one sample at a time, nothing is kept per sample.
+    -------------------------------------------------------
+    """
+    def __init__(self, width):
+        self.count = np.zeros(width, dtype=np.int64)
+        self.mean = np.zeros(width)
+        self.m2 = np.zeros(width)
+        self.min = np.full(width, np.nan)
+        self.max = np.full(width, np.nan)
+
+    def update(self, values):
+        # values - one value per sensor, None or NaN when missing
+        x = np.array(values, dtype=float)
+        valid = ~np.isnan(x)
+        self.count += valid
+        with np.errstate(invalid='ignore'):
+            delta = np.where(valid, x - self.mean, 0.0)
+            self.mean += delta / np.maximum(self.count, 1)
+            self.m2 += np.where(valid, delta * (x - self.mean), 0.0)
+        self.min = np.fmin(self.min, x)
+        self.max = np.fmax(self.max, x)
+
+    def summary(self):
+        """
+        Returns the same dict as summarize(), with 'std' included.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {
+                'mean': np.where(self.count > 0, self.mean, np.nan),
+                'max': self.max.copy(),
+                'min': self.min.copy(),
+                'count': self.count.copy(),
+                'std': np.where(self.count > 0, np.sqrt(self.m2 / np.maximum(self.count, 1)), np.nan)}
+
+    def to_dict(self):
+        return {name: [None if v != v else v for v in getattr(self, name).tolist()]
+                for name in ('count', 'mean', 'm2', 'min', 'max')}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(len(data['count']))
+        stats.count = np.array(data['count'], dtype=np.int64)
+        for name in ('mean', 'm2', 'min', 'max'):
+            setattr(stats, name, np.array(data[name], dtype=float))
+        return stats
+
+
+class PeriodAggregator:
+    """
+    -------------------------------------------------------
+    Running stats for the current hour, day and ISO week, updated on
+    every sample. When a period rolls over its summary is kept, so the
+    compressed hour line is ready without downloading the hour again.
+    The state is saved when a period closes and at least every
+    save_interval seconds, not every sample, to spare the SD card.
+    Call save() on shutdown too. Only a power cut or a crash loses
+    anything, at most save_interval seconds of the running stats.
+    Use: aggregator = PeriodAggregator('Output/aggregator_state.json')
+         aggregator.update(epoch, readingObj.get_solar_tuple()[1:])
+    -------------------------------------------------------
+    Keys:
+        hour - UTC hour start in epoch seconds, same hour as the firestore document
+        day  - local date, starting at day_start_hour (the daily max reset)
+        week - ISO 'year-Wweek' of the UTC date, same as the week document
+    -------------------------------------------------------
+    """
+    PERIODS = ('hour', 'day', 'week')
+
+    def __init__(self, state_file=None, day_start_hour=5, keep_closed=KEEP_CLOSED, save_interval=SAVE_INTERVAL):
+        """
+        -------------------------------------------------------
+        Parameters:
+            state_file - json file the state is saved to. None keeps it in memory (str)
+            day_start_hour - local hour the day period starts (int)
+            keep_closed - closed periods kept, one count for every period
+                          type or {period: count} (int or dict)
+            save_interval - longest time between saves, seconds (float)
+        -------------------------------------------------------
+        """
+        self.state_file = state_file
+        self.day_start_hour = day_start_hour
+        if isinstance(keep_closed, dict):
+            self.keep_closed = {period: keep_closed.get(period, 0) for period in self.PERIODS}
+        else:
+            self.keep_closed = {period: keep_closed for period in self.PERIODS}
+        self.save_interval = save_interval
+        self._last_save = monotonic()
+        # period -> [key, RunningStats]
+        self.current = dict()
+        # period -> {key: summary line or summary dict}
+        self.closed = {period: dict() for period in self.PERIODS}
+        if state_file is not None:
+            self.load()
+
+    def keys(self, epoch):
+        """
+        Returns the hour, day and week keys for an epoch time.
+        """
+        utc = datetime.fromtimestamp(epoch, timezone.utc)
+        local_day = datetime.fromtimestamp(epoch - self.day_start_hour * 3600)
+        iso = utc.isocalendar()
+        return {
+            'hour': int(epoch - epoch % 3600),
+            'day': local_day.strftime('%Y-%m-%d'),
+            'week': f"{iso[0]}-W{iso[1]:02d}"}
+
+    def update(self, epoch, values):
+        """
+        -------------------------------------------------------
+        Adds one sample. Closes any period it rolls over.
+        None and the 0.01 placeholder are missing values, they
+        don't count towards the min, mean or count.
+        -------------------------------------------------------
+        Parameters:
+            epoch - time of the sample in epoch seconds (float)
+            values - one value per sensor (list)
+        Returns:
+            closed - [(period, key)] closed by this sample (list)
+        -------------------------------------------------------
+        """
+        values = [None if value == MISSING_VALUE else value for value in values]
+        closed = list()
+        for period, key in self.keys(epoch).items():
+            current = self.current.get(period)
+            if current is not None and current[0] != key:
+                self._close(period, current[0], current[1])
+                closed.append((period, current[0]))
+                current = None
+            if current is None:
+                current = self.current[period] = [key, RunningStats(len(values))]
+            current[1].update(values)
+        if closed or monotonic() - self._last_save >= self.save_interval:
+            self.save()
+        return closed
+
+    def _close(self, period, key, stats):
+        summary = stats.summary()
+        if period == 'hour':
+            self.closed[period][key] = format_summary(strftime('%Y-%m-%d %H:%M:%S', localtime(key)), summary)
+        else:
+            self.closed[period][key] = {name: [None if v != v else v for v in values.tolist()]
+                                        for name, values in summary.items()}
+        while len(self.closed[period]) > self.keep_closed[period]:
+            del self.closed[period][next(iter(self.closed[period]))]
+
+    def hour_line(self, date_time_utc):
+        """
+        -------------------------------------------------------
+        Returns the compressed line of a closed hour, or None if
+        this aggregator didn't see that hour.
+        date_time_utc - start of the hour (datetime)
+        -------------------------------------------------------
+        """
+        return self.closed['hour'].get(int(date_time_utc.timestamp()))
+
+    def current_max(self, period, index):
+        """
+        -------------------------------------------------------
+        Returns the running max of one sensor for the current period.
+        i.e. current_max('day', 1) is today's glycol_in max.
+        None before the first value.
+        -------------------------------------------------------
+        """
+        current = self.current.get(period)
+        if current is None:
+            return None
+        value = current[1].max[index]
+        return None if value != value else float(value)
+
+    def save(self):
+        """
+        -------------------------------------------------------
+        Writes the state file. Also call it on shutdown.
+        -------------------------------------------------------
+        """
+        self._last_save = monotonic()
+        if self.state_file is None:
+            return
+        state = {
+            'current': {period: [key, stats.to_dict()] for period, (key, stats) in self.current.items()},
+            'closed': {period: [[key, value] for key, value in closed.items()] for period, closed in self.closed.items()}}
+        # write, sync, then rename so a power cut can't leave an empty or half file
+        temp_file = self.state_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            dump(state, f)
+            f.flush()
+            fsync(f.fileno())
+        replace(temp_file, self.state_file)
+
+    def load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = load(f)
+        except (OSError, ValueError):
+            return
+        self.current = {period: [key, RunningStats.from_dict(stats)] for period, (key, stats) in state.get('current', {}).items()}
+        for period, closed in state.get('closed', {}).items():
+            # trimmed to keep_closed, older state files kept far more
+            keep = self.keep_closed.get(period, 0)
+            self.closed[period] = dict(closed[max(0, len(closed) - keep):]) if keep else dict()
@@ -0,0 +1,415 @@
+'''
+------------------------------------------------------------------------
+End to end benchmark of the logger, run off the Pi. Uses the fake
+1-Wire bus (fake_w1.py) and the in memory Firestore and messaging
+stand-ins (fake_firestore.py) in a temporary folder, and writes one
+JSON report per run so two runs can be compared before deploying.
+
+    sweep    - read_sensors over the fake bus: one by one, 4 workers,
+               bulk, bulk with CRC failures, bulk with missing devices
+    sinks    - latency of each storage write over two synthetic days:
+               sqlite local and usb, ts_store, text archive, firestore
+    rollover - the writes that cross an hour (firestore) or a day
+               (text archive, ts_store) boundary, kept apart from sinks
+    plot     - range query, column load, downsampling and a full Agg
+               draw of the three plotter subplots, for spans of 1 day
+               to 5 years of synthetic history
+
+Times are in milliseconds. The firestore sink needs firebase_admin
+installed (no credentials), it is skipped without it.
+The 5 year history is 8.3 million rows, about 1.7 GB and a few minutes
+to build. A shorter history days argument makes a quicker run.
+
+Use: python bench.py run [<report.json>] [<history days>]
+     python bench.py compare <old report.json> <new report.json>
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timezone
+from json import dump as json_dump, load as json_load
+from os import chdir, getcwd, makedirs, path as os_path
+from platform import platform, python_version
+from shutil import rmtree
+from sqlite3 import connect as sqlite_connect
+from subprocess import run as subprocess_run
+from sys import argv
+from tempfile import mkdtemp
+from time import localtime, mktime, perf_counter, strftime
+
+import numpy as np
+
+import notifier
+from downsample import downsample
+from ds18b20 import ReadingObj, read_sensors
+from log_setup import setup_logging, stop_logging
+from metrics import METRICS
+from fake_firestore import FakeFirestore, FakeMessaging
+from fake_w1 import DEFAULT_MASTERS, FakeDS18B20, FakeW1Bus
+from plot_data import fetch_columns
+from sensor_registry import REGISTRY
+from sqlite_storage import ROLLUPS, SQLiteWriter, create_schema, fill_rollup, insert_sql, pick_rollup, select_rollup_sql
+from text_archive import TextArchive
+from ts_store import TimeSeriesStore
+
+SAMPLE_INTERVAL = 18.9
+# sweeps timed per case. A one by one sweep of 9 sensors takes about 9s
+SWEEPS = 3
+CONVERSION_TIME = 0.75
+SINK_DAYS = 2
+# plot spans in days, all ending at the newest sample
+PLOT_SPANS = {'1d': 1, '1w': 7, '30d': 30, '1y': 365, '5y': 1826}
+PLOT_REPEATS = 3
+# plot width in pixels, what the series are downsampled to
+PLOT_WIDTH = 1000
+# compare flags a time that grew by more than this
+REGRESSION = 0.10
+# first synthetic sample, local noon
+START_EPOCH = mktime((2024, 6, 1, 12, 0, 0, 0, 0, -1))
+
+# bus settings and read_sensors arguments of each sweep case
+SWEEP_CASES = {
+    'serial': ({}, {'max_workers': 1, 'bulk': False}),
+    'workers_4': ({}, {'max_workers': 4, 'bulk': False}),
+    'bulk': ({}, {'max_workers': 1, 'bulk': True}),
+    'bulk_crc_10pct': ({'crc_fail_rate': 0.1}, {'max_workers': 1, 'bulk': True}),
+    'bulk_2_missing': ({'missing': list(DEFAULT_MASTERS['w1_bus_master2'])[:2]}, {'max_workers': 1, 'bulk': True})}
+
+# plotter subplot of each solar column, like LINES in plotter.pyw
+PLOT_SUBPLOTS = (0, 0, 0, 0, 1, 1, 1, 2, 2, 2)
+
+
+def timing_stats(times):
+    """
+    -------------------------------------------------------
+    Summary of a list of durations in seconds, reported in ms.
+    -------------------------------------------------------
+    """
+    ms = np.array(times, dtype=float) * 1000
+    if len(ms) == 0:
+        return {'n': 0}
+    return {'n': len(ms), 'mean': round(float(ms.mean()), 3), 'p50': round(float(np.percentile(ms, 50)), 3),
+            'p95': round(float(np.percentile(ms, 95)), 3), 'max': round(float(ms.max()), 3)}
+
+
+def synthetic_values(epochs, columns, seed=0):
+    """
+    -------------------------------------------------------
+    Returns a daily cycle plus noise for each column, rounded like
+    the logger, one row per epoch.
+    -------------------------------------------------------
+    """
+    rng = np.random.default_rng(seed)
+    phase = (np.asarray(epochs) % 86400) / 86400 * 2 * np.pi
+    base = 35 + 3 * np.arange(columns)
+    values = base + 12 * np.sin(phase[:, None] + np.arange(columns) * 0.3) + rng.normal(0, 0.3, (len(epochs), columns))
+    return np.round(values, 2)
+
+
+def date_string(epoch):
+    # "Date" of a sample, like the logger writes it
+    return strftime('%Y-%m-%d %H:%M:%S', localtime(epoch))
+
+
+def bench_sweep(work):
+    """
+    -------------------------------------------------------
+    Times read_sensors over the fake bus for every case of SWEEP_CASES.
+    -------------------------------------------------------
+    """
+    results = dict()
+    for name, (bus_settings, read_settings) in SWEEP_CASES.items():
+        bus = FakeW1Bus(os_path.join(work, 'w1_' + name), conversion_time=CONVERSION_TIME, **bus_settings)
+        sensor_obj = FakeDS18B20(bus)
+        times = list()
+        for k in range(SWEEPS):
+            start = perf_counter()
+            sensor_obj.refresh()
+            read_sensors(sensor_obj, None, date_string(START_EPOCH + k * SAMPLE_INTERVAL),
+                         sensor_obj.device_count(), 2, **read_settings)
+            times.append(perf_counter() - start)
+        results[name] = dict(timing_stats(times), devices=sensor_obj.device_count(),
+                             conversions=bus.conversions, crc_failures=bus.crc_failures)
+        print(f"sweep {name:16} {results[name]['mean']:9.1f} ms")
+    return results
+
+
+def bench_sinks(work):
+    """
+    -------------------------------------------------------
+    Writes SINK_DAYS of samples to every sink, timing each write.
+    Returns the steady writes and the boundary crossing writes apart.
+    -------------------------------------------------------
+    """
+    names = ReadingObj.SENSOR_NAMES
+    solar = [REGISTRY.names.index(name) for name in ReadingObj.SOLAR_FIELDS]
+    epochs = START_EPOCH + np.arange(int(SINK_DAYS * 86400 / SAMPLE_INTERVAL)) * SAMPLE_INTERVAL
+    values = synthetic_values(epochs, len(REGISTRY.names))
+
+    def sample(k):
+        date = date_string(epochs[k])
+        solar_values = tuple(values[k, solar].tolist())
+        return float(epochs[k]), date, (date,) + solar_values, list(zip(REGISTRY.names, values[k].tolist()))
+
+    def utc_hour(epoch):
+        return datetime.fromtimestamp(epoch, timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    def local_day(epoch):
+        return localtime(epoch)[:3]
+
+    def utc_day(epoch):
+        return utc_hour(epoch).date()
+
+    # like the logger's sinks
+    local_writer = SQLiteWriter(os_path.join(work, 'local.db'), names, rollups=list(ROLLUPS), registry=REGISTRY)
+    usb_writer = SQLiteWriter(os_path.join(work, 'usb.db'), names, commit_every=20, commit_interval=300, registry=REGISTRY)
+    store = TimeSeriesStore(os_path.join(work, 'ts'), names)
+    archive = TextArchive(os_path.join(work, 'output.txt'), ','.join(names))
+    # sink -> (write(epoch, date, row, readings), boundary of the sample or None)
+    sinks = {
+        'sqlite_local': (lambda epoch, date, row, readings: local_writer.write(row, epoch, readings), None),
+        'sqlite_usb': (lambda epoch, date, row, readings: usb_writer.write(row, epoch, readings), None),
+        'ts_store': (lambda epoch, date, row, readings: store.append(epoch, row[1:]), utc_day),
+        'text_archive': (lambda epoch, date, row, readings: archive.write(','.join(map(str, row)), epoch), local_day)}
+    skipped = dict()
+    try:
+        import firebase_admin_file
+    except ImportError as error:
+        skipped['firestore'] = f"firebase_admin not installed: {error}"
+    else:
+        firebase_admin_file.db = FakeFirestore()
+        firebase_admin_file.messaging = FakeMessaging()
+        state = {'ref': None}
+
+        def write_firestore(epoch, date, row, readings):
+            state['ref'] = firebase_admin_file.write_lines(utc_hour(epoch), [','.join(map(str, row))], state['ref'],
+                                                           row[2], row[1])
+        sinks['firestore'] = (write_firestore, utc_hour)
+
+    steady = {name: list() for name in sinks}
+    crossing = {name: list() for name in sinks}
+    last_boundary = dict()
+    for k in range(len(epochs)):
+        epoch, date, row, readings = sample(k)
+        for name, (write, boundary) in sinks.items():
+            start = perf_counter()
+            write(epoch, date, row, readings)
+            elapsed = perf_counter() - start
+            key = boundary(epoch) if boundary is not None else None
+            if k and key != last_boundary.get(name):
+                crossing[name].append(elapsed)
+            else:
+                steady[name].append(elapsed)
+            last_boundary[name] = key
+
+    start = perf_counter()
+    local_writer.close()
+    usb_writer.close()
+    store.close()
+    archive.close()
+    close_time = perf_counter() - start
+
+    sinks_result = {name: timing_stats(times) for name, times in steady.items()}
+    sinks_result.update({name: {'skipped': reason} for name, reason in skipped.items()})
+    rollover = {name: timing_stats(times) for name, times in crossing.items() if times}
+    # closing waits for the background compression of the rotated day
+    rollover['close_and_compress'] = timing_stats([close_time])
+    for name, stats in sinks_result.items():
+        print(f"sink {name:16} " + (f"{stats['p50']:9.3f} ms p50  {stats['p95']:9.3f} ms p95" if 'p50' in stats else stats['skipped']))
+    return sinks_result, rollover
+
+
+def build_history(db_location, days):
+    """
+    -------------------------------------------------------
+    Fills a database with days of synthetic samples and its rollups.
+    -------------------------------------------------------
+    Returns:
+        epoch of the newest sample (float)
+    -------------------------------------------------------
+    """
+    names = ReadingObj.SENSOR_NAMES
+    count = int(days * 86400 / SAMPLE_INTERVAL)
+    conn = sqlite_connect(db_location, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        create_schema(conn, names)
+        sql = insert_sql(names)
+        for first in range(0, count, 100000):
+            epochs = START_EPOCH + np.arange(first, min(first + 100000, count)) * SAMPLE_INTERVAL
+            values = synthetic_values(epochs, len(names) - 1, seed=first)
+            conn.executemany(sql, zip(epochs.astype(np.int64).tolist(), *values.T.tolist()))
+        for table in ROLLUPS:
+            fill_rollup(conn, table, names)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return START_EPOCH + (count - 1) * SAMPLE_INTERVAL
+
+
+def bench_plot(work, history_days):
+    """
+    -------------------------------------------------------
+    Times the plotter's refresh steps for each span of PLOT_SPANS:
+    query, column load, downsampling and a full draw.
+    -------------------------------------------------------
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import matplotlib.dates as mdates
+
+    names = ReadingObj.SENSOR_NAMES
+    db_location = os_path.join(work, 'history.db')
+    start = perf_counter()
+    end = build_history(db_location, history_days)
+    results = {'history': {'days': history_days, 'rows': int(history_days * 86400 / SAMPLE_INTERVAL),
+                           'build_seconds': round(perf_counter() - start, 1),
+                           'db_mb': round(os_path.getsize(db_location) / 1e6, 1)}}
+    print(f"plot history {history_days} days built in {results['history']['build_seconds']}s")
+
+    fig = Figure(figsize=(10, 8))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(3, 1)
+    lines = [axes[n].plot([], [])[0] for n in PLOT_SUBPLOTS]
+    conn = sqlite_connect(db_location)
+    try:
+        for span, days in PLOT_SPANS.items():
+            if days > history_days:
+                continue
+            y = (int(end - days * 86400), int(end))
+            rollup = pick_rollup(days * 86400, PLOT_WIDTH)
+            steps = {'query': list(), 'load': list(), 'downsample': list(), 'draw': list()}
+            for _ in range(PLOT_REPEATS):
+                t0 = perf_counter()
+                if rollup is not None:
+                    cursor = conn.execute(select_rollup_sql(rollup, names), y)
+                else:
+                    cursor = conn.execute('SELECT * FROM samples WHERE ts BETWEEN ? AND ?', y)
+                t1 = perf_counter()
+                times, columns = fetch_columns(cursor)
+                t2 = perf_counter()
+                x = mdates.date2num(times)
+                reduced = [downsample(columns[:, i], PLOT_WIDTH, 'lttb', x=x) for i in range(columns.shape[1])]
+                t3 = perf_counter()
+                for line, (idx, series) in zip(lines, reduced):
+                    line.set_data(x[idx], series)
+                for ax in axes:
+                    ax.relim()
+                    ax.autoscale_view()
+                fig.canvas.draw()
+                t4 = perf_counter()
+                for step, elapsed in zip(steps, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+                    steps[step].append(elapsed)
+            results[span] = {'table': rollup or 'samples', 'rows': len(times),
+                             'total': timing_stats([sum(parts) for parts in zip(*steps.values())])}
+            results[span].update({step: timing_stats(durations) for step, durations in steps.items()})
+            print(f"plot {span:4} {results[span]['table']:16} {len(times):8} rows {results[span]['total']['mean']:9.1f} ms")
+    finally:
+        conn.close()
+    return results
+
+
+def git_commit():
+    # commit the run was made on, None outside a git checkout
+    try:
+        done = subprocess_run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os_path.dirname(os_path.abspath(__file__)))
+    except OSError:
+        return None
+    return done.stdout.strip() or None
+
+
+def run(report_file=None, history_days=max(PLOT_SPANS.values())):
+    """
+    -------------------------------------------------------
+    Runs every benchmark and writes the report.
+    Use: run('Output/bench/before.json')
+    -------------------------------------------------------
+    Returns:
+        report (dict)
+    -------------------------------------------------------
+    """
+    if report_file is None:
+        report_file = os_path.join('Output', 'bench', f"bench-{strftime('%Y%m%d-%H%M%S')}.json")
+    report_file = os_path.abspath(report_file)
+    home = getcwd()
+    # sinks write Output/ files relative to the working folder
+    work = mkdtemp(prefix='bench_')
+    makedirs(os_path.join(work, 'Output'), exist_ok=True)
+    chdir(work)
+    # the retry and recovery logs go through the same queue as on the pi
+    setup_logging(os_path.join(work, 'Logs'))
+    messaging = FakeMessaging()
+    notifier.dispatcher = notifier.NotificationDispatcher(sender=messaging.send_notifications)
+    try:
+        sinks, rollover = bench_sinks(work)
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': python_version(),
+            'platform': platform(),
+            'settings': {'sample_interval': SAMPLE_INTERVAL, 'sweeps': SWEEPS, 'conversion_time': CONVERSION_TIME,
+                         'sink_days': SINK_DAYS, 'history_days': history_days, 'plot_width': PLOT_WIDTH},
+            'results': {
+                'sweep': bench_sweep(work),
+                'sinks': sinks,
+                'rollover': rollover,
+                'plot': bench_plot(work, history_days)},
+            'notifications': messaging.messages,
+            # stage timings and retry counters the code recorded during the run
+            'metrics': METRICS.snapshot()}
+    finally:
+        stop_logging()
+        chdir(home)
+        rmtree(work, ignore_errors=True)
+    makedirs(os_path.dirname(report_file), exist_ok=True)
+    with open(report_file, 'w') as file:
+        json_dump(report, file, indent=1)
+    print(f"report: {report_file}")
+    return report
+
+
+def flatten(results, prefix=''):
+    # {'sinks.ts_store.p50': 0.02, ...} of every number in the results
+    flat = dict()
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old_file, new_file):
+    """
+    -------------------------------------------------------
+    Prints the times of two reports side by side.
+    A mean, p50 or p95 that grew by more than REGRESSION is flagged.
+    -------------------------------------------------------
+    Returns:
+        number of flagged times (int)
+    -------------------------------------------------------
+    """
+    with open(old_file) as file:
+        old = flatten(json_load(file)['results'])
+    with open(new_file) as file:
+        new = flatten(json_load(file)['results'])
+    flagged = 0
+    for metric in sorted(set(old) & set(new)):
+        if metric.rsplit('.', 1)[-1] not in ('mean', 'p50', 'p95'):
+            continue
+        before, after = old[metric], new[metric]
+        change = (after - before) / before if before else 0.0
+        slower = change > REGRESSION
+        flagged += slower
+        print(f"{metric:42} {before:11.3f} {after:11.3f} ms {change:+8.1%}{'  SLOWER' if slower else ''}")
+    return flagged
+
+
+if __name__ == '__main__':
+    if len(argv) >= 2 and argv[1] == 'run' and len(argv) <= 4:
+        run(argv[2] if len(argv) > 2 else None, int(argv[3]) if len(argv) > 3 else max(PLOT_SPANS.values()))
+    elif len(argv) == 4 and argv[1] == 'compare':
+        raise SystemExit(1 if compare(argv[2], argv[3]) else 0)
+    else:
+        print('Use: python bench.py run [<report.json>] [<history days>]\n'
+              '     python bench.py compare <old report.json> <new report.json>')
+        raise SystemExit(1)
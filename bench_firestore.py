@@ -0,0 +1,95 @@
+'''
+------------------------------------------------------------------------
+Compares the bytes moved per reading by the hour document write paths,
+against the in memory stand-in in fake_firestore.py.
+
+    legacy - query the hour, download the whole lines array, append one
+             line and write the whole array back (the old update_hour_document)
+    append - firebase_admin_file.write_line. Query once per hour, then
+             array union appends with the maximums in one write.
+
+Use: python bench_firestore.py [hours]
+The append path needs firebase_admin installed (no credentials), it is
+skipped without it.
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timedelta, timezone
+from os import chdir, makedirs
+from sys import argv
+from tempfile import mkdtemp
+from time import perf_counter
+
+import fake_firestore
+from log_setup import setup_logging
+
+# readings per hour at the 18.9s interval
+READINGS_PER_HOUR = 190
+
+
+def make_line(when, k):
+    # a solar csv line like ReadingObj.get_solar_str()
+    values = ','.join(f"{40 + (k + i) % 17 + 0.25 * i:.2f}" for i in range(10))
+    return f"{when.strftime('%Y-%m-%d %H:%M:%S')},{values}"
+
+
+def legacy_write(client, date_time_utc, line, glycol_in, glycol_roof):
+    # the read-modify-write pattern update_hour_document used before
+    collection_ref = client.collection('test')
+    documents = collection_ref.where('hour', '>=', date_time_utc).where('hour', '<=', date_time_utc + timedelta(seconds=1)).get()
+    if documents:
+        doc_ref = documents[0].reference
+        doc_data = documents[0].to_dict()
+        lines = doc_data.get('lines', [])
+        lines.append(line)
+        doc_ref.update({'lines': lines})
+        doc_ref.update({'last_reading': datetime.now(timezone.utc)})
+        doc_ref.update({'glycol_in_max': max(glycol_in, doc_data.get('glycol_in_max', 0.01))})
+        doc_ref.update({'glycol_roof_max': max(glycol_roof, doc_data.get('glycol_roof_max', 0.01))})
+    else:
+        collection_ref.add({'hour': date_time_utc, 'lines': [line], 'glycol_in_max': glycol_in,
+                            'glycol_roof_max': glycol_roof, 'last_reading': datetime.now(timezone.utc)})
+
+
+def run(name, write, client, hours):
+    start_hour = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    client.reset_counters()
+    start = perf_counter()
+    for h in range(hours):
+        hour = start_hour + timedelta(hours=h)
+        for k in range(READINGS_PER_HOUR):
+            line = make_line(hour + timedelta(seconds=18.9 * k), k)
+            write(hour, line, 40.0 + k % 7, 45.0 + k % 5)
+    elapsed = perf_counter() - start
+    readings = hours * READINGS_PER_HOUR
+    print(f"{name:8} reads/reading {client.reads / readings:6.2f}  writes/reading {client.writes / readings:5.2f}  "
+          f"bytes read/reading {client.bytes_read / readings:9.0f}  bytes written/reading {client.bytes_written / readings:7.0f}  "
+          f"cpu {elapsed / readings * 1e6:7.1f} us/reading")
+
+
+def main(hours):
+    # compress_doc_data writes Output/averageDebug.csv relative to the working folder
+    work = mkdtemp(prefix='bench_firestore_')
+    makedirs(work + '/Output', exist_ok=True)
+    chdir(work)
+    setup_logging(work + '/Logs')
+
+    print(f"{hours} hour(s), {READINGS_PER_HOUR} readings per hour")
+    legacy_client = fake_firestore.FakeFirestore()
+    run('legacy', lambda hour, line, a, b: legacy_write(legacy_client, hour, line, a, b), legacy_client, hours)
+
+    try:
+        import firebase_admin_file
+    except ImportError as error:
+        print(f"{'append':8} skipped, firebase_admin not installed: {error}")
+        return
+    firebase_admin_file.db = fake_firestore.FakeFirestore()
+    state = {'ref': None}
+
+    def append_write(hour, line, glycol_in, glycol_roof):
+        state['ref'] = firebase_admin_file.write_lines(hour, [line], state['ref'], glycol_in, glycol_roof)
+
+    run('append', append_write, firebase_admin_file.db, hours)
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 2)
@@ -0,0 +1,128 @@
+'''
+------------------------------------------------------------------------
+Shape preserving downsampling of a series before it is plotted.
+There's no point drawing more points than the axes have pixels, so
+each series is cut down to about the pixel width first.
+
+    lttb   - Largest Triangle Three Buckets. Keeps the point of each
+             bucket that makes the largest triangle with its neighbours,
+             so peaks and the overall shape survive.
+    minmax - the min and the max of each bucket. Every extreme is kept.
+
+Both return indexes into the series, so the same indexes pick the
+matching timestamps. Missing values (NaN) are never picked over a real
+value. LTTB measures its triangles on the timestamps when given them,
+so a gap in the logging doesn't bend the shape it keeps.
+------------------------------------------------------------------------
+'''
+import numpy as np
+
+
+def lttb_indices(y, n_out, x=None):
+    """
+    -------------------------------------------------------
+    Returns the indexes LTTB keeps, first and last always included.
+    The loop is over output buckets, each bucket is done with numpy.
+    Use: idx = lttb_indices(values, 1000)
+    -------------------------------------------------------
+    Parameters:
+        y - series values (array)
+        n_out - points to keep, at least 3 (int)
+        x - x positions, default the index (array)
+    Returns:
+        idx - sorted indexes (ndarray of int)
+    -------------------------------------------------------
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float) if x is None else np.asarray(x, dtype=float)
+    # a missing value sits on the previous point's line so it never wins a bucket
+    filled = _fill_nan(y)
+
+    # bucket edges over every point except the first and last
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0] = 0
+    idx[-1] = n - 1
+    # average point of every bucket, the third corner of the triangle
+    starts, ends = edges[:-1], edges[1:]
+    sums_x = np.add.reduceat(x[1:n - 1], starts - 1)
+    sums_y = np.add.reduceat(filled[1:n - 1], starts - 1)
+    counts = ends - starts
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, filled[-1])
+
+    previous = 0
+    for b in range(n_out - 2):
+        start, end = starts[b], ends[b]
+        bx = x[start:end]
+        by = filled[start:end]
+        # twice the triangle area, the constant factor doesn't change the argmax
+        area = np.abs((x[previous] - avg_x[b + 1]) * (by - filled[previous])
+                      - (x[previous] - bx) * (avg_y[b + 1] - filled[previous]))
+        area[np.isnan(y[start:end])] = -1.0
+        previous = start + int(np.argmax(area))
+        idx[b + 1] = previous
+    return idx
+
+
+def minmax_indices(y, n_out):
+    """
+    -------------------------------------------------------
+    Returns the indexes of the min and max of each bucket,
+    about n_out of them. Fully vectorized.
+    Use: idx = minmax_indices(values, 1000)
+    -------------------------------------------------------
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    buckets = n_out // 2
+    if n_out >= n or buckets < 1:
+        return np.arange(n)
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    missing = np.isnan(padded)
+    lows = np.argmin(np.where(missing, np.inf, padded), axis=1)
+    highs = np.argmax(np.where(missing, -np.inf, padded), axis=1)
+    offsets = np.arange(buckets) * size
+    idx = np.concatenate(([0, n - 1], offsets + lows, offsets + highs))
+    return np.unique(idx[idx < n])
+
+
+METHODS = {'lttb': lttb_indices, 'minmax': minmax_indices}
+
+
+def downsample(y, n_out, method='lttb', x=None):
+    """
+    -------------------------------------------------------
+    Returns (indexes, values) of y cut down to about n_out points.
+    x are the positions of y, i.e. matplotlib date numbers.
+    Only lttb uses them, minmax keeps every extreme either way.
+    Use: idx, y = downsample(series, axes_width_pixels, 'lttb', x=date_numbers)
+    -------------------------------------------------------
+    """
+    y = np.asarray(y, dtype=float)
+    if method == 'lttb':
+        idx = lttb_indices(y, n_out, x)
+    else:
+        idx = METHODS[method](y, n_out)
+    return idx, y[idx]
+
+
+def _fill_nan(y):
+    # forward fill, leading NaN take the first real value
+    missing = np.isnan(y)
+    if not missing.any():
+        return y
+    if missing.all():
+        return np.zeros_like(y)
+    positions = np.where(missing, 0, np.arange(len(y)))
+    np.maximum.accumulate(positions, out=positions)
+    filled = y[positions]
+    first = np.argmax(~missing)
+    filled[:first] = y[first]
+    return filled
@@ -1,128 +1,111 @@
-from os import system
+from os import system, path as os_path
 from glob import glob
-from time import sleep, time
-from sqlite3 import connect as sqlite_connect
+from time import sleep, time, monotonic
+from sqlite3 import connect as sqlite_connect, OperationalError
 from datetime import datetime
-from firebase_admin_file import send_notification
+from notifier import FLUSH_TIMEOUT, dispatcher, send_notification
 from subprocess import call as subprocess_call
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from sqlite_storage import PLACEHOLDER, create_schema
+from sensor_registry import REGISTRY, SOLAR_GROUP
+from metrics import METRICS
+from log_setup import get_logger, fields, stop_logging
 sqlite_file_1= '/home/luke/Desktop/Script/Output/shared_data.db'
 
 HIGH_TEMP_THRESHOLD = 91.5
 
+# seconds one sensor's reads are retried within a sample. A sensor that
+# still fails is answered from LastKnownValues and read again next sample,
+# so one bad sensor never holds the sweep past the sample interval.
+RETRY_BUDGET = 3.0
+# a failing sensor is read on the next sample, then after 20, 40 .. seconds
+BACKOFF_START = 10
+BACKOFF_MAX = 300
+# reboot once a sensor that is still on the bus has failed this long, seconds
+REBOOT_AFTER = 600
+
+# queued, written by the log_setup thread. never waits on the SD card
+log = get_logger('ds18b20')
+
 class ReadingObj:
     """
     -------------------------------------------------------
     Object used to store read sensor values.
-    Contains sensor names and calibration values.
+    One slot per sensor, no per instance dict. The sensor names and
+    calibration values are class level tables, built once from sensors.json.
     -------------------------------------------------------
     """ 
-    def __init__(self):
-        self.date_time_now = time()
-        self.glycol_in_roof = 0.01 # workaround to stop None from being written
-        self.glycol_in = 0.01
-        self.glycol_out_st = 0.01
-        self.glycol_out_he = 0.01
-        self.solar_t_high = 0.01
-        self.solar_t_mid = 0.01
-        self.solar_t_low = 0.01
-        self.boiler_t_mid = 0.01
-        self.boiler_t_out = 0.01
-        self.solar_t_out = 0.01
-        self.ab = None
-        self.cd = None
-        self.ef = None
-        self.gh = None
-        self.ij = None
-        self.kl = None
-        self.mn = None
-        self.op = None
-        self.qr = None
-        self.st = None
+    # every sensor value in sensors.json order
+    FIELDS = REGISTRY.names
+    # the solar system logger sensors, the temperature table columns
+    SOLAR_FIELDS = REGISTRY.group_names(SOLAR_GROUP)
+
+    __slots__ = ('date_time_now',) + FIELDS
 
     # maps the sensors address to a variable
-        self._sensor_mapping = {
-            '7b72': 'glycol_in_roof',
-            '1e37': 'glycol_in',
-            '9e0f': 'glycol_out_st',
-            '4ee6': 'glycol_out_he',
-            'f5d6': 'solar_t_high',
-            '071a': 'solar_t_mid',
-            '839e': 'solar_t_low',
-            '1a77': 'boiler_t_mid',
-            'd995': 'boiler_t_out',
-            'f969': 'solar_t_out',
-            # new sensors. Not in use.
-            '78a2': "ab",
-            '91ed': "cd",
-            'a85c': "ef",
-            'a0b0': "gh",
-            '7bc2': "ij",
-            '317c': "kl",
-            '7176': "mn",
-            '6ebd': "op",
-            'dad9': "qr",
-            'b9fd': "st"
-            }
+    SENSOR_MAPPING = REGISTRY.mapping
 
     # sensor calibration.
-        self._adjustment_values = {
-            # original solar system sensors (2020)
-            '9e0f': 0.567,
-            '1e37': 0,
-            '839e': -0.29,
-            '4ee6': 0.35,
-            '071a': 0.552,
-            '7b72': -0.045,
-            'd995': -0.165,
-            'f5d6': 0.045,
-            'f969': -0.636,
-            '1a77': 0.142,
-            # new sensors (12/2023)
-            '78a2': -0.2788,
-            '91ed': 0.2878,
-            'a85c': -0.208,
-            'a0b0': -0.0416,
-            '7bc2': 0.2128,
-            '317c': 0.0413,
-            '7176': 0.4028,
-            '6ebd': -0.5231,
-            'dad9': 0.2513,
-            'b9fd': -0.1445}
+    ADJUSTMENT_VALUES = REGISTRY.offsets
+
+    # 0.01 is a workaround to stop None from being written for the solar sensors
+    _DEFAULTS = tuple(PLACEHOLDER if s.group == SOLAR_GROUP else None for s in REGISTRY.sensors)
+
+    # addresses on the bus that aren't in sensors.json, warned about once each
+    _unknown_addresses = set()
+
+    # older names of the tables
+    _sensor_mapping = SENSOR_MAPPING
+    _adjustment_values = ADJUSTMENT_VALUES
+
+    # bulk getters, one C level call instead of 20 attribute reads. plain callables, pass self
+    _get_fields = attrgetter(*FIELDS)
+    _get_solar = attrgetter('date_time_now', *SOLAR_FIELDS)
+
+    def __init__(self, date_time_now=None):
+        self.date_time_now = time() if date_time_now is None else date_time_now
+        for name, default in zip(self.FIELDS, self._DEFAULTS):
+            setattr(self, name, default)
+
+    def set(self, address, value):
+        '''
+        Stores the value of the sensor with this address.
+        An address that isn't in sensors.json, a new or replaced
+        probe, is skipped with a warning instead of failing the sweep.
+        '''
+        name = self.SENSOR_MAPPING.get(address)
+        if name is None:
+            if address not in self._unknown_addresses:
+                self._unknown_addresses.add(address)
+                log.warning("sensor address not in sensors.json. its values are skipped", extra=fields(address=address, value=value))
+            METRICS.inc('unknown_sensor_values')
+            return
+        setattr(self, name, value)
 
     def __iter__(self):
-        return iter([
-            self.glycol_in_roof,
-            self.glycol_in,
-            self.glycol_out_st,
-            self.glycol_out_he,
-            self.solar_t_high,
-            self.solar_t_mid,
-            self.solar_t_low,
-            self.boiler_t_mid,
-            self.boiler_t_out,
-            self.solar_t_out,
-            self.ab,
-            self.cd,
-            self.ef,
-            self.gh,
-            self.ij,
-            self.kl,
-            self.mn,
-            self.op,
-            self.qr,
-            self.st])
+        return iter(self._get_fields(self))
+
+    def as_tuple(self):
+        '''
+        Returns every sensor value in FIELDS order, without the date.
+        '''
+        return self._get_fields(self)
+
+    def as_array(self):
+        '''
+        Returns every sensor value in FIELDS order as a float array, NaN for None.
+        '''
+        from numpy import array
+        return array([float('nan') if v is None else v for v in self._get_fields(self)], dtype=float)
 
     def print_not_none(self):
         '''
         Returns a string of sensors that are not none.\n
         Useful when testing new sensors.
         '''
-        not_none_attr = {attr: getattr(self, attr) 
-            for attr in dir(self) 
-            if not callable(getattr(self, attr)) 
-            and not attr.startswith("__") 
-            and not attr.startswith("_") 
-            and getattr(self, attr) is not None}
+        not_none_attr = {'date_time_now': self.date_time_now}
+        not_none_attr.update((name, value) for name, value in zip(self.FIELDS, self._get_fields(self)) if value is not None)
         
         return ', '.join(f"{key},{value}" for key, value in not_none_attr.items())
     
@@ -131,19 +114,7 @@ class ReadingObj:
         """
         Returns a tuple with ordered data for the solar system logger.
         """
-        sensor_vals_tup = (self.date_time_now,
-        self.glycol_in_roof,
-        self.glycol_in,
-        self.glycol_out_st,
-        self.glycol_out_he,
-        self.solar_t_high,
-        self.solar_t_mid,
-        self.solar_t_low,
-        self.boiler_t_mid,
-        self.boiler_t_out,
-        self.solar_t_out)
-
-        return sensor_vals_tup
+        return self._get_solar(self)
     
     def get_solar_str(self):
         # returns a string from a tuple.
@@ -154,41 +125,61 @@ class ReadingObj:
         '''
         To String
         '''
-        return (
-            f"glycol_in_roof: {self.glycol_in_roof}, "
-            f"glycol_in: {self.glycol_in}, "
-            f"glycol_out_st: {self.glycol_out_st}, "
-            f"glycol_out_he: {self.glycol_out_he}, "
-            f"solar_t_high: {self.solar_t_high}, "
-            f"solar_t_mid: {self.solar_t_mid}, "
-            f"solar_t_low: {self.solar_t_low}, "
-            f"boiler_t_mid: {self.boiler_t_mid}, "
-            f"boiler_t_out: {self.boiler_t_out}, "
-            f"solar_t_out: {self.solar_t_out}, "
-            f"ab: {self.ab}, "
-            f"cd: {self.cd}, "
-            f"ef: {self.ef}, "
-            f"gh: {self.gh}, "
-            f"ij: {self.ij}, "
-            f"kl: {self.kl}, "
-            f"mn: {self.mn}, "
-            f"op: {self.op}, "
-            f"qr: {self.qr}, "
-            f"st: {self.st}")
+        return ', '.join(f"{name}: {value}" for name, value in zip(self.FIELDS, self._get_fields(self)))
     
     # ordered list of sensor names for solar system logger 
-    SENSOR_NAMES = [
-        'Date',
-        'glycol_in_roof',
-        'glycol_in',
-        'glycol_out_st',
-        'glycol_out_he',
-        'solar_t_high',
-        'solar_t_mid',
-        'solar_t_low',
-        'boiler_t_mid',
-        'boiler_t_out',
-        'solar_t_out']
+    SENSOR_NAMES = ['Date'] + list(SOLAR_FIELDS)
+
+
+class LastKnownValues:
+    """
+    -------------------------------------------------------
+    In memory cache of the last good value of each sensor.
+    Fed by read_sensors. A failed read is answered from here
+    and the db is only used on a cold start.
+    Also keeps the failures of each sensor, so a sensor that keeps
+    failing is read less often instead of being retried in a loop.
+    Use: value = last_known_values.get(device_name)
+    -------------------------------------------------------
+    """
+    def __init__(self):
+        # device name -> value
+        self._values = dict()
+        # device name -> [failed reads in a row, monotonic time of the first, time of the next read]
+        self._failures = dict()
+
+    def update(self, device_name, value):
+        if value is not None:
+            self._values[device_name] = value
+
+    def get(self, device_name):
+        return self._values.get(device_name)
+
+    def failed(self, device_name):
+        """
+        -------------------------------------------------------
+        Records a failed read and backs the sensor off.
+        Returns (failed reads in a row, seconds since the first of them)
+        -------------------------------------------------------
+        """
+        now = monotonic()
+        failure = self._failures.setdefault(device_name, [0, now, now])
+        failure[0] += 1
+        failure[2] = now + min(BACKOFF_START * 2 ** (failure[0] - 1), BACKOFF_MAX)
+        return failure[0], now - failure[1]
+
+    def recovered(self, device_name):
+        # clears the failures. returns the failed reads in a row before this one
+        failure = self._failures.pop(device_name, None)
+        return 0 if failure is None else failure[0]
+
+    def backing_off(self, device_name):
+        # True while a failing sensor waits for its next read
+        failure = self._failures.get(device_name)
+        return failure is not None and monotonic() < failure[2]
+
+# shared by the sensor worker threads. dict get/set is atomic.
+last_known_values = LastKnownValues()
 
 
 class DS18B20:
@@ -210,22 +201,102 @@ class DS18B20:
      You can connect more than one sensor to the same set of pins.
      Only one pullup resistor is required.
     '''
-    def __init__(self):
+    # the kernel modules only need to be loaded once per process
+    _modules_loaded = False
+
+    def __init__(self, base_dir='/sys/bus/w1/devices/', rescan_interval=300, load_modules=True):
+        """
+        -------------------------------------------------------
+        Long lived handle to the 1-Wire bus. Create it once and call
+        refresh() before each sweep to pick up added or removed sensors.
+        -------------------------------------------------------
+        Parameters:
+            base_dir - sysfs folder holding the w1 devices (str)
+            rescan_interval - seconds between device table rescans (float)
+            load_modules - run modprobe for the w1 drivers (bool)
+        -------------------------------------------------------
+        """
         # load required kernel modules
-        system('/usr/sbin/modprobe w1-gpio')
-        system('/usr/sbin/modprobe w1-therm')     
-        # Find file names for the sensor(s)
-        base_dir = '/sys/bus/w1/devices/'
-        device_folder = glob(base_dir + '28*')
-                
+        if load_modules and not DS18B20._modules_loaded:
+            system('/usr/sbin/modprobe w1-gpio')
+            system('/usr/sbin/modprobe w1-therm')
+            DS18B20._modules_loaded = True
+        self._base_dir = base_dir
+        self._rescan_interval = rescan_interval
+        self._last_scan = 0
+        self._rescan_needed = False
+        # bus masters do not come and go, find them once.
+        self._master_folder = sorted(glob(base_dir + 'w1_bus_master*'))
+        self.device_folder = list()
+        self._device_file = list()
+        self._num_devices = 0
+        # master folder -> indexes of the devices on that master
+        self._masters = dict()
+        # master folder -> False once therm_bulk_read is found to be unsupported
+        self._bulk_supported = dict()
+        # worker pool for concurrent reads. created on first use.
+        self._pool = None
+        self._pool_workers = 0
+        self.rescan()
+
+    def rescan(self):
+        """
+        -------------------------------------------------------
+        Rebuilds the cached device table.
+        Reads each master's w1_master_slaves list which is much cheaper
+        than globbing the devices folder. Falls back to the glob when
+        no bus master is found.
+        Use: changed = sensor_obj.rescan()
+        -------------------------------------------------------
+        Returns:
+            changed - True if sensors were added or removed (bool)
+        -------------------------------------------------------
+        """
+        device_folder = list()
+        masters = dict()
+        for master in self._master_folder:
+            try:
+                with open(master + '/w1_master_slaves', 'r') as f:
+                    slaves = [line.strip() for line in f if line.startswith('28')]
+            except OSError:
+                continue
+            masters[master] = list(range(len(device_folder), len(device_folder) + len(slaves)))
+            device_folder.extend(self._base_dir + slave for slave in slaves)
+
+        if not masters:
+            device_folder = sorted(glob(self._base_dir + '28*'))
+            masters[self._base_dir] = list(range(len(device_folder)))
+
+        changed = device_folder != self.device_folder
+        if changed and self._last_scan != 0:
+            added = set(device_folder) - set(self.device_folder)
+            removed = set(self.device_folder) - set(device_folder)
+            log.info("device table changed", extra=fields(added=sorted(added), removed=sorted(removed)))
+
         self.device_folder = device_folder
+        self._device_file = [folder + '/w1_slave' for folder in device_folder]
         self._num_devices = len(device_folder)
-        self._device_file = list()
-        i = 0
-        while i < self._num_devices:
-            self._device_file.append(device_folder[i] + '/w1_slave')
-            i += 1
-        
+        self._masters = masters
+        self._last_scan = monotonic()
+        self._rescan_needed = False
+        return changed
+
+    def refresh(self):
+        """
+        -------------------------------------------------------
+        Rescans the bus if the rescan interval has passed or a read failed
+        since the last scan. Call this between sweeps, never during one,
+        because a rescan can change device indexes.
+        Use: sensor_obj.refresh()
+        -------------------------------------------------------
+        Returns:
+            changed - True if sensors were added or removed (bool)
+        -------------------------------------------------------
+        """
+        if self._rescan_needed or (monotonic() - self._last_scan) >= self._rescan_interval:
+            return self.rescan()
+        return False
+
     def _read_temp(self,index):
         # Issue one read to one sensor
         # you should not call this directly
@@ -234,95 +305,169 @@ class DS18B20:
             f = open(self._device_file[index],'r')
         except:
             # getting around FileNotFoundError preventing the retries in get_tempC
-            log_event(f"FileNotFoundError for index {index}")
+            log.warning("w1_slave file not found", extra=fields(index=index))
+            # sensor may have been unplugged. rescan before the next sweep.
+            self._rescan_needed = True
             return []
         lines = f.readlines()
         f.close()
         return lines
         
-    def get_tempC(self,index = 0):
+    def get_tempC(self, index=0, budget=None):
         """
         -------------------------------------------------------
-        Returns the value for a sensor.
-        Returns 998 or 999 if the read failed. 
+        Returns the calibrated value of a sensor.
+        An empty file, a failed CRC ('NO') or a value out of range
+        is read again until budget seconds have passed.
+        Never sleeps past the budget and never reboots, read_sensor
+        handles a sensor that keeps failing.
         Use: s_value = sensor_obj.get_tempC(i)
         -------------------------------------------------------
         Parameters:
-            i - index of the element to access (int)
+            index - index of the sensor (int)
+            budget - seconds retries may take, default RETRY_BUDGET (float)
         Returns:
-            value - a float value for temperature (float)
+            value - a float value for temperature, None if the read failed (float)
         -------------------------------------------------------
         """
-        # read sensor temperature in degrees C
-        lines = self._read_temp(index)
-        retries = 12
-        interval = 2
-        # read failed. sensor file is empty. Try again.
-        if len(lines) == 0:                        
-            # retry a few times before giving up
-            while (len(lines) == 0) and (retries > 0):                
-                sleep(interval)
-                interval += 2
-                retries -= 1
-                lines = self._read_temp(index)
-                log_event("list len {} | failed index {}    read retried.  retries remaining {}".format(str(len(lines)),str(index),str(retries)))
-                if (retries <= 0):
-                    send_notification('debug','read failed',f'{datetime.now().strftime("%a %I:%M %p")} Index {index}. retries remaining {str(retries)}')
-            # read failed
-            if len(lines) == 0:
-                    log_event("get_tempC read FAILED")  
-                    #----------------  
-                    # attempt to prevent None from being written
-                    try:
-                        send_notification('debug', 'error', f'Rebooting @ {datetime.now().strftime("%a %I:%M %p")}. Sensor Failed to read.')
-                    except:
-                        log_event(f"Failed to send notification")
-                        pass
-                    sleep(60)
-                    log_event(f"Rebooting. Sensor Failed to read. Ultimate failure")
-                    subprocess_call('sudo reboot', shell=True)
-                    #-----------------
-                    #return None
-        
-        retries = 10
-        while (lines[0].strip()[-3:] != 'YES') and (retries > 0):
-            # read failed so try again
-            log_event(" file is not empty but 'YES' not found. trying again.  retries: {}".format(str(retries)))
+        budget = RETRY_BUDGET if budget is None else budget
+        deadline = monotonic() + budget
+        while True:
             lines = self._read_temp(index)
-            retries -= 1
-            
-        if retries == 0:
-            # error
+            if len(lines) == 0:
+                # read failed. sensor file is empty.
+                kind = 'empty'
+            elif len(lines) < 2 or lines[0].strip()[-3:] != 'YES':
+                kind = 'crc'
+            else:
+                equals_pos = lines[1].find('t=')
+                if equals_pos == -1:
+                    kind = 'crc'
+                else:
+                    temp = float(lines[1][equals_pos + 2:]) / 1000
+                    # avoid recording nonsensical values. sensor can read -55 to 125.
+                    if -60 <= temp <= 150:
+                        return calibration(self.device_folder[index][-4:], temp)
+                    kind = 'out_of_range'
+                    log.warning("nonsense temp value encountered", extra=fields(index=index, temp=temp))
+
+            if monotonic() >= deadline:
+                log.warning("get_tempC read FAILED. retried until the budget ran out", extra=fields(index=index, kind=kind, budget=budget))
+                return None
+            METRICS.inc('read_retries', kind=kind)
+            log.warning("read failed. trying again", extra=fields(index=index, kind=kind))
+
+    def bulk_read(self, timeout=1.5):
+        """
+        -------------------------------------------------------
+        Starts one simultaneous conversion on every bus master through
+        the w1-therm therm_bulk_read file, waits for it to finish and
+        collects each device's temperature file. The per device 0.25s
+        sleep and 750ms conversion are paid once per master instead of
+        once per sensor.
+        Masters without therm_bulk_read (older kernels) are skipped and
+        remembered so the caller can fall back to get_tempC.
+        Use: values = sensor_obj.bulk_read()
+        -------------------------------------------------------
+        Parameters:
+            timeout - seconds to wait for the conversion (float)
+        Returns:
+            values - {index: calibrated temperature} for the sensors
+                     that were read. Missing indexes need get_tempC. (dict)
+        -------------------------------------------------------
+        """
+        triggered = list()
+        for master in self._masters:
+            if not self._bulk_supported.get(master, True):
+                continue
+            bulk_file = master + '/therm_bulk_read'
+            try:
+                if not os_path.exists(bulk_file):
+                    raise FileNotFoundError(bulk_file)
+                with open(bulk_file, 'w') as f:
+                    f.write('trigger\n')
+            except OSError:
+                log.info("therm_bulk_read not supported. using per device reads", extra=fields(master=master))
+                self._bulk_supported[master] = False
+                continue
+            self._bulk_supported[master] = True
+            triggered.append(master)
+
+        values = dict()
+        deadline = monotonic() + timeout
+        for master in triggered:
+            bulk_file = master + '/therm_bulk_read'
+            # -1 while at least one sensor is still converting
+            while self._read_lines(bulk_file)[:1] == ['-1\n'] and monotonic() < deadline:
+                sleep(0.05)
+            for index in self._masters[master]:
+                temp = self._read_temperature_file(index)
+                if temp is not None:
+                    values[index] = temp
+        return values
+
+    def _read_temperature_file(self, index):
+        # Reads the last converted value of one sensor. None if it can't be used.
+        lines = self._read_lines(self.device_folder[index] + '/temperature')
+        try:
+            temp = float(lines[0]) / 1000
+        except (IndexError, ValueError):
             return None
-            
-        equals_pos = lines[1].find('t=')
-        if equals_pos != -1:
-            temp = lines[1][equals_pos + 2:]
-            temp = float(temp)/1000
-            device_name = self.device_folder[index][-4:]
-            temp = calibration(device_name,temp)
-            #print(temp)
-            
-            # avoid recording nonsensical values.
-            # TODO keep a running average and use that instead of this. 
-            # problem is with fast temp swings such as when system turns on or water turns on. 
-            # sensor can read -55 to 125.
-            
-            # FIXME this is not a good place to check for this.
-            # could lead to infinite loop. hasnt happened yet
-            if (temp < -60) or (temp > 150):
-                sleep(2)
-                log_event(f"nonsense temp value encountered at {device_name} and {temp}")
-                # retry
-                temp = self.get_tempC(index)
-            return temp
-        else:
-            # error
+        # sensor can read -55 to 125.
+        if (temp < -60) or (temp > 150):
             return None
-            
+        return calibration(self.get_device_name(index), temp)
+
+    def _read_lines(self, file_name):
+        # returns the lines of a sysfs file or an empty list
+        try:
+            with open(file_name, 'r') as f:
+                return f.readlines()
+        except OSError:
+            return []
+
     def device_count(self):
         # call this to see how many sensors have been detected
         return self._num_devices
+
+    def read_order(self, num_of_sensors):
+        """
+        -------------------------------------------------------
+        Returns sensor indexes interleaved across bus masters so
+        concurrent reads are spread over every master.
+        i.e. masters [0,1,2] and [3,4] give [0,3,1,4,2]
+        -------------------------------------------------------
+        """
+        groups = [[i for i in indexes if i < num_of_sensors] for indexes in self._masters.values()]
+        order = list()
+        depth = max((len(group) for group in groups), default=0)
+        for k in range(depth):
+            order.extend(group[k] for group in groups if k < len(group))
+        return order
+
+    def map_devices(self, func, num_of_sensors, max_workers):
+        """
+        -------------------------------------------------------
+        Calls func(index) for each sensor using a pool of worker threads.
+        Reads are grouped per bus master and submitted round robin so one
+        slow master does not hold up the others. The pool is kept between sweeps.
+        Use: results = sensor_obj.map_devices(func, num_of_sensors, 4)
+        -------------------------------------------------------
+        Parameters:
+            func - function taking a sensor index
+            num_of_sensors - number of sensors to read (int)
+            max_workers - number of worker threads (int)
+        Returns:
+            results - list of func results in index order (list)
+        -------------------------------------------------------
+        """
+        if self._pool is None or self._pool_workers != max_workers:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='w1')
+            self._pool_workers = max_workers
+        futures = {i: self._pool.submit(func, i) for i in self.read_order(num_of_sensors)}
+        return [futures[i].result() for i in sorted(futures)]
     
     def get_device_name(self, i):
         # Return the devices ids last 4 characters 
@@ -359,22 +504,13 @@ def file_check(file_name):
 def write_to_sql_lite(db_location, sensor_values):
     '''
     db_location - (string) location of sql_lite db \n
-    sensor_values - (tuple) Sensor values
+    sensor_values - (tuple) Sensor values \n
+    Opens and commits on every call. The logger uses sqlite_storage.SQLiteWriter.
+    Goes through the temperature view, its trigger stores the date as epoch seconds.
     '''
     conn = sqlite_connect(db_location)
     c = conn.cursor()
-    c.execute(f"""CREATE TABLE IF NOT EXISTS "temperature" (
-        "{ReadingObj.SENSOR_NAMES[0]}" DATETIME NULL,
-        "{ReadingObj.SENSOR_NAMES[1]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[2]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[3]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[4]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[5]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[6]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[7]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[8]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[9]}" INTEGER NULL,
-        "{ReadingObj.SENSOR_NAMES[10]}" INTEGER NULL)""")
+    create_schema(conn, ReadingObj.SENSOR_NAMES)
     c.execute("INSERT INTO temperature VALUES(?,?,?,?,?,?,?,?,?,?,?)", sensor_values)
     conn.commit()
     conn.close()
@@ -383,21 +519,27 @@ def write_to_sql_lite(db_location, sensor_values):
 def get_last_known_value_sql(db_location, index):
     '''
     When sensor fails to read, retrieve last value from db to prevent None from being written to db.
+    index - position of the column in ReadingObj.SENSOR_NAMES \n
+    Reads the last row of samples by its "ts" key, it does not scan the whole table.
+    Returns None when the db can't be read, a failed read must not stop the sweep.
     '''
-    conn = sqlite_connect(db_location)
-    c = conn.cursor()
     column_name = ReadingObj.SENSOR_NAMES[index]
-    c.execute(f'SELECT {column_name} from temperature ORDER BY "Date" DESC LIMIT 1;')
-    result = c.fetchone()    
-    conn.commit()
-    conn.close()
+    try:
+        conn = sqlite_connect(db_location)
+        try:
+            result = conn.execute(f'SELECT {column_name} from samples ORDER BY "ts" DESC LIMIT 1;').fetchone()
+        finally:
+            conn.close()
+    except OperationalError as error:
+        log.error("Failed to retrieve from DB", extra=fields(db=db_location, error=error))
+        return None
     if result:
         return result[0]
     else:
-        log_event("Failed to retrieve from DB")
+        log.error("Failed to retrieve from DB")
         return None
 
-def read_sensors(sensor_obj, previousReadingObj, date_time_now, num_of_sensors, ROUNDING):
+def read_sensors(sensor_obj, previousReadingObj, date_time_now, num_of_sensors, ROUNDING, max_workers=1, bulk=False):
     '''
     -------------------------------------------------------
     sensor_obj - (DS18B20 object)
@@ -405,81 +547,115 @@ def read_sensors(sensor_obj, previousReadingObj, date_time_now, num_of_sensors,
     previousReadingObj - last reading incase of failure.
     num_of_sensors - preset number of connceted sensors
     ROUNDING - value to round to
+    max_workers - number of sensors read at the same time. 1 reads them one by one.
+    bulk - start one conversion per bus master and read all sensors from it.
+           sensors the bulk read missed are read one by one.
     -------------------------------------------------------
     Returns - ReadingObj
     '''
-    reading_obj = ReadingObj()
-    reading_obj.date_time_now = date_time_now
-    RETRIES = 5
+    reading_obj = ReadingObj(date_time_now)
+    prefetched = dict()
+    if bulk:
+        with METRICS.timer('bulk_read'):
+            prefetched = sensor_obj.bulk_read()
+        # sensors the bulk read missed are read one by one
+        METRICS.inc('bulk_misses', max(0, num_of_sensors - len(prefetched)))
     # read each sensor
     #print(f"{num_of_sensors}")
-    i = 0
-    while i < num_of_sensors:
-        # get sensor name and value
-        s_name = sensor_obj.get_device_name(i)
-        s_value = sensor_obj.get_tempC(i)
-        
-                    # Overheating notification
-        # get a second reading beore sending a notification
-        if (s_value > HIGH_TEMP_THRESHOLD):
-            s_value = sensor_obj.get_tempC(i)
-            if (s_value > HIGH_TEMP_THRESHOLD):
-                send_notification('hot','Temperature limit exceeded', f"{reading_obj._sensor_mapping[s_name]} reported {round(s_value, ROUNDING)} C")
-        #print (f"{i+1} {reading_obj._sensor_mapping[s_name]} {s_value}")
-        if s_value is not None:
-            # temp read succesfully
-            s_value = round(s_value, ROUNDING) 
-        else:
-            # read failed
-            log_event("Sensor read FAILED.  previousReadingObj is None. Fetching from DB ")
-            s_value = get_last_known_value_sql(sqlite_file_1, i)
-            log_event(f"retrieved from DB  {s_name} = {s_value}")  
-            # if previousReadingObj is not None:
-            #     # get value from previous value held in memory          
-            #     s_value = getattr(previousReadingObj, previousReadingObj._sensor_mapping[s_name])
-            #     log_event("Sensor read FAILED.  Retrieving last known temperature of {}  {}".format(previousReadingObj._sensor_mapping[s_name], s_value))
-            # else:
-            #     log_event("Sensor read FAILED.  previousReadingObj is None. Fetching from DB ")
-            #     s_value = get_last_known_value_sql(sqlite_file_1, i)
-            #     log_event(f"retrieved from DB  {s_name} = {s_value}")                
-
-        
-        # if its still None for some reason
-        if s_value is None:
-            # still failed, try again .
-            j = 0
-            while s_value is None and j < RETRIES:
-                log_event("Sensor read FAILED.  Retrying read again ")
-                sleep(10)
-                s_value = sensor_obj.get_tempC(i)
-                j += 1
-                
-            if s_value is None:
-                # Ultimate failure. Reboot.
-                # FIXME  Handle all read errors in one place.  logging is now broken.
-                try:
-                    send_notification('debug', 'error', f'Reboot @ {datetime.now().strftime("%a %I:%M %p")}. Ultimate sensor read failure.')
-                except:
-                    log_event(f"Failed to send notification")
-                    pass
-                sleep(60)
-                log_event(f"Rebooting. Sensor Failed to read. Ultimate failure")
-                subprocess_call('sudo reboot', shell=True)
+    if max_workers > 1:
+        results = sensor_obj.map_devices(lambda i: read_sensor(sensor_obj, i, ROUNDING, prefetched.get(i)), num_of_sensors, max_workers)
+    else:
+        results = [read_sensor(sensor_obj, i, ROUNDING, prefetched.get(i)) for i in range(num_of_sensors)]
 
+    for s_name, s_value in results:
         # set the correct variable in reading object
-        #print (f'{i} {reading_obj._sensor_mapping[s_name]} = {s_value}')
+        #print (f'{i} {ReadingObj.SENSOR_MAPPING[s_name]} = {s_value}')
         if s_value is None:
-            send_notification('debug', 'error', f'NULL got through {datetime.now().strftime("%a %I:%M %p")}')
-        setattr(reading_obj, reading_obj._sensor_mapping[s_name], s_value)
-        i += 1      
-        #print(reading_obj._sensor_mapping[s_name], " ", s_value)
+            # failed with nothing to fall back on, the default (0.01 for solar sensors) stays
+            continue
+        reading_obj.set(s_name, s_value)
     return reading_obj
+
+def read_sensor(sensor_obj, i, ROUNDING, s_value=None):
+    '''
+    -------------------------------------------------------
+    Reads one sensor. Handles the overheating notification and read failures.
+    Safe to call from a worker thread.
+    A failed read returns at once with the last known value, or None
+    when there is none. The sensor is read again on the next sample and
+    backs off while it keeps failing. After REBOOT_AFTER seconds of
+    failures the Pi is rebooted.
+    -------------------------------------------------------
+    sensor_obj - (DS18B20 object)
+    i - index of the sensor
+    ROUNDING - value to round to
+    s_value - value already collected by a bulk read. None reads the sensor.
+    -------------------------------------------------------
+    Returns - (device name, value)
+    '''
+    # get sensor name and value
+    s_name = sensor_obj.get_device_name(i)
+    backing_off = s_value is None and last_known_values.backing_off(s_name)
+    if s_value is None and not backing_off:
+        with METRICS.timer('get_tempc'):
+            s_value = sensor_obj.get_tempC(i)
+
+    # Overheating notification
+    # get a second reading beore sending a notification
+    if s_value is not None and s_value > HIGH_TEMP_THRESHOLD:
+        s_value = sensor_obj.get_tempC(i)
+        if s_value is not None and s_value > HIGH_TEMP_THRESHOLD:
+            send_notification('hot','Temperature limit exceeded', f"{ReadingObj.SENSOR_MAPPING.get(s_name, s_name)} reported {round(s_value, ROUNDING)} C", key=s_name)
+    #print (f"{i+1} {s_name} {s_value}")
+    if s_value is not None:
+        # temp read succesfully
+        s_value = round(s_value, ROUNDING) 
+        last_known_values.update(s_name, s_value)
+        failed_reads = last_known_values.recovered(s_name)
+        if failed_reads:
+            log.info("Sensor read again after failing", extra=fields(sensor=s_name, failed_reads=failed_reads))
+        return s_name, s_value
+
+    if not backing_off:
+        failed_reads, failing_for = last_known_values.failed(s_name)
+        METRICS.inc('read_retries', kind='failed')
+        log.warning("Sensor read FAILED. Read again on a later sample", extra=fields(sensor=s_name, failed_reads=failed_reads, failing_for=round(failing_for)))
+        if failed_reads == 1:
+            send_notification('debug', 'read failed', f'{datetime.now().strftime("%a %I:%M %p")} {ReadingObj.SENSOR_MAPPING.get(s_name, s_name)} failed to read.', key=s_name)
+        if failing_for >= REBOOT_AFTER:
+            # Ultimate failure. Reboot.
+            METRICS.inc('reboots', reason='sensor_read_failure')
+            send_notification('debug', 'error', f'Reboot @ {datetime.now().strftime("%a %I:%M %p")}. {s_name} failed to read for {failing_for / 60:.0f} minutes.', key='reboot')
+            log.critical("Rebooting. Sensor Failed to read. Ultimate failure", extra=fields(sensor=s_name, failed_reads=failed_reads))
+            dispatcher.flush(FLUSH_TIMEOUT)
+            stop_logging()
+            subprocess_call('sudo reboot', shell=True)
+
+    # read failed or skipped while backing off
+    s_value = last_known_values.get(s_name)
+    if s_value is not None:
+        METRICS.inc('recoveries', source='memory')
+        log.warning("Sensor read FAILED. Retrieved last known value from memory", extra=fields(sensor=s_name, value=s_value))
+    else:
+        # cold start. nothing in memory yet.
+        log.warning("Sensor read FAILED. No last known value in memory. Fetching from DB")
+        column_name = ReadingObj.SENSOR_MAPPING.get(s_name)
+        if column_name in ReadingObj.SENSOR_NAMES:
+            s_value = get_last_known_value_sql(sqlite_file_1, ReadingObj.SENSOR_NAMES.index(column_name))
+        if s_value is not None:
+            METRICS.inc('recoveries', source='db')
+            # the next failure is answered from memory
+            last_known_values.update(s_name, s_value)
+        log.info("retrieved from DB", extra=fields(sensor=s_name, value=s_value))
+
+    return s_name, s_value
     
 def calibration(name, temp_c):
     """
     -------------------------------------------------------
     Returns the calibrated value for a sensor.
     Calibration values are hardcoded from previous testing. 
+    A sensor that isn't in sensors.json is not calibrated.
     Use: value = calibration(device_name,value)
     -------------------------------------------------------
     Parameters:
@@ -489,19 +665,6 @@ def calibration(name, temp_c):
         temp_c - a float value for temperature (float)
     -------------------------------------------------------
     """ 
-    readingObj = ReadingObj()
-    temp_c += readingObj._adjustment_values[name]
+    temp_c += ReadingObj.ADJUSTMENT_VALUES.get(name, 0)
     
     return temp_c
-
-def log_event(message):
-    """
-    -------------------------------------------------------
-    Writes a message to log file.
-    Use: log_event("errors.txt", "my error")
-    -------------------------------------------------------
-    """ 
-    with open("/home/luke/Desktop/Script/Logs/errors_ds18b20.txt", 'a') as output_file:
-        output_file.write(f"{str(datetime.now())}  {message}\n")
-    output_file.close()
-    return
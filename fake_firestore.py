@@ -0,0 +1,370 @@
+'''
+------------------------------------------------------------------------
+In memory stand-in for the parts of the Firestore client the logger uses.
+Counts reads, writes and the bytes each one would move so write paths
+can be compared off the Pi, without credentials or a network.
+
+Use:
+    import firebase_admin_file, fake_firestore
+    firebase_admin_file.db = fake_firestore.FakeFirestore()
+    firebase_admin_file.messaging = fake_firestore.FakeMessaging()
+
+Byte counts are the size of the JSON encoded payload. Not the exact
+Firestore wire size, but close enough to compare two write paths.
+
+Set client.offline = True to act like an outage: every read, query,
+write and commit raises until it is set back.
+------------------------------------------------------------------------
+'''
+from datetime import datetime
+from json import dumps
+from operator import eq, ge, gt, le, lt, ne
+from uuid import uuid4
+
+OPERATORS = {'==': eq, '!=': ne, '<': lt, '<=': le, '>': gt, '>=': ge}
+# FieldPath.document_id(), orders by the document id
+DOCUMENT_ID = '__name__'
+
+
+def payload_size(data):
+    # approximate bytes on the wire for a document or update
+    return len(dumps(data, default=_encode))
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if type(value).__name__ in ('ArrayUnion', 'ArrayRemove'):
+        return list(value.values)
+    return str(value)
+
+
+class ArrayUnion:
+    """
+    Same shape as google.cloud.firestore.ArrayUnion.
+    """
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+    def get(self, field):
+        return self._data.get(field)
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def _client(self):
+        return self._collection._client
+
+    def get(self, transaction=None):
+        data = self._collection._docs.get(self.id)
+        self._client._count_read(data)
+        return FakeSnapshot(self, None if data is None else _copy(data))
+
+    def set(self, data):
+        self._client._count_write(data)
+        self._collection._docs[self.id] = _copy(data)
+
+    def update(self, data):
+        if self.id not in self._collection._docs:
+            self._client.not_found(self.id)
+        self._client._count_write(data)
+        doc = self._collection._docs[self.id]
+        for field, value in data.items():
+            if type(value).__name__ == 'ArrayUnion':
+                current = list(doc.get(field, []))
+                current.extend(v for v in value.values if v not in current)
+                doc[field] = current
+            else:
+                doc[field] = _copy(value)
+
+    def delete(self):
+        self._client.check_online()
+        self._client.deletes += 1
+        self._collection._docs.pop(self.id, None)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), order=(), limit=None, start_after=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = list(order)
+        self._limit = limit
+        self._start_after = start_after
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        filters = self._filters + _flatten(filter) if filter is not None else self._filters + [(field_path, op_string, value)]
+        return FakeQuery(self._collection, filters, self._order, self._limit, self._start_after)
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return FakeQuery(self._collection, self._filters, self._order + [(field_path, direction)],
+                         self._limit, self._start_after)
+
+    def limit(self, count):
+        return FakeQuery(self._collection, self._filters, self._order, count, self._start_after)
+
+    def start_after(self, values):
+        # a snapshot, a dict of fields, or the value of a single order_by
+        return FakeQuery(self._collection, self._filters, self._order, self._limit, values)
+
+    def get(self, transaction=None):
+        self._collection._client.check_online()
+        matches = list()
+        for doc_id, data in self._collection._docs.items():
+            if all(field in data and OPERATORS[op](data[field], value) for field, op, value in self._filters):
+                matches.append((doc_id, data))
+        if self._order:
+            # one direction for every field, like the composite indexes the logger uses
+            descending = self._order[0][1] == 'DESCENDING'
+            fields = [field for field, _direction in self._order]
+            matches.sort(key=lambda item: _order_key(fields, *item), reverse=descending)
+            if self._start_after is not None:
+                after = _cursor(fields, self._start_after)
+                if descending:
+                    matches = [m for m in matches if _order_key(fields, *m) < after]
+                else:
+                    matches = [m for m in matches if _order_key(fields, *m) > after]
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        client = self._collection._client
+        client.queries += 1
+        snapshots = list()
+        for doc_id, data in matches:
+            client._count_read(data)
+            snapshots.append(FakeSnapshot(FakeDocumentReference(self._collection, doc_id), _copy(data)))
+        return snapshots
+
+    def stream(self, transaction=None):
+        return iter(self.get())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+        self._docs = dict()
+        super().__init__(self)
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self, doc_id or uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return datetime.now(), ref
+
+
+class FakeBatch:
+    """
+    Write batch. Operations are applied on commit.
+    """
+    def __init__(self, client):
+        self._client = client
+        self._ops = list()
+
+    def delete(self, ref):
+        self._ops.append(ref.delete)
+
+    def update(self, ref, data):
+        self._ops.append(lambda: ref.update(data))
+
+    def set(self, ref, data):
+        self._ops.append(lambda: ref.set(data))
+
+    def commit(self):
+        self._client.check_online()
+        self._client.commits += 1
+        for op in self._ops:
+            op()
+        self._ops = list()
+        return []
+
+
+class FakeTransaction(FakeBatch):
+    """
+    Enough of google.cloud.firestore.Transaction for @firestore.transactional.
+    Runs once, there is never contention.
+    """
+    _max_attempts = 1
+    _read_only = False
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._id = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def _clean_up(self):
+        self._ops = list()
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._id = uuid4().bytes
+
+    def _commit(self):
+        result = self.commit()
+        self._clean_up()
+        return result
+
+    def _rollback(self):
+        self._clean_up()
+
+
+class FakeFirestore:
+    """
+    -------------------------------------------------------
+    Stand-in for firestore.client().
+    Counters: reads, writes, queries, deletes, commits,
+              bytes_read, bytes_written
+    -------------------------------------------------------
+    """
+    def __init__(self):
+        self._collections = dict()
+        # True acts like an outage
+        self.offline = False
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+        self.deletes = 0
+        self.commits = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def collection(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def not_found(self, doc_id):
+        # raise the same error the real client raises when it is installed
+        try:
+            from google.api_core.exceptions import NotFound
+        except ImportError:
+            raise KeyError(doc_id)
+        raise NotFound(f"No document to update: {doc_id}")
+
+    def check_online(self):
+        # raise the error the real client gives when the service can't be reached
+        if not self.offline:
+            return
+        try:
+            from google.api_core.exceptions import ServiceUnavailable
+        except ImportError:
+            raise ConnectionError("firestore unavailable")
+        raise ServiceUnavailable("firestore unavailable")
+
+    def _count_read(self, data):
+        self.check_online()
+        self.reads += 1
+        self.bytes_read += payload_size(data) if data is not None else 0
+
+    def _count_write(self, data):
+        self.check_online()
+        self.writes += 1
+        self.bytes_written += payload_size(data)
+
+
+class FakeMessaging:
+    """
+    -------------------------------------------------------
+    Stand-in for the firebase_admin.messaging module.
+    Keeps every message sent.
+    Counters: sends (calls), messages, bytes_sent
+    -------------------------------------------------------
+    """
+    class Notification:
+        def __init__(self, title=None, body=None):
+            self.title = title
+            self.body = body
+
+    class Message:
+        def __init__(self, notification=None, topic=None, data=None):
+            self.notification = notification
+            self.topic = topic
+            self.data = data
+
+    def __init__(self):
+        self.sent = list()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.sends = 0
+        self.messages = 0
+        self.bytes_sent = 0
+
+    def send(self, message):
+        self.send_each([message])
+        return f"projects/fake/messages/{uuid4().hex}"
+
+    def send_each(self, messages):
+        self.sends += 1
+        for message in messages:
+            self.messages += 1
+            self.bytes_sent += payload_size({'topic': message.topic, 'title': message.notification.title,
+                                             'body': message.notification.body})
+            self.sent.append(message)
+
+    def send_notifications(self, notifications):
+        # sender for notifier.NotificationDispatcher, like firebase_admin_file.send_notifications
+        self.send_each([self.Message(notification=self.Notification(title=title, body=body), topic=topic)
+                        for topic, title, body in notifications])
+
+
+def _flatten(filter):
+    # BaseCompositeFilter('AND', [FieldFilter, ...]) or a single FieldFilter
+    if hasattr(filter, 'filters'):
+        flat = list()
+        for inner in filter.filters:
+            flat.extend(_flatten(inner))
+        return flat
+    return [(filter.field_path, filter.op_string, filter.value)]
+
+
+def _order_key(fields, doc_id, data):
+    return tuple(doc_id if field == DOCUMENT_ID else data[field] for field in fields)
+
+
+def _cursor(fields, start_after):
+    # start_after values in the order of the order_by fields
+    if isinstance(start_after, FakeSnapshot):
+        return _order_key(fields, start_after.id, start_after.to_dict())
+    if isinstance(start_after, dict):
+        return tuple(start_after[field] for field in fields)
+    return (start_after,)
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return list(value)
+    return value
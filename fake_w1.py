@@ -0,0 +1,253 @@
+'''
+------------------------------------------------------------------------
+Builds a fake 1-Wire sysfs tree so DS18B20 can be run off the Pi.
+Point DS18B20(base_dir=...) at the folder this creates.
+
+Layout matches the w1-therm driver:
+    <root>/w1_bus_master1/w1_master_slaves
+    <root>/w1_bus_master1/therm_bulk_read
+    <root>/28-xxxxxxxxxxxx/w1_slave
+    <root>/28-xxxxxxxxxxxx/temperature
+
+A file tree answers instantly, the kernel does not. FakeDS18B20 adds
+the driver's timing on top of the tree: a w1_slave read blocks for a
+conversion, one at a time per bus master, and therm_bulk_read reads -1
+until a bulk conversion is done. FakeW1Bus sets the conversion time,
+the share of conversions that fail their CRC and the devices missing
+from the bus.
+
+Use: python fake_w1.py /tmp/w1
+------------------------------------------------------------------------
+'''
+from os import makedirs, path as os_path
+from shutil import rmtree
+from random import Random
+from sys import argv
+from threading import Lock
+from time import monotonic, sleep
+
+from ds18b20 import DS18B20
+
+# device address -> temperature. Addresses end with the ids in ReadingObj.
+DEFAULT_MASTERS = {
+    'w1_bus_master1': {
+        '28-0000000b7b72': 41.25,
+        '28-000000091e37': 38.5,
+        '28-0000000a9e0f': 30.125,
+        '28-0000000a4ee6': 29.75,
+        '28-00000009f5d6': 62.0,
+    },
+    'w1_bus_master2': {
+        '28-00000009071a': 55.5,
+        '28-0000000a839e': 44.0625,
+        '28-0000000b1a77': 51.0,
+        '28-0000000ad995': 49.875,
+    },
+}
+
+
+def w1_slave_text(temp_c, crc_ok=True):
+    """
+    -------------------------------------------------------
+    Returns the contents of a w1_slave file for a temperature.
+    The scratchpad bytes hold the 12 bit reading like a real DS18B20.
+    -------------------------------------------------------
+    Parameters:
+        temp_c - temperature in C (float)
+        crc_ok - False writes a failed CRC 'NO' line (bool)
+    Returns:
+        text - two line w1_slave contents (str)
+    -------------------------------------------------------
+    """
+    raw = int(round(temp_c * 16)) & 0xFFFF
+    scratchpad = f"{raw & 0xFF:02x} {raw >> 8:02x} 4b 46 7f ff 0c 10 1c"
+    status = 'YES' if crc_ok else 'NO'
+    return (f"{scratchpad} : crc=1c {status}\n"
+            f"{scratchpad} t={int(round(temp_c * 1000))}\n")
+
+
+def write_device(root, address, temp_c, crc_ok=True):
+    """
+    -------------------------------------------------------
+    Creates or updates one device folder.
+    -------------------------------------------------------
+    """
+    folder = os_path.join(root, address)
+    makedirs(folder, exist_ok=True)
+    with open(os_path.join(folder, 'w1_slave'), 'w') as f:
+        f.write(w1_slave_text(temp_c, crc_ok))
+    with open(os_path.join(folder, 'temperature'), 'w') as f:
+        f.write(f"{int(round(temp_c * 1000))}\n")
+
+
+def make_fake_w1(root, masters=None, bulk=True):
+    """
+    -------------------------------------------------------
+    Creates a fake w1 sysfs tree.
+    Use: make_fake_w1('/tmp/w1')
+    -------------------------------------------------------
+    Parameters:
+        root - folder to create the tree in (str)
+        masters - {master name: {device address: temp C}} (dict)
+        bulk - create therm_bulk_read files. False acts like an older kernel (bool)
+    Returns:
+        base_dir - root with a trailing slash, ready for DS18B20 (str)
+    -------------------------------------------------------
+    """
+    if masters is None:
+        masters = DEFAULT_MASTERS
+    for master, devices in masters.items():
+        master_folder = os_path.join(root, master)
+        makedirs(master_folder, exist_ok=True)
+        with open(os_path.join(master_folder, 'w1_master_slaves'), 'w') as f:
+            f.write(''.join(f"{address}\n" for address in devices) or "not found.\n")
+        if bulk:
+            with open(os_path.join(master_folder, 'therm_bulk_read'), 'w') as f:
+                f.write("0\n")
+        for address, temp_c in devices.items():
+            write_device(root, address, temp_c)
+    return os_path.join(root, '')
+
+
+class FakeW1Bus:
+    """
+    -------------------------------------------------------
+    A fake tree plus the state of its conversions.
+    Every conversion gives a device a new value that drifts from
+    the last one.
+    Use: bus = FakeW1Bus('/tmp/w1', conversion_time=0.75, crc_fail_rate=0.05,
+                         missing=['28-0000000a9e0f'])
+         sensor_obj = FakeDS18B20(bus)
+    -------------------------------------------------------
+    """
+    def __init__(self, root, masters=None, conversion_time=0.75, crc_fail_rate=0.0, missing=(), drift=0.25, seed=0):
+        """
+        -------------------------------------------------------
+        Parameters:
+            root - folder to create the tree in (str)
+            masters - {master name: {device address: temp C}} (dict)
+            conversion_time - seconds one conversion takes. 0.75 at 12 bits (float)
+            crc_fail_rate - share of conversions that fail the CRC (float)
+            missing - addresses left off the bus (list)
+            drift - most a value moves between conversions, C (float)
+            seed - random seed, the same seed gives the same run (int)
+        -------------------------------------------------------
+        """
+        if masters is None:
+            masters = DEFAULT_MASTERS
+        self.root = root
+        self.masters = {master: {address: temp_c for address, temp_c in devices.items() if address not in missing}
+                        for master, devices in masters.items()}
+        self.conversion_time = conversion_time
+        self.crc_fail_rate = crc_fail_rate
+        self.drift = drift
+        self._random = Random(seed)
+        self._lock = Lock()
+        # a master's bus does one thing at a time
+        self._bus_locks = {master: Lock() for master in self.masters}
+        self._master_of = {address: master for master, devices in self.masters.items() for address in devices}
+        # master -> monotonic time its bulk conversion finishes
+        self._converting = dict()
+        self.conversions = 0
+        self.crc_failures = 0
+        self.base_dir = make_fake_w1(root, self.masters)
+
+    def _convert(self, address):
+        # new value for one device. Returns False when its CRC fails
+        with self._lock:
+            master = self._master_of[address]
+            temp_c = self.masters[master][address] + self._random.uniform(-self.drift, self.drift)
+            self.masters[master][address] = temp_c
+            crc_ok = self._random.random() >= self.crc_fail_rate
+            self.conversions += 1
+            self.crc_failures += not crc_ok
+        write_device(self.root, address, temp_c, crc_ok)
+        return crc_ok
+
+    def read_device(self, address):
+        """
+        -------------------------------------------------------
+        What a w1_slave read does in the kernel: waits for the bus,
+        then for one conversion.
+        -------------------------------------------------------
+        """
+        master = self._master_of.get(address)
+        if master is None:
+            return
+        with self._bus_locks[master]:
+            sleep(self.conversion_time)
+            self._convert(address)
+
+    def bulk_status(self, bulk_file):
+        """
+        -------------------------------------------------------
+        Returns the lines a read of therm_bulk_read gives.
+        The first read after a trigger starts the conversion on every
+        triggered master at once, like the driver does on the write.
+        -1 until it is done, then 1.
+        A device whose CRC fails gets an empty temperature file.
+        -------------------------------------------------------
+        """
+        master = os_path.basename(os_path.dirname(bulk_file))
+        for name in self.masters:
+            other_file = os_path.join(self.root, name, 'therm_bulk_read')
+            # an older kernel, or a test, without bulk reads on this master
+            if not os_path.exists(other_file):
+                continue
+            with open(other_file) as f:
+                if f.read().strip() == 'trigger':
+                    self._converting[name] = monotonic() + self.conversion_time
+                    with open(other_file, 'w') as f_out:
+                        f_out.write('-1\n')
+        with open(bulk_file) as f:
+            status = f.read().strip()
+        if status == '-1' and monotonic() >= self._converting.get(master, 0):
+            with self._bus_locks[master]:
+                for address in self.masters[master]:
+                    if not self._convert(address):
+                        with open(os_path.join(self.root, address, 'temperature'), 'w') as f:
+                            f.write('')
+            status = '1'
+        with open(bulk_file, 'w') as f:
+            f.write(status + '\n')
+        return [status + '\n']
+
+    def unplug(self, address):
+        """
+        -------------------------------------------------------
+        Takes a device off the bus: its folder goes and its master
+        no longer lists it, like a probe losing its connection.
+        -------------------------------------------------------
+        """
+        with self._lock:
+            master = self._master_of.pop(address)
+            del self.masters[master][address]
+        with open(os_path.join(self.root, master, 'w1_master_slaves'), 'w') as f:
+            f.write(''.join(f"{device}\n" for device in self.masters[master]) or "not found.\n")
+        rmtree(os_path.join(self.root, address), ignore_errors=True)
+
+
+class FakeDS18B20(DS18B20):
+    """
+    -------------------------------------------------------
+    DS18B20 on a FakeW1Bus. Everything but the file reads is the
+    real class.
+    Use: sensor_obj = FakeDS18B20(bus)
+    -------------------------------------------------------
+    """
+    def __init__(self, bus, **kwargs):
+        self.bus = bus
+        super().__init__(base_dir=bus.base_dir, load_modules=False, **kwargs)
+
+    def _read_temp(self, index):
+        self.bus.read_device(os_path.basename(self.device_folder[index]))
+        return super()._read_temp(index)
+
+    def _read_lines(self, file_name):
+        if file_name.endswith('/therm_bulk_read'):
+            return self.bus.bulk_status(file_name)
+        return super()._read_lines(file_name)
+
+
+if __name__ == '__main__':
+    print(make_fake_w1(argv[1] if len(argv) > 1 else 'fake_w1'))
@@ -1,11 +1,36 @@
 from firebase_admin import credentials, firestore, initialize_app, messaging
 from google.cloud.firestore_v1.base_query import FieldFilter, BaseCompositeFilter
+from google.api_core.exceptions import NotFound
 from datetime import datetime, timezone, timedelta
+from aggregation import parse_lines, summarize, format_summary
+from metrics import METRICS
+from log_setup import get_logger, fields
 
-creds = credentials.Certificate('/home/luke/Desktop/Script/Credentials/solar-logger.json')
-initialize_app(creds)
+log = get_logger('firestore')
 
-db = firestore.client()
+CREDENTIALS_FILE = '/home/luke/Desktop/Script/Credentials/solar-logger.json'
+
+# firestore client. Created on first use so importing this file needs no credentials.
+# Benchmarks replace it with a local stand-in (fake_firestore.py).
+db = None
+
+# Compressed hour lines are also appended here. None turns it off.
+AVERAGE_DEBUG_FILE = "Output/averageDebug.csv"
+
+# The current hour's document. Every tick but the first of an hour
+# appends to it directly, without a query or a read.
+current_hour = {'hour': None, 'ref': None, 'glycol_in_max': 0.01, 'glycol_roof_max': 0.01}
+
+
+def get_db():
+    """
+    Returns the firestore client. Initializes the app on first call.
+    """
+    global db
+    if db is None:
+        initialize_app(credentials.Certificate(CREDENTIALS_FILE))
+        db = firestore.client()
+    return db
 
 
 
@@ -13,6 +38,7 @@ def send_notification(msg_topic, msg_title, msg_body):
     """
     Android app notifications.
     """
+    get_db()
     message = messaging.Message(
     notification=messaging.Notification(
     title=msg_title,
@@ -22,22 +48,110 @@ def send_notification(msg_topic, msg_title, msg_body):
     return
 
 
+def send_notifications(notifications):
+    """
+    -------------------------------------------------------
+    Sends several app notifications in one request.
+    Used by the notifier dispatcher.
+    notifications - list of (topic, title, body)
+    -------------------------------------------------------
+    """
+    get_db()
+    messages = [messaging.Message(
+        notification=messaging.Notification(title=title, body=body),
+        topic=topic) for topic, title, body in notifications]
+    if len(messages) == 1:
+        messaging.send(messages[0])
+    else:
+        messaging.send_each(messages)
+    return
+
+
 def write_line(date_time_utc, new_line_data, lastHourDocumentRef, readingObj):
-    lastHourDocumentRef = update_hour_document(db.transaction(), date_time_utc, new_line_data, lastHourDocumentRef, readingObj, collection_name="test")    
-    return lastHourDocumentRef
+    return write_lines(date_time_utc, [new_line_data], lastHourDocumentRef, readingObj.glycol_in, readingObj.glycol_in_roof)
+
+
+def write_lines(date_time_utc, new_lines, lastHourDocumentRef, glycol_in_max, glycol_roof_max, aggregator=None):
+    """
+    -------------------------------------------------------
+    Appends a batch of lines to one hour document.
+    Used by the upload spool to replay lines in time order.
+    -------------------------------------------------------
+    Parameters:
+        date_time_utc - hour of the document (datetime)
+        new_lines - csv lines of sensor values (list)
+        lastHourDocumentRef - previous hour document reference or None
+        glycol_in_max, glycol_roof_max - highest values in the batch (float)
+        aggregator - the logger's aggregation.PeriodAggregator. When given,
+                     the maximums are its daily maximums and are written as is,
+                     and the previous hour is compressed from it without
+                     downloading that hour. (PeriodAggregator)
+    Returns:
+        doc_ref - reference to the hour document
+    -------------------------------------------------------
+    """
+    if current_hour['hour'] == date_time_utc:
+        try:
+            with METRICS.timer('append_hour_document'):
+                return append_hour_document(new_lines, glycol_in_max, glycol_roof_max, aggregator is not None)
+        except NotFound:
+            # document was removed under us. find or create it again.
+            log.warning("cached hour document not found. querying again", extra=fields(document=current_hour['ref'].id))
+
+    # includes the retries of the transaction
+    with METRICS.timer('update_hour_document'):
+        doc_ref, max_glycol_in, max_glycol_roof = update_hour_document(get_db().transaction(), date_time_utc, new_lines, lastHourDocumentRef, glycol_in_max, glycol_roof_max, collection_name="test", aggregator=aggregator)    
+    current_hour.update({'hour': date_time_utc, 'ref': doc_ref, 'glycol_in_max': max_glycol_in, 'glycol_roof_max': max_glycol_roof})
+    return doc_ref
+
+
+def append_hour_document(new_lines, glycol_in_max, glycol_roof_max, daily_max=False):
+    """
+    -------------------------------------------------------
+    Appends lines to the cached current hour document.
+    One write that only carries the new lines (array union) and the
+    running maximums. Nothing is read, so the cost per reading stays
+    the same however full the document gets.
+    Note: array union skips a line that is already in the document,
+    so replaying the same line twice is harmless.
+    -------------------------------------------------------
+    Parameters:
+        daily_max - the maximums already are the day's maximums (bool)
+    Returns:
+        doc_ref - reference to the hour document
+    -------------------------------------------------------
+    """
+    if daily_max:
+        # a batch without a value keeps the stored maximum
+        max_glycol_in = current_hour['glycol_in_max'] if glycol_in_max is None else glycol_in_max
+        max_glycol_roof = current_hour['glycol_roof_max'] if glycol_roof_max is None else glycol_roof_max
+    else:
+        max_glycol_in = max_of(glycol_in_max, current_hour['glycol_in_max'])
+        max_glycol_roof = max_of(glycol_roof_max, current_hour['glycol_roof_max'])
+    doc_ref = current_hour['ref']
+    doc_ref.update({
+        'lines': firestore.ArrayUnion(list(new_lines)),
+        'last_reading': datetime.now(timezone.utc),
+        **max_fields(max_glycol_in, max_glycol_roof)})
+    current_hour['glycol_in_max'] = max_glycol_in
+    current_hour['glycol_roof_max'] = max_glycol_roof
+    return doc_ref
     
 
 # Run a transaction to store data
 @firestore.transactional
-def update_hour_document(transaction, date_time_utc, new_line_data, lastHourDocumentRef, readingObj, collection_name):
+def update_hour_document(transaction, date_time_utc, new_lines, lastHourDocumentRef, glycol_in_max, glycol_roof_max, collection_name, aggregator=None):
     """
     -------------------------------------------------------
-    Appends a single line to the current hour document.
+    Appends lines to the current hour document.
     Tracks daily max for two important temperatures.
     Creates new doc if it does not exist.
+    Only runs on the first tick of an hour, after that write_lines
+    appends to the cached document.
+    Returns (doc_ref, glycol_in_max, glycol_roof_max)
     -------------------------------------------------------
     """
-    collection_ref = db.collection(collection_name)
+    collection_ref = get_db().collection(collection_name)
     # Construct
     conditions = [['hour', '>=', date_time_utc], ['hour', '<=', date_time_utc + timedelta(seconds=1)]]
     query = collection_ref.where(filter=BaseCompositeFilter('AND', [FieldFilter(*_c) for _c in conditions]))
@@ -52,24 +166,33 @@ def update_hour_document(transaction, date_time_utc, new_line_data, lastHourDocu
         doc_ref = documents[0].reference
         doc_data = documents[0].to_dict()
         # Add the new line
-        max_glycol_in = doc_data.get('glycol_in_max', 0.01)
-
-        max_glycol_in = max([readingObj.glycol_in, max_glycol_in])
-        max_glycol_roof = doc_data.get('glycol_roof_max', 0.01)
-        max_glycol_roof = max([readingObj.glycol_in_roof, max_glycol_roof])
-        lines = doc_data.get('lines', [])
-        lines.append(new_line_data)
-        # Update within the transaction
-        transaction.update(doc_ref, {'lines': lines})
-        transaction.update(doc_ref, {'last_reading': datetime.now(timezone.utc)})
-        transaction.update(doc_ref, {'glycol_in_max': max_glycol_in})
-        transaction.update(doc_ref, {'glycol_roof_max': max_glycol_roof})
+        max_glycol_in = doc_data.get('glycol_in_max')
+        max_glycol_roof = doc_data.get('glycol_roof_max')
+        if aggregator is not None:
+            # the aggregator's daily max, already reset at 5, replaces the stored one.
+            # a batch without a value (i.e. a replayed one) keeps it
+            if glycol_in_max is not None:
+                max_glycol_in = glycol_in_max
+            if glycol_roof_max is not None:
+                max_glycol_roof = glycol_roof_max
+        else:
+            max_glycol_in = max_of(glycol_in_max, max_glycol_in)
+            max_glycol_roof = max_of(glycol_roof_max, max_glycol_roof)
+        # Update within the transaction. only the new lines are sent.
+        transaction.update(doc_ref, {
+            'lines': firestore.ArrayUnion(list(new_lines)),
+            'last_reading': datetime.now(timezone.utc),
+            **max_fields(max_glycol_in, max_glycol_roof)})
         # if the hour has changed use the previous document id to compress that hour
 
     else:
         #print(f"Document with timestamp {date_time_utc} does not exist. creating document")
+        # the aggregator already tracks the daily max, nothing to look up
+        if aggregator is not None:
+            max_glycol_in = 0.01
+            max_glycol_roof = 0.01
         # creating new hour doc with knowledge of previous hour doc (get max and min, then compress)
-        if lastHourDocumentRef is not None:
+        elif lastHourDocumentRef is not None:
             prev_doc_snapshot = lastHourDocumentRef.get()
             prev_doc_data = prev_doc_snapshot.to_dict()
             max_glycol_in = prev_doc_data.get('glycol_in_max', 0.01)
@@ -78,17 +201,21 @@ def update_hour_document(transaction, date_time_utc, new_line_data, lastHourDocu
         else:
             max_glycol_in = 0.01
             max_glycol_roof = 0.01
-            log_event(f"new doc created with No previous doc Id in memory  {max_glycol_in} {max_glycol_roof} need to locate last max.  Some crash occured.")
+            log.warning("new doc created with No previous doc Id in memory. need to locate last max. Some crash occured.", extra=fields(glycol_in_max=max_glycol_in, glycol_roof_max=max_glycol_roof))
             #getLastKnownMax()
         
         # reset the min and max daily at this hour
-        if datetime.now().hour == 5:
+        if aggregator is None and datetime.now().hour == 5:
             max_glycol_in = 0.01
             max_glycol_roof = 0.01
         
+        # include the new lines
+        max_glycol_in = max_of(glycol_in_max, max_glycol_in)
+        max_glycol_roof = max_of(glycol_roof_max, max_glycol_roof)
+
         new_doc_data = {
             'hour': date_time_utc,
-            'lines': [new_line_data],
+            'lines': list(new_lines),
             'glycol_in_max': max_glycol_in,
             'glycol_roof_max': max_glycol_roof,
             'last_reading': datetime.now(timezone.utc)}
@@ -96,18 +223,39 @@ def update_hour_document(transaction, date_time_utc, new_line_data, lastHourDocu
         doc_ref = collection_ref.add(new_doc_data)[1]
         
         # Since this hours doc does not exist. it is a new hour. compress the previous hour.
-        compress_previous_hour(collection_ref, date_time_utc, lastHourDocumentRef)
+        compress_previous_hour(collection_ref, date_time_utc, lastHourDocumentRef, aggregator)
         
-    return doc_ref
+    return doc_ref, max_glycol_in, max_glycol_roof
+
+
+def max_of(value, current):
+    # max that ignores a missing value
+    if value is None:
+        return current
+    if current is None:
+        return value
+    return max([value, current])
+
+
+def max_fields(glycol_in_max, glycol_roof_max):
+    # the maximum fields of an update. a missing one is left out, not overwritten
+    values = {'glycol_in_max': glycol_in_max, 'glycol_roof_max': glycol_roof_max}
+    return {name: value for name, value in values.items() if value is not None}
 
 
-def compress_previous_hour(collection_ref, date_time_utc, previousHourDocumentRef):
+def compress_previous_hour(collection_ref, date_time_utc, previousHourDocumentRef, aggregator=None):
     """
     -------------------------------------------------------
     Compress the last hour (if it exists) when a new document is created.
-    If no doc ref in memory, query the db to find the previous doc.
+    The logger's aggregator already has the compressed line for hours it saw.
+    Otherwise if no doc ref in memory, query the db to find the previous doc.
     -------------------------------------------------------
     """
+    output_line = aggregator.hour_line(date_time_utc - timedelta(hours=1)) if aggregator is not None else None
+    if output_line is not None:
+        update_week_document(get_db().transaction(), date_time_utc, output_line, collection_name="weeks")
+        return
+
     doc_data = None
     if previousHourDocumentRef is None:
         # Construct
@@ -122,7 +270,7 @@ def compress_previous_hour(collection_ref, date_time_utc, previousHourDocumentRe
             doc_data = documents[0].to_dict()
         # Else nothing to compress.
         else:
-            log_event(f"previousDocumentRef is None and query returned no results for {date_time_utc} nothing to compress")
+            log.warning("previousDocumentRef is None and query returned no results. nothing to compress", extra=fields(hour=date_time_utc))
     
     else: # we already know the previous hours doc reference.        
         doc_data = previousHourDocumentRef.get().to_dict()
@@ -130,8 +278,7 @@ def compress_previous_hour(collection_ref, date_time_utc, previousHourDocumentRe
     if doc_data is not None:
         # Compress lines  Avg, max, min
         output_line = compress_doc_data(previousHourDocumentRef, doc_data)
-        doc_ref = update_week_document(db.transaction(), date_time_utc, output_line, collection_name="weeks")
-        delete_old_documents(date_time_utc, collection_name='test')
+        doc_ref = update_week_document(get_db().transaction(), date_time_utc, output_line, collection_name="weeks")
 
     return 
         
@@ -140,62 +287,23 @@ def compress_doc_data(previousHourDocumentRef, doc_data):
     -------------------------------------------------------
     Calculates averages, maximums, and minimums for each sensor.
     Called when a new hourly document is created.
+    Missing values are skipped. A sensor with no values at all
+    gets the MISSING_VALUE placeholder.
     -------------------------------------------------------
     """    
     #hour = doc_data.get('hour')
     lines = doc_data.get('lines', [])
 
-    averages = []
-    average_counts = []
-    maximums = []
-    minimums = []
-
-    firstLine = True
-    for line in lines:
-        line = line.split(",")
-        i = 1
-        while i < len(line):
-            try:
-                value = float(line[i])
-                if firstLine:
-                    averages.append(value)
-                    average_counts.append(1)
-                    maximums.append(value) 
-                    minimums.append(value)
-                else:
-                    averages[i-1] += value
-                    average_counts[i-1] += 1
-                    maximums[i-1] = max(maximums[i-1], value)
-                    minimums[i-1] = min(minimums[i-1], value)
-            except:
-                # value is None. Append 0 if the list is empty.
-                # this could be improved
-                if firstLine:
-                    averages.append(0)
-                    average_counts.append(1)
-                    maximums.append(0) 
-                    minimums.append(0)
-                else:
-                    pass
-            i += 1
-        firstLine = False
-
-    # calculate averages
-    i -= 1
-    k = 0
-    while k < len(averages):
-        # +0.001 rounds the .005 up
-        averages[k] = round(averages[k]/average_counts[k]+0.001,2)
-        k += 1
+    # one 2-D array for the hour, NaN where a value is missing
+    dates, values = parse_lines(lines)
+    summary = summarize(values)
 
     # format results  
     time = datetime.now() - timedelta(hours=1)
-    output_line = ""  
-    output_line += (f"{time.strftime('%Y-%m-%d %H:%M:%S')},")
-    output_line += ",".join(f"{avg},{maxm},{minm}" for avg, maxm, minm in zip(averages, maximums, minimums))
-    with open("Output/averageDebug.csv", 'a') as file:        
-        file.write(output_line + "\n")
-    file.close()
+    output_line = format_summary(time.strftime('%Y-%m-%d %H:%M:%S'), summary)
+    if AVERAGE_DEBUG_FILE is not None:
+        with open(AVERAGE_DEBUG_FILE, 'a') as file:        
+            file.write(output_line + "\n")
 
     return output_line
 
@@ -208,7 +316,7 @@ def update_week_document(transaction, date_time_utc, new_line_data, collection_n
     Creates new doc if it does not exist.
     -------------------------------------------------------
     """ 
-    collection_ref = db.collection(collection_name)
+    collection_ref = get_db().collection(collection_name)
     # Construct
     week_no = date_time_utc.isocalendar().week
     year = date_time_utc.isocalendar().year
@@ -242,34 +350,4 @@ def update_week_document(transaction, date_time_utc, new_line_data, collection_n
         doc_ref = collection_ref.add(new_doc_data)[1]
 
     return doc_ref
-
-def delete_old_documents(date_time_utc, collection_name):
-    """
-    -------------------------------------------------------
-    Removes hourly documents that are older than one week.
-    No need for more than one week of detailed info on firebase.
-    -------------------------------------------------------
-    """ 
-    collection_ref = db.collection(collection_name)
-    conditions = [['hour', '<=', date_time_utc - timedelta(weeks=1)]]
-    query = collection_ref.where(filter=BaseCompositeFilter('AND', [FieldFilter(*_c) for _c in conditions]))
-
-    docs = query.stream()
-
-    for doc in docs:
-        doc.reference.delete()
-    return
-
-def log_event(message):
-    """
-    -------------------------------------------------------
-    Writes a message to file.
-    Includes Datetime.
-    Use: log_event("errors.txt", "my error")
-    -------------------------------------------------------
-    """ 
-    with open("/home/luke/Desktop/Script/Logs/errors_firebase_admin_file.txt", 'a') as output_file:
-        output_file.write(f"{str(datetime.now())}  {message}\n")
-    output_file.close()
-    return
     
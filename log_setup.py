@@ -0,0 +1,167 @@
+'''
+------------------------------------------------------------------------
+Queued logging for the logger and the modules it calls.
+Every module logs to its own named logger under 'solar':
+    solar.logger         - the main loop, sinks, spool   error_logging.txt
+    solar.ds18b20        - sensor reads, retries, reboots errors_ds18b20.txt
+    solar.firestore      - the hour documents            errors_firebase_admin_file.txt
+    solar.write_failures - samples the spool dropped     write_failures.txt
+
+A log call only puts the record on a queue and returns. One background
+thread (a QueueListener) formats the records and writes them to the
+files, so a slow SD card never adds to a sensor read. If the queue is
+full the record is dropped and counted instead of waiting.
+
+Each file rotates at max_bytes and keeps backup_count old files.
+Structured fields go after the message as key=value:
+    log.warning('read retried', extra=fields(index=3, retries_left=2))
+    2024-06-01 12:00:00 - WARNING - solar.ds18b20 - read retried  index=3 retries_left=2
+
+Logs from other libraries (firebase, google) at WARNING and above go to
+the solar.logger file, like basicConfig did before.
+------------------------------------------------------------------------
+'''
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from os import makedirs, path as os_path
+from queue import Full, Queue
+
+from metrics import METRICS
+
+ROOT = 'solar'
+
+# subsystem -> file in the logs folder
+LOG_FILES = {
+    'logger': 'error_logging.txt',
+    'ds18b20': 'errors_ds18b20.txt',
+    'firestore': 'errors_firebase_admin_file.txt',
+    'write_failures': 'write_failures.txt',
+}
+# records from outside 'solar' go to this subsystem's file
+DEFAULT_SUBSYSTEM = 'logger'
+
+FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_BYTES = 1_000_000
+BACKUP_COUNT = 5
+# records waiting for the writer thread before new ones are dropped
+QUEUE_SIZE = 10000
+
+_listener = None
+
+
+def get_logger(subsystem):
+    """
+    -------------------------------------------------------
+    Returns the logger of a subsystem.
+    Use: log = get_logger('ds18b20')
+    -------------------------------------------------------
+    """
+    return logging.getLogger(f"{ROOT}.{subsystem}")
+
+
+def fields(**values):
+    """
+    -------------------------------------------------------
+    Structured fields for one record, written as key=value.
+    Use: log.error('read FAILED', extra=fields(index=index))
+    -------------------------------------------------------
+    """
+    return {'fields': values}
+
+
+class FieldsFormatter(logging.Formatter):
+    # FORMAT, then the record's fields as key=value
+    def format(self, record):
+        line = super().format(record)
+        values = getattr(record, 'fields', None)
+        if values:
+            line += '  ' + ' '.join(f"{key}={value}" for key, value in values.items())
+        return line
+
+
+class SubsystemFilter(logging.Filter):
+    # passes the records of one subsystem, and of other libraries when catch_all
+    def __init__(self, subsystem, catch_all=False):
+        super().__init__()
+        self.name_prefix = f"{ROOT}.{subsystem}"
+        self.catch_all = catch_all
+
+    def filter(self, record):
+        name = record.name
+        if name == self.name_prefix or name.startswith(self.name_prefix + '.'):
+            return True
+        return self.catch_all and not (name == ROOT or name.startswith(ROOT + '.'))
+
+
+class DroppingQueueHandler(QueueHandler):
+    # never blocks the caller. a full queue drops the record and counts it
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            METRICS.inc('log_records_dropped')
+
+
+def setup_logging(log_folder, level=logging.INFO, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                  log_files=LOG_FILES, queue_size=QUEUE_SIZE):
+    """
+    -------------------------------------------------------
+    Starts the writer thread and sends every 'solar' record, and other
+    libraries' warnings, through the queue. Call once at start up.
+    Calling it again first stops the previous writer.
+    -------------------------------------------------------
+    Parameters:
+        log_folder - folder of the log files (str)
+        level - lowest level logged by the subsystems (int)
+        max_bytes - size a file rotates at (int)
+        backup_count - rotated files kept per subsystem (int)
+        log_files - subsystem -> file name (dict)
+        queue_size - records waiting before new ones are dropped (int)
+    Returns:
+        the QueueListener
+    -------------------------------------------------------
+    """
+    global _listener
+    stop_logging()
+    makedirs(log_folder, exist_ok=True)
+    formatter = FieldsFormatter(FORMAT, DATE_FORMAT)
+    handlers = list()
+    for subsystem, file_name in log_files.items():
+        handler = RotatingFileHandler(os_path.join(log_folder, file_name), maxBytes=max_bytes,
+                                      backupCount=backup_count, delay=True)
+        handler.setFormatter(formatter)
+        handler.addFilter(SubsystemFilter(subsystem, catch_all=subsystem == DEFAULT_SUBSYSTEM))
+        handlers.append(handler)
+
+    queue_handler = DroppingQueueHandler(Queue(queue_size))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    logging.getLogger(ROOT).setLevel(level)
+
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """
+    -------------------------------------------------------
+    Writes the queued records and stops the writer thread.
+    Also run at exit.
+    -------------------------------------------------------
+    """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,237 @@
+'''
+------------------------------------------------------------------------
+Latency and event metrics for the logger, in one process wide registry.
+
+    timers   - monotonic durations of each stage (sweep, every sink,
+               get_tempC, the firestore hour document). Kept as a
+               Prometheus histogram since start, plus the last WINDOW
+               durations for recent quantiles.
+    counters - read retries, recoveries, reboots, sink errors, overruns
+    gauges   - current values, like the spool depth
+
+Exported in the Prometheus text format, either written to a file for
+node_exporter's textfile collector or served on a small local HTTP
+endpoint. Both show what is using the 18.9s sample budget.
+
+Use:
+    from metrics import METRICS
+    with METRICS.timer('sweep'):
+        ...
+    METRICS.inc('read_retries', kind='crc')
+    METRICS.write_textfile('Output/logger.prom')
+    METRICS.serve(9105)     # curl http://127.0.0.1:9105/metrics
+------------------------------------------------------------------------
+'''
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import replace
+from threading import Lock, Thread
+from time import monotonic
+
+# metric names start with this
+PREFIX = 'logger'
+
+# histogram bucket upper bounds in seconds. a sample has 18.9
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 60.0)
+
+# durations kept per stage for the recent quantiles, about 2.5 hours of samples
+WINDOW = 500
+
+# recent quantiles exported per stage. 1 is the max
+QUANTILES = (0.5, 0.95, 0.99, 1.0)
+
+
+class Histogram:
+    """
+    -------------------------------------------------------
+    Bucket counts, sum and count since start, and a rolling
+    window of the latest values.
+    -------------------------------------------------------
+    """
+    def __init__(self, buckets=BUCKETS, window=WINDOW):
+        self.buckets = tuple(buckets)
+        # one count per bucket, the last one is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self, quantiles=QUANTILES):
+        # nearest rank quantiles of the recent values, {} when there are none
+        values = sorted(self.recent)
+        if not values:
+            return dict()
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in quantiles}
+
+
+def format_labels(labels):
+    # {"stage": "sweep"} -> '{stage="sweep"}'
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+class Metrics:
+    """
+    -------------------------------------------------------
+    Thread safe registry of stage timers, counters and gauges.
+    Use: metrics = Metrics()
+         with metrics.timer('sqlite_local'): ...
+         metrics.inc('reboots', reason='read_failure')
+         text = metrics.render()
+    -------------------------------------------------------
+    """
+    def __init__(self, prefix=PREFIX, buckets=BUCKETS, window=WINDOW):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.window = window
+        self._lock = Lock()
+        # stage -> Histogram
+        self._timers = dict()
+        # name -> {label items: value}
+        self._counters = dict()
+        self._gauges = dict()
+        self._server = None
+
+    def observe(self, stage, seconds):
+        """
+        -------------------------------------------------------
+        Records one duration of a stage.
+        -------------------------------------------------------
+        """
+        with self._lock:
+            timer = self._timers.get(stage)
+            if timer is None:
+                timer = self._timers[stage] = Histogram(self.buckets, self.window)
+            timer.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """
+        -------------------------------------------------------
+        Times the block with the monotonic clock, also when it raises.
+        Use: with METRICS.timer('sweep'): ...
+        -------------------------------------------------------
+        """
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, monotonic() - start)
+
+    def inc(self, name, amount=1, **labels):
+        # adds to a counter. exported as <prefix>_<name>_total
+        key = tuple(labels.items())
+        with self._lock:
+            counter = self._counters.setdefault(name, dict())
+            counter[key] = counter.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        # sets a gauge
+        with self._lock:
+            self._gauges.setdefault(name, dict())[tuple(labels.items())] = value
+
+    def snapshot(self):
+        """
+        -------------------------------------------------------
+        Returns the recent timings and the counters as a dict,
+        for a log line or a report.
+        -------------------------------------------------------
+        """
+        with self._lock:
+            return {
+                'timers': {stage: dict(count=timer.count, total=round(timer.sum, 3),
+                                       **{f"p{int(q * 100)}": round(v, 4) for q, v in timer.quantiles().items()})
+                           for stage, timer in self._timers.items()},
+                'counters': {name: {format_labels(dict(key)) or 'total': value for key, value in values.items()}
+                             for name, values in self._counters.items()},
+                'gauges': {name: {format_labels(dict(key)) or 'value': value for key, value in values.items()}
+                           for name, values in self._gauges.items()}}
+
+    def render(self):
+        """
+        -------------------------------------------------------
+        Returns every metric in the Prometheus text format.
+        -------------------------------------------------------
+        """
+        stage_name = f"{self.prefix}_stage_seconds"
+        lines = list()
+        with self._lock:
+            if self._timers:
+                lines.append(f"# HELP {stage_name} Time spent in each stage of the logger.")
+                lines.append(f"# TYPE {stage_name} histogram")
+                for stage, timer in sorted(self._timers.items()):
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + ('+Inf',), timer.counts):
+                        cumulative += count
+                        lines.append(f"{stage_name}_bucket{format_labels({'stage': stage, 'le': bound})} {cumulative}")
+                    lines.append(f"{stage_name}_sum{format_labels({'stage': stage})} {timer.sum:.6f}")
+                    lines.append(f"{stage_name}_count{format_labels({'stage': stage})} {timer.count}")
+                lines.append(f"# HELP {stage_name}_recent Quantiles of the last {self.window} durations of each stage.")
+                lines.append(f"# TYPE {stage_name}_recent gauge")
+                for stage, timer in sorted(self._timers.items()):
+                    for q, value in timer.quantiles().items():
+                        lines.append(f"{stage_name}_recent{format_labels({'stage': stage, 'quantile': q})} {value:.6f}")
+            for name, values in sorted(self._counters.items()):
+                lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+                lines.extend(f"{self.prefix}_{name}_total{format_labels(dict(key))} {value}" for key, value in values.items())
+            for name, values in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {self.prefix}_{name} gauge")
+                lines.extend(f"{self.prefix}_{name}{format_labels(dict(key))} {value}" for key, value in values.items())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, file_name):
+        """
+        -------------------------------------------------------
+        Writes render() to a file for node_exporter's textfile collector.
+        Written next to it then renamed, so it is never read half done.
+        -------------------------------------------------------
+        """
+        with open(file_name + '.tmp', 'w') as file:
+            file.write(self.render())
+        replace(file_name + '.tmp', file_name)
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        -------------------------------------------------------
+        Serves render() on http://host:port/metrics from a daemon thread.
+        Only on the local machine unless another host is given.
+        -------------------------------------------------------
+        Returns:
+            the server, server.shutdown() stops it
+        -------------------------------------------------------
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # no line on stderr per scrape
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+        return self._server
+
+
+# shared by the logger and the modules it calls
+METRICS = Metrics()
@@ -0,0 +1,191 @@
+'''
+------------------------------------------------------------------------
+Background notification dispatcher.
+send_notification() only puts the message on a bounded queue and returns,
+so a slow or failing messaging.send never stalls a sensor read.
+A worker thread coalesces bursts into one message per topic and title,
+drops repeats of the same key inside its rate limit window and sends the
+batch through the sender (firebase_admin_file.send_notifications by default).
+Messages with a key in UNLIMITED_KEYS (the reboot notices) are never
+rate limited. Pass a key whenever the body changes every call, i.e.
+holds the time, or only exact repeats are limited.
+------------------------------------------------------------------------
+'''
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from time import monotonic
+
+# seconds between two messages with the same topic and key
+RATE_LIMITS = {'hot': 900, 'debug': 60}
+DEFAULT_RATE_LIMIT = 60
+# keys that are never rate limited
+UNLIMITED_KEYS = ('reboot',)
+# most seconds to wait for queued messages before a reboot
+FLUSH_TIMEOUT = 30
+
+
+class NotificationDispatcher:
+    """
+    -------------------------------------------------------
+    Use: dispatcher = NotificationDispatcher()
+         dispatcher.notify('hot', 'Temperature limit exceeded', 'glycol_in reported 92 C', key='1e37')
+    -------------------------------------------------------
+    """
+    def __init__(self, sender=None, maxsize=100, coalesce_window=2.0, max_batch=20, rate_limits=None):
+        """
+        -------------------------------------------------------
+        Parameters:
+            sender - called with a list of (topic, title, body) tuples.
+                     None uses firebase_admin_file.send_notifications
+            maxsize - most messages waiting. New ones are dropped when full (int)
+            coalesce_window - seconds to wait for more messages of a burst (float)
+            max_batch - most messages collected into one send (int)
+            rate_limits - {topic: seconds} between messages with the same key (dict)
+        -------------------------------------------------------
+        """
+        self._sender = sender
+        self._queue = Queue(maxsize=maxsize)
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.rate_limits = dict(RATE_LIMITS if rate_limits is None else rate_limits)
+        self._lock = Lock()
+        # (topic, key) or (topic, title, body) without a key -> monotonic time
+        # of the last accepted message. pruned once the window has passed
+        self._last_sent = dict()
+        # same keys -> messages dropped by the rate limit since the last one
+        self._suppressed = dict()
+        self._thread = None
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def notify(self, topic, title, body, key=None):
+        """
+        -------------------------------------------------------
+        Queues a message. Never blocks and never raises.
+        -------------------------------------------------------
+        Parameters:
+            topic - app notification topic (str)
+            title - message title (str)
+            body - message text (str)
+            key - what the rate limit is per, i.e. a sensor. Without one only
+                  repeats of the same title and body are rate limited.
+                  UNLIMITED_KEYS are not rate limited.
+        Returns:
+            queued - False if the message was rate limited or the queue is full (bool)
+        -------------------------------------------------------
+        """
+        try:
+            suppressed = 0
+            if key not in UNLIMITED_KEYS:
+                rate_key = (topic, title, body) if key is None else (topic, key)
+                now = monotonic()
+                with self._lock:
+                    self._prune(now)
+                    if rate_key in self._last_sent:
+                        self._suppressed[rate_key] = self._suppressed.get(rate_key, 0) + 1
+                        return False
+                    self._last_sent[rate_key] = now
+                    suppressed = self._suppressed.pop(rate_key, 0)
+            if suppressed:
+                body = f"{body} (+{suppressed} suppressed)"
+            self._start()
+            self._queue.put_nowait((topic, title, body))
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+        except Exception:
+            self.dropped += 1
+            return False
+
+    def _prune(self, now):
+        # forgets keys whose window has passed. called with the lock held.
+        # a key keeps its suppressed count for its next message, a body
+        # may never come again so its count goes too
+        expired = [rate_key for rate_key, last in self._last_sent.items()
+                   if now - last >= self.rate_limits.get(rate_key[0], DEFAULT_RATE_LIMIT)]
+        for rate_key in expired:
+            del self._last_sent[rate_key]
+            if len(rate_key) == 3:
+                self._suppressed.pop(rate_key, None)
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = Thread(target=self._run, name='notifier', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = monotonic() + self.coalesce_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+            try:
+                self._send(coalesce(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _send(self, messages):
+        try:
+            sender = self._sender
+            if sender is None:
+                from firebase_admin_file import send_notifications as sender
+            sender(messages)
+            self.sent += len(messages)
+        except Exception:
+            # nothing to do, the read path must not see this
+            self.failed += len(messages)
+
+    def flush(self, timeout=None):
+        """
+        -------------------------------------------------------
+        Waits until every queued message was handed to the sender.
+        Call before a reboot or shutdown.
+        Returns False if it timed out.
+        -------------------------------------------------------
+        """
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and monotonic() >= deadline:
+                return False
+            with self._queue.all_tasks_done:
+                self._queue.all_tasks_done.wait(0.1)
+        return True
+
+
+def coalesce(batch):
+    """
+    -------------------------------------------------------
+    Merges messages with the same topic and title into one,
+    dropping repeated bodies. Order of first appearance is kept.
+    -------------------------------------------------------
+    """
+    grouped = dict()
+    for topic, title, body in batch:
+        bodies = grouped.setdefault((topic, title), [])
+        if body not in bodies:
+            bodies.append(body)
+    return [(topic, title, '\n'.join(bodies)) for (topic, title), bodies in grouped.items()]
+
+
+# shared dispatcher for the logger
+dispatcher = NotificationDispatcher()
+
+
+def send_notification(msg_topic, msg_title, msg_body, key=None):
+    """
+    Android app notifications. Queued, sent in the background.
+    """
+    return dispatcher.notify(msg_topic, msg_title, msg_body, key)
@@ -1,9 +1,23 @@
-from ds18b20 import DS18B20, file_check, read_sensors, write_to_sql_lite, ReadingObj 
+from ds18b20 import DS18B20, read_sensors, ReadingObj 
+from sqlite_storage import SQLiteWriter, ROLLUPS, check_database
+from ts_store import TimeSeriesStore
+from sensor_registry import REGISTRY
+from text_archive import TextArchive
+from spool import UploadSpool
+from retention import RetentionSweeper
+from aggregation import PeriodAggregator
+from metrics import METRICS
 from datetime import datetime, timezone
-from time import sleep, strftime
-from logging import basicConfig as logging_basicConfig, DEBUG as const_DEBUG, ERROR as const_ERROR, info as logging_info, debug as logging_debug, error as logging_error
+from time import sleep, strftime, localtime, time
+from logging import INFO as const_INFO
+from log_setup import setup_logging, stop_logging, get_logger, fields
 from subprocess import call as subprocess_call
+from sqlite3 import OperationalError
 import firebase_admin_file
+from notifier import FLUSH_TIMEOUT, dispatcher, send_notification
+import asyncio
+from signal import signal, SIGTERM
+from scheduler import SampleScheduler
 from os import chdir as os_chdir, path as os_path
 os_chdir(os_path.dirname(os_path.abspath(__file__)))
 
@@ -17,7 +31,8 @@ DEBUG_NOTIFICATION = False
 DEBUG_PRINT = False
 
 SENSOR_NAMES = ReadingObj.SENSOR_NAMES
-# Sleep interval between readings
+# Interval between readings. Samples fire on a fixed wall clock grid,
+# so read and write time no longer adds to it.
 #  750ms conversion time + manual 250ms sleep = around 1s per sensor read time.
 # sensor accuracy = +- 0.0625
 INTERVAL = 18.9
@@ -28,20 +43,94 @@ ROUNDING = 2
 # Number of physically connected sensors
 SENSOR_COUNT = 9
 
+# Number of sensors read at the same time. 1 reads them one by one.
+# Reads are spread across the bus masters (gpiopin 26 and 6).
+SENSOR_WORKERS = 4
+
+# Start one conversion per bus master with therm_bulk_read, then collect every sensor.
+# Falls back to per sensor reads when the kernel does not support it.
+BULK_READ = True
+
 # Maximum errors before system reboot.
 MAX_ERRORS = 10
 
+# Seconds between rescans of the 1-Wire bus for added or removed sensors.
+# A failed read also triggers a rescan before the next sweep.
+RESCAN_INTERVAL = 300
+
 # Storage location 1 - SQLite - local
+# Read by the plotter over SMB, where WAL does not work. So a rollback journal,
+# with synchronous FULL, which is what keeps that mode safe on a power cut.
 sqlite_file_1= '/home/luke/Desktop/Script/Output/shared_data.db'
+SQLITE_1_JOURNAL_MODE = 'DELETE'
+SQLITE_1_SYNCHRONOUS = 'FULL'
 
 # Storage location 2 - SQLite - USB
 sqlite_file_2= '/media/luke/USB4G/shared_data.db'
 
+# Rows grouped into one commit, and the longest a row may wait for its commit.
+# Each commit is an fsync on the flash. The local db is read by the plotter so keep it current.
+SQLITE_1_COMMIT_EVERY = 1
+SQLITE_2_COMMIT_EVERY = 10
+SQLITE_2_COMMIT_INTERVAL = 300
+
+# 1 minute, 15 minute, hourly and daily min/max/avg tables kept beside the raw rows
+# in the local db for the plotter. Existing history: python sqlite_storage.py backfill <db>
+SQLITE_1_ROLLUPS = list(ROLLUPS)
+
+# Every sensor in sensors.json is also stored in the long format readings table,
+# including the ones that aren't temperature table columns.
+# Existing history: python sqlite_storage.py long <db>
+
+# Log a warning when a single commit takes longer than this many seconds.
+SLOW_COMMIT = 1.0
+
+# Storage location 5 - binary daily segments - local
+# 24 bytes a sample, memory mapped by readers. Existing history: python ts_store.py import <db> <folder>
+ts_store_folder = '/home/luke/Desktop/Script/Output/ts'
+
 # Storage location 3 - txt - local
+# Rotated daily to output-YYYY-MM-DD.txt and compressed in the background.
 text_output_file = '/home/luke/Desktop/Script/Output/output.txt'
 
+# Lines are buffered and written once this many seconds or bytes have built up.
+TEXT_FLUSH_INTERVAL = 300
+TEXT_FLUSH_BYTES = 64 * 1024
+# How often the buffer's age is checked when no sample comes to write it.
+TEXT_FLUSH_CHECK = 30
+
 # Storage location 4 - firebase firestore
 # firestore_admin_file.py handles this
+# Lines are spooled here first and replayed once firestore accepts them.
+spool_file = '/home/luke/Desktop/Script/Output/upload_spool.db'
+
+# Most lines kept in the spool during an outage. Oldest are dropped to write_failures.txt.
+SPOOL_MAX_ROWS = 200000
+
+# Lines merged into an hour document per firestore transaction when replaying.
+SPOOL_BATCH_SIZE = 100
+
+# Sinks that only talk to firestore. An outage is expected and the spool keeps the
+# lines, so their errors are logged but never count towards a reboot.
+# The spool_depth and spool_lag_seconds metrics show how far behind firestore is.
+OFFLINE_SINKS = ('firestore', 'retention')
+
+# Running hour/day/week avg, max, min. Saved when a period closes, at least every
+# aggregation.SAVE_INTERVAL (300s) and on shutdown, SIGTERM included.
+# A power cut loses at most the last SAVE_INTERVAL of the running stats.
+aggregator_file = '/home/luke/Desktop/Script/Output/aggregator_state.json'
+
+# Hour documents older than a week are deleted by the retention sweeper,
+# in batches, every RETENTION_INTERVAL seconds. Never inside a sample.
+RETENTION_INTERVAL = 3600
+
+# Per stage timings (sweep, each sink, get_tempC, firestore) and counters of retries,
+# recoveries and reboots, in the Prometheus text format. Written to metrics_file every
+# METRICS_INTERVAL seconds for node_exporter's textfile collector, and served on
+# http://127.0.0.1:METRICS_PORT/metrics. None turns either off.
+metrics_file = '/home/luke/Desktop/Script/Output/logger.prom'
+METRICS_INTERVAL = 60
+METRICS_PORT = 9105
 
 # keep last reading incase of read failure.
 previousReadingObj = None
@@ -53,86 +142,309 @@ error_count_other = 0
 
 # Logging settings
 # (10 DEBUG, 20 INFO, 30 WARNING, 40 ERROR, 50 CRITICAL)
-logging_basicConfig(
-    level=const_ERROR,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    filename='/home/luke/Desktop/Script/Logs/error_logging.txt',
-    filemode='a'
-)
-
-def log_reading(message):
+# One rotating file per subsystem in log_folder. The log calls only queue the
+# record, a background thread writes it.
+log_folder = '/home/luke/Desktop/Script/Logs'
+setup_logging(log_folder, level=const_INFO)
+log = get_logger('logger')
+# samples the spool had to drop
+write_failures = get_logger('write_failures')
+
+# get temperature sensors. loads the kernel modules once and keeps the device table.
+sensor_obj = DS18B20(rescan_interval=RESCAN_INTERVAL)
+
+# durable queue in front of firestore
+upload_spool = UploadSpool(spool_file, SPOOL_MAX_ROWS, on_drop=write_failures.warning)
+
+# running aggregates of every sample. the hourly compression and daily maximums come from here.
+aggregator = PeriodAggregator(aggregator_file)
+
+# deletes expired hour documents in pages of up to 500
+retention_sweeper = RetentionSweeper('test')
+
+# background replay of the spool. only one runs at a time.
+replay_task = None
+
+# A database from before the samples table is converted by hand, once, with the
+# logger stopped: python sqlite_storage.py migrate <db>. A database whose columns
+# don't match the 'solar' group in sensors.json is not written to either.
+# Until then the logger won't start.
+for db_location in (sqlite_file_1, sqlite_file_2):
+    try:
+        check_database(db_location, SENSOR_NAMES)
+    except (OperationalError, ValueError) as error:
+        log.critical(str(error))
+        stop_logging()
+        raise SystemExit(1)
+
+# long lived writers, one per database
+# rows a failed commit couldn't keep are logged
+def log_sqlite_drop(db_location):
+    return lambda count: log.error(f"{db_location}: gave up on {count} uncommitted rows", extra=fields(rows=count))
+
+sqlite_writer_1 = SQLiteWriter(sqlite_file_1, SENSOR_NAMES, journal_mode=SQLITE_1_JOURNAL_MODE, synchronous=SQLITE_1_SYNCHRONOUS,
+                               commit_every=SQLITE_1_COMMIT_EVERY, rollups=SQLITE_1_ROLLUPS, registry=REGISTRY,
+                               on_drop=log_sqlite_drop(sqlite_file_1))
+# the USB copy is only read on the Pi, WAL is fine there
+sqlite_writer_2 = SQLiteWriter(sqlite_file_2, SENSOR_NAMES, commit_every=SQLITE_2_COMMIT_EVERY, commit_interval=SQLITE_2_COMMIT_INTERVAL,
+                               registry=REGISTRY, on_drop=log_sqlite_drop(sqlite_file_2))
+
+# buffered text file with daily rotation
+text_archive = TextArchive(text_output_file, ','.join(SENSOR_NAMES), TEXT_FLUSH_INTERVAL, TEXT_FLUSH_BYTES,
+                           on_error=lambda error: log.error(f"text archive compression failed: {error}"))
+
+# append only binary segments, one file per day
+ts_store = TimeSeriesStore(ts_store_folder, SENSOR_NAMES)
+
+# one lock per sink keeps each sink's writes in sample order while
+# a slow sink (USB stick, Firestore) runs on without holding up the others.
+sink_locks = dict()
+
+# keep references to running sink tasks so they aren't garbage collected
+sink_tasks = set()
+
+def on_overrun(deadline, duration, missed):
     """
     -------------------------------------------------------
-    Writes a message to log file.
-    Use: log_event("errors.txt", "my error")
+    Records a sample that ran past the next deadline.
     -------------------------------------------------------
-    """ 
-    with open("/home/luke/Desktop/Script/Logs/write_failures.txt", 'a') as output_file:
-        output_file.write(f"{str(datetime.now())}  {message}\n")
-    output_file.close()
-    return
+    """
+    METRICS.inc('overruns')
+    METRICS.inc('missed_ticks', missed)
+    log.warning(f"_OVERRUN_ sample scheduled {strftime('%Y-%m-%d %H:%M:%S', localtime(deadline))} took {duration:.2f}s. "
+                f"skipped {missed} tick(s). total overruns: {scheduler.overruns}")
 
-'''
-MAIN LOOP
-'''
-while True:
+scheduler = SampleScheduler(INTERVAL, on_overrun)
+
+def check_sensor_count(num_of_sensors):
+    """
+    -------------------------------------------------------
+    Reboot if error count reaches set value. One or more sensors are not detected.
+    Rebooting helps when sensors are not being detected. Log the rest of the sensors.
+    Most of the time its the same sensor that isn't detected. Long cable issue. We can ignore this one.
+    -------------------------------------------------------
+    """
+    global error_count_sensors
+    if num_of_sensors != SENSOR_COUNT:
+        if DEBUG_PRINT:
+            print(f"__ERROR  only found {num_of_sensors} / {SENSOR_COUNT} sensors")
+        
+        
+        error_count_sensors += 1
+        if error_count_sensors >= MAX_ERRORS:
+            log.error(f'_ERROR_  detected only {num_of_sensors} / {SENSOR_COUNT} sensors.')
+            # reset 
+            error_count_sensors = 0
+            
+            if DEBUG_NOTIFICATION:
+                send_notification('debug', 'error', \
+                f'REBOOTING @ {datetime.now().strftime("%a %I:%M %p")} \
+                Detected only {num_of_sensors} / {SENSOR_COUNT} sensors.', key='reboot')
+            if REBOOT_ON_SENSOR_COUNT:
+                METRICS.inc('reboots', reason='sensor_count')
+                log.critical(f'_ERROR_ REBOOTING because detected only {num_of_sensors} / {SENSOR_COUNT} sensors.')
+
+                sleep(30)
+                dispatcher.flush(FLUSH_TIMEOUT)
+                stop_logging()
+                subprocess_call('sudo reboot', shell=True)
+        
+        elif DEBUG_NOTIFICATION and num_of_sensors < (SENSOR_COUNT - 1) and error_count_sensors >= MAX_ERRORS:
+            # Notify if more than one sensor isn't being detected.
+            send_notification('debug', 'Warning', \
+            f'Detected only {num_of_sensors} / {SENSOR_COUNT} sensors.', key='sensor_count')
+            error_count_sensors = 0
+
+def sweep(date_time_now):
+    """
+    -------------------------------------------------------
+    Reads all available sensors. Runs in a worker thread so sensor
+    retries don't block the event loop.
+    -------------------------------------------------------
+    """
+    with METRICS.timer('sweep'):
+        # pick up added or removed sensors
+        sensor_obj.refresh()
+        num_of_sensors = sensor_obj.device_count()
+        METRICS.set('sensors_found', num_of_sensors)
+        check_sensor_count(num_of_sensors)
+
+        # Read Available Sensors
+        if DEBUG_PRINT:
+            print("__reading sensors...")
+        return read_sensors(sensor_obj, previousReadingObj, date_time_now, num_of_sensors, ROUNDING, SENSOR_WORKERS, BULK_READ)
+
+def write_sqlite(writer, sensor_vals_tuple, deadline, readings):
+    # Storage Location 1 and 2 - SQLite. readings is (name, value) of every sensor
+    commits = writer.commit_count
+    writer.write(sensor_vals_tuple, deadline, readings)
+    if writer.commit_count != commits and writer.commit_latencies[-1] > SLOW_COMMIT:
+        log.warning(f"slow commit to {writer.db_location} took {writer.commit_latencies[-1]:.2f}s  {writer.stats()}")
+
+def write_ts_store(deadline, sensor_vals_tuple):
+    # Storage Location 5 - binary segments. keyed by the scheduled time
+    if not ts_store.append(deadline, sensor_vals_tuple[1:]):
+        log.warning(f"ts_store skipped a sample out of time order at {sensor_vals_tuple[0]}. total: {ts_store.out_of_order}")
+
+def write_text_file(deadline, sensor_vals_string):
+    # Storage Location 3 - text file. the header is written once per file
+    text_archive.write(sensor_vals_string, deadline)
+
+def spool_line(deadline, date_time_utc, sensor_vals_tuple, sensor_vals_string):
+    # Storage Location 4 - Firebase firestore
+    '''
+    Updates the running aggregates, then the line goes into the spool
+    with the day's glycol maximums so far.
+    Every line goes into the spool first so a firestore outage loses nothing.
+    replay_spool uploads them in time order once the connection is back.
     
+    if sensor isn't detected, the default value of None will be written to databases.
+    This crashes the android app. Either update app or do not write Nones.
+    -8_25_2024 workaround is to use 0.01 instead of None as default. not ideal but prevents app from crashing.
+    '''
+    aggregator.update(deadline, sensor_vals_tuple[1:])
+    glycol_in_max = aggregator.current_max('day', SENSOR_NAMES.index('glycol_in') - 1)
+    glycol_roof_max = aggregator.current_max('day', SENSOR_NAMES.index('glycol_in_roof') - 1)
+    upload_spool.put(date_time_utc, sensor_vals_string, glycol_in_max, glycol_roof_max)
+
+def upload_lines(date_time_utc, lines, glycol_in_max, glycol_roof_max):
+    # merges one batch of spooled lines into its hour document
+    global lastHourDocumentRef
+    lastHourDocumentRef = firebase_admin_file.write_lines(date_time_utc, lines, lastHourDocumentRef, glycol_in_max, glycol_roof_max, aggregator)
+
+def replay_spool():
+    '''
+     When write to firebase fails.
+     "An exception of type ValueError occurred: The transaction has no transaction ID, so it cannot be rolled back."
+     The lines stay in the spool and are retried on the next tick.
+    '''
+    backlog = upload_spool.depth()
+    lag = upload_spool.lag()
     try:
-        # get temperature sensors
-        sensor_obj = DS18B20()
-        num_of_sensors = sensor_obj.device_count()
+        uploaded = upload_spool.replay(upload_lines, SPOOL_BATCH_SIZE)
+    finally:
+        # the health signal during an outage, also when the replay failed
+        METRICS.set('spool_depth', upload_spool.depth())
+        METRICS.set('spool_lag_seconds', round(upload_spool.lag(), 1))
+    if backlog > 1:
+        log.info(f"replayed {uploaded} spooled lines. oldest was {lag:.0f}s behind.  {upload_spool.stats()}")
+
+def sweep_retention():
+    # deletes expired hour documents and reports how many and how long it took
+    deleted = retention_sweeper.sweep()
+    if deleted:
+        log.info(f"retention sweep deleted {deleted} hour documents in {retention_sweeper.last_duration:.2f}s.  {retention_sweeper.stats()}")
+
+async def retention_loop():
+    '''
+     Runs the retention sweeper on its own schedule, off the sampling path.
+    '''
+    while True:
+        await run_sink('retention', sweep_retention)
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+def export_metrics():
+    # never raises, a failed export must not count towards a reboot
+    try:
+        METRICS.write_textfile(metrics_file)
+    except Exception as error:
+        log.error(f"metrics export to {metrics_file} failed: {error}")
+
+async def metrics_loop():
+    '''
+     Writes the metrics file on its own schedule, off the sampling path.
+    '''
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        await asyncio.to_thread(export_metrics)
+
+async def text_flush_loop():
+    '''
+     Writes buffered text lines that are TEXT_FLUSH_INTERVAL old,
+     so a stalled sampling loop doesn't leave them in memory.
+    '''
+    while True:
+        await asyncio.sleep(TEXT_FLUSH_CHECK)
+        await run_sink('text_file', text_archive.flush_due)
 
+async def run_sink(name, func, *args):
+    """
+    -------------------------------------------------------
+    Runs one storage sink in a worker thread.
+    Errors are counted and logged here so one failing sink
+    doesn't stop the others. Errors of OFFLINE_SINKS are only
+    logged, they don't count towards a reboot. Its time is
+    recorded under its name, not counting the wait for its
+    previous write.
+    -------------------------------------------------------
+    """
+    global error_count_other
+    lock = sink_locks.setdefault(name, asyncio.Lock())
+    async with lock:
+        try:
+            with METRICS.timer(name):
+                await asyncio.to_thread(func, *args)
+        except Exception as error:
+            if DEBUG_PRINT:
+                print(f"---------ERROR--------{name}--------{type(error)}--------\n {error}")
+            METRICS.inc('sink_errors', sink=name)
+            if name in OFFLINE_SINKS:
+                log.warning(f"An exception of type {type(error).__name__} occurred in {name}: {error}",
+                            extra=fields(spool_depth=upload_spool.depth(), spool_lag=round(upload_spool.lag())))
+                return
+            error_count_other += 1
+            log.error(f"An exception of type {type(error).__name__} occurred in {name}: {error}", extra=fields(error_count=error_count_other))
+
+async def check_error_count():
+    """
+    -------------------------------------------------------
+    Reboots when too many errors have been counted.
+    -------------------------------------------------------
+    """
+    if error_count_other >= MAX_ERRORS:
+        METRICS.inc('reboots', reason='error_count')
+        log.critical(f"REBOOTING due to error count of {error_count_other}.")
+        try:
+            # try/except here because we cant have errors here.
+            if DEBUG_NOTIFICATION:
+                send_notification('debug', 'error', f'REBOOTING @ {datetime.now().strftime("%a %I:%M %p")} due to error count of {error_count_other}.', key='reboot')
+        except:
+            log.error("Failed to send notification")
+            pass
+        await asyncio.sleep(60)
+        log.critical("REBOOTING now")
+        # the reboot notification is still on the dispatcher's queue
+        dispatcher.flush(FLUSH_TIMEOUT)
+        stop_logging()
+        subprocess_call('sudo reboot', shell=True)
+
+async def sample(deadline):
+    """
+    -------------------------------------------------------
+    One tick of the logger. Reads the sensors then hands the reading
+    to every sink. Sinks run in the background, so the next deadline
+    only waits for the sweep.
+    deadline - scheduled epoch time of this tick (float)
+    -------------------------------------------------------
+    """
+    global previousReadingObj, error_count_other, replay_task
+    # how late the tick started. the budget left for the sweep is INTERVAL minus this
+    METRICS.observe('start_lag', max(0.0, time() - deadline))
+    try:
         # datetime for firebase
-        date_time_utc = datetime.now(timezone.utc)
+        date_time_utc = datetime.fromtimestamp(deadline, timezone.utc)
         date_time_utc = date_time_utc.replace(minute=0, second=0, microsecond=0)
-        #date_time_utc = date_time_utc.astimezone(timezone.utc)
 
-        # create time string
-        date_time_now = strftime('%Y-%m-%d %H:%M:%S')
+        # create time string from the scheduled time, not from when the sweep finished
+        date_time_now = strftime('%Y-%m-%d %H:%M:%S', localtime(deadline))
 
-        '''
-        Reboot if error count reaches set value. One or more sensors are not detected.
-        Rebooting helps when sensors are not being detected. Log the rest of the sensors.
-        Most of the time its the same sensor that isn't detected. Long cable issue. We can ignore this one.
-        '''
-        if num_of_sensors != SENSOR_COUNT:
-            if DEBUG_PRINT:
-                print(f"__ERROR  only found {num_of_sensors} / {SENSOR_COUNT} sensors")
-            
-            
-            error_count_sensors += 1
-            if error_count_sensors >= MAX_ERRORS:
-                logging_error(f'_ERROR_  detected only {num_of_sensors} / {SENSOR_COUNT} sensors.')
-                # reset 
-                error_count_sensors = 0
-                
-                if DEBUG_NOTIFICATION:
-                    firebase_admin_file.send_notification('debug', 'error', \
-                    f'REBOOTING @ {datetime.now().strftime("%a %I:%M %p")} \
-                    Detected only {num_of_sensors} / {SENSOR_COUNT} sensors.')
-                if REBOOT_ON_SENSOR_COUNT:
-                    logging_error(f'_ERROR_ REBOOTING because detected only {num_of_sensors} / {SENSOR_COUNT} sensors.')
-
-                    sleep(30)
-                    subprocess_call('sudo reboot', shell=True)
-            
-            elif DEBUG_NOTIFICATION and num_of_sensors < (SENSOR_COUNT - 1) and error_count_sensors >= MAX_ERRORS:
-                # Notify if more than one sensor isn't being detected.
-                firebase_admin_file.send_notification('debug', 'Warning', \
-                f'Detected only {num_of_sensors} / {SENSOR_COUNT} sensors.')
-                error_count_sensors = 0
-                
-        
         '''
         Begin reading sensors
         '''
-        # Read Available Sensors
-        if DEBUG_PRINT:
-            print("__reading sensors...")
-        readingObj = read_sensors(sensor_obj, previousReadingObj, date_time_now, num_of_sensors, ROUNDING)
+        readingObj = await asyncio.to_thread(sweep, date_time_now)
         sensor_vals_tuple = readingObj.get_solar_tuple()
         sensor_vals_string = readingObj.get_solar_str()
+        readings = tuple(zip(ReadingObj.FIELDS, readingObj.as_tuple()))
         if DEBUG_PRINT:
             print(sensor_vals_string)
         '''
@@ -147,68 +459,74 @@ while True:
 
         previousReadingObj = readingObj
 
-        # Storage Location 1 - SQLite
-        write_to_sql_lite(sqlite_file_1, sensor_vals_tuple)
-      
-        # Storage Location 3 - text file
-        file_check(text_output_file)
-        with open(text_output_file, 'a') as output_file:
-            # write titles if required
-            output_file.write(sensor_vals_string + "\n")
-        output_file.close()
-        
-        # Storage Location 2 - SQLite USB
-        write_to_sql_lite(sqlite_file_2, sensor_vals_tuple)
+        for name, func, args in (
+                # Storage Location 1 - SQLite
+                ('sqlite_local', write_sqlite, (sqlite_writer_1, sensor_vals_tuple, deadline, readings)),
+                # Storage Location 3 - text file
+                ('text_file', write_text_file, (deadline, sensor_vals_string)),
+                # Storage Location 2 - SQLite USB
+                ('sqlite_usb', write_sqlite, (sqlite_writer_2, sensor_vals_tuple, deadline, readings)),
+                # Storage Location 5 - binary segments
+                ('ts_store', write_ts_store, (deadline, sensor_vals_tuple)),
+                # Storage Location 4 - Firebase firestore, through the spool
+                ('spool', spool_line, (deadline, date_time_utc, sensor_vals_tuple, sensor_vals_string))):
+            task = asyncio.create_task(run_sink(name, func, *args))
+            sink_tasks.add(task)
+            task.add_done_callback(sink_tasks.discard)
 
-        # Storage Location 4 - Firebase firestore
-        '''
-        TODO: deal with connection exceptions. record timestamps where exception occurs.
-        when connection is restored, write all failed lines to db.
-        Merging with previous hours will need to be done.
-        
-        if sensor isn't detected, the default value of None will be written to databases.
-        This crashes the android app. Either update app or do not write Nones.
-        -8_25_2024 workaround is to use 0.01 instead of None as default. not ideal but prevents app from crashing.
-        '''
-        
-        lastHourDocumentRef = firebase_admin_file.write_line(date_time_utc, sensor_vals_string, lastHourDocumentRef, readingObj)
-        
-    except ValueError as error:
-        '''
-         When write to firebase fails.
-         "An exception of type ValueError occurred: The transaction has no transaction ID, so it cannot be rolled back."
-         TODO
-         Write lines to file and upload them when connection is restored.
-         Check if file exists. If so, read line by line and firebase.write_line
-        '''
-        logging_error(f"An exception of type {type(error).__name__} occurred: {str(error)}\n    error_count: {error_count_other}\n\n", exc_info=False)
-        log_reading(sensor_vals_string)
-        error_count_other += 1
+        # upload whatever is spooled. skip if the last replay is still waiting on firestore.
+        if replay_task is None or replay_task.done():
+            replay_task = asyncio.create_task(run_sink('firestore', replay_spool))
 
     except Exception as error:
         if DEBUG_PRINT:
             print(f"---------ERROR--------{type(error)}--------\n {error}")
         error_count_other += 1        
-        logging_error(f"An exception of type {type(error).__name__} occurred: {str(error)}\n    error_count: {error_count_other}\n\n", exc_info=False)     
+        log.error(f"An exception of type {type(error).__name__} occurred: {error}", extra=fields(error_count=error_count_other))     
         
     finally:
         if DEBUG_PRINT:
-            print ('__waiting {} seconds...'.format(INTERVAL))
-        if error_count_other >= MAX_ERRORS:
-            logging_error(f"REBOOTING due to error count of {error_count_other}.")
-            try:
-                # try/except here because we cant have errors in the finally block.
-                if DEBUG_NOTIFICATION:
-                    firebase_admin_file.send_notification('debug', 'error', f'REBOOTING @ {datetime.now().strftime("%a %I:%M %p")} due to error count of {error_count_other}.')
-            except:
-                logging_error(f"Failed to send notification")
-                pass
-            sleep(60)
-            logging_error(f"REBOOTING now")
-            subprocess_call('sudo reboot', shell=True)
-
-
-        sleep(INTERVAL)
-        
+            print ('__next sample in {:.1f} seconds...'.format(scheduler.next_deadline(time()) - time()))
+        await check_error_count()
 
+async def main():
+    # the retention sweeper, the text flush and the metrics export run beside the sampling loop
+    retention_task = asyncio.create_task(retention_loop())
+    metrics_task = asyncio.create_task(metrics_loop()) if metrics_file is not None else None
+    text_flush_task = asyncio.create_task(text_flush_loop())
+    METRICS.set('sample_interval_seconds', INTERVAL)
+    if METRICS_PORT is not None:
+        try:
+            METRICS.serve(METRICS_PORT)
+        except OSError as error:
+            log.error(f"metrics endpoint on port {METRICS_PORT} failed to start: {error}")
+    try:
+        await scheduler.run(sample)
+    finally:
+        retention_task.cancel()
+        text_flush_task.cancel()
+        if metrics_task is not None:
+            metrics_task.cancel()
+
+def shutdown(signum, frame):
+    # turn SIGTERM into SystemExit so the writers get flushed
+    raise SystemExit(0)
 
+'''
+MAIN LOOP
+'''
+signal(SIGTERM, shutdown)
+try:
+    asyncio.run(main())
+finally:
+    # first, so a failing close below can't skip them
+    aggregator.save()
+    text_archive.close()
+    sqlite_writer_1.close()
+    sqlite_writer_2.close()
+    ts_store.close()
+    upload_spool.close()
+    if metrics_file is not None:
+        export_metrics()
+    # last, so the closes above can still log
+    stop_logging()
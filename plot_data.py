@@ -0,0 +1,41 @@
+'''
+------------------------------------------------------------------------
+Columnar loading of sample rows for the plotter.
+Rows come off the cursor in chunks and go straight into NumPy arrays:
+datetime64 timestamps and one float column per sensor, missing values
+as NaN. Load time and memory grow linearly with the rows, without a
+Python list per sensor.
+------------------------------------------------------------------------
+'''
+import numpy as np
+
+# rows fetched from the cursor at a time
+CHUNK_SIZE = 5000
+
+
+def fetch_columns(cursor, chunk_size=CHUNK_SIZE):
+    """
+    -------------------------------------------------------
+    Reads every row of an executed query shaped like the samples
+    table, "ts" (epoch seconds) first then the sensor values.
+    Use: cursor.execute('SELECT * FROM samples WHERE ts BETWEEN ? AND ?', (start, end))
+         times, values = fetch_columns(cursor)
+    -------------------------------------------------------
+    Returns:
+        times - row times, UTC (ndarray of datetime64[s])
+        values - one row per time, one column per sensor (2-D ndarray of float)
+    -------------------------------------------------------
+    """
+    width = len(cursor.description) - 1
+    time_chunks = list()
+    value_chunks = list()
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        # epoch seconds are datetime64[s] as they are, None values become NaN
+        time_chunks.append(np.array([row[0] for row in rows], dtype='datetime64[s]'))
+        value_chunks.append(np.array([row[1:] for row in rows], dtype=float).reshape(len(rows), width))
+    if not time_chunks:
+        return np.empty(0, dtype='datetime64[s]'), np.empty((0, width))
+    return np.concatenate(time_chunks), np.concatenate(value_chunks)
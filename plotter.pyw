@@ -5,8 +5,9 @@ pysimplegui lets you select the time frame to view. Either live graph or static.
 Animate function gets the data within the time frame. creates lists to provide Matplotlib.
 Matplotlib creates a few graphs.
 
+The database is mirrored into a local cache db. Each refresh only grabs the new rows.
+
 plans:
-    - can create a cache db, copy it all over to local drive, then only grab new rows..
     - make an option to view week by getting avg
 ------------------------------------------------------------------------
 Author: Luke Tatarsky
@@ -14,9 +15,16 @@ __updated__ = "2023-02-03"
 ------------------------------------------------------------------------
 '''
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+import numpy as np
 import sqlite3, time
 import PySimpleGUI as sg
 from datetime import datetime, timedelta
+from dateutil.tz import tzlocal
+from sqlite_storage import pick_rollup, select_rollup_sql
+from replica_cache import ReplicaCache
+from downsample import downsample
+from plot_data import fetch_columns
 
 # Constants
 TITLE_FONT_SIZE = 15
@@ -26,6 +34,23 @@ YTICK_SIZE = 12
 #SLOPE_MULTIPLIER = 6.05
 NUM_OF_SENSORS = 10
 
+# Each line is cut down to about the pixel width of its axes before plotting,
+# so render time stays the same however long the span is.
+DOWNSAMPLE_METHODS = {'LTTB': 'lttb', 'Min/Max': 'minmax', 'Off': None}
+
+# the database stores UTC epoch seconds, the x axis shows them in local time
+LOCAL_TZ = tzlocal()
+
+# Database written by the logger
+# LAN Remote database
+#SOURCE_DB = '//192.168.100.180/PiShare/shared_data.db'
+# WLAN Remote database
+#SOURCE_DB = '//192.168.100.181/PiShare/shared_data.db'
+# Local database
+SOURCE_DB = 'Output/shared_data.db'
+# Local copy the graphs are drawn from
+CACHE_DB = 'Output/plot_cache.db'
+
 t = []
 SENSOR_NAMES = ['Date',
             'glycol_out_roof',
@@ -40,6 +65,9 @@ SENSOR_NAMES = ['Date',
             'solar_t_out']
 
 
+# the first refresh copies everything, later ones only rows newer than the last synced ts
+replica = ReplicaCache(SOURCE_DB, CACHE_DB)
+
 fig, a = plt.subplots(3, 1)
 fig.set_figwidth(10)
 fig.set_figheight(8)
@@ -48,6 +76,110 @@ fig.set_figheight(8)
 # adjust the spacing between subplots
 fig.subplots_adjust(left=0.06, bottom=0.08, right=0.99, top=0.96, wspace=None, hspace=0.30)
 
+# subplot, series, legend label, colour of every line
+LINES = [(0, 'glycol_in_roof', 'Glyc In Rf', '#81018F'),
+         (0, 'glycol_in', 'Glyc In', '#cc0249'),
+         (0, 'glycol_out_st', 'Glyc Out ST', '#029357'),
+         (0, 'glycol_out_he', 'Glyc Out HE', '#004e92'),
+         (1, 'solar_t_high', 'High', '#cc0249'),
+         (1, 'solar_t_mid', 'Mid', '#D84315'),
+         (1, 'solar_t_low', 'Low', '#0097A7'),
+         (2, 'boiler_t_mid', 'Boiler T Mid', '#44007d'),
+         (2, 'boiler_t_out', 'Boiler T Out', '#704890'),
+         (2, 'solar_t_out', 'Solar T Out', '#F74D61')]
+
+# Artists are created once and updated in place. Everything that changes on a
+# refresh (lines, titles, x axis, legends drawn over the lines) is animated and
+# blitted over a saved background. The background is only redrawn when a y range changes.
+BLIT = fig.canvas.supports_blit
+background = None
+
+def setup_graph():
+    '''
+    creates every line, title, legend and grid once.
+    returns {series name: Line2D}
+    '''
+    lines = dict()
+    for n, name, label, color in LINES:
+        lines[name], = a[n].plot([], [], label=label, color=color, animated=BLIT)
+    for ax in a:
+        locator = mdates.AutoDateLocator(minticks=4, maxticks=8, tz=LOCAL_TZ)
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator, tz=LOCAL_TZ))
+        ax.set_title('', fontsize=TITLE_FONT_SIZE)
+        ax.title.set_animated(BLIT)
+        ax.xaxis.set_animated(BLIT)
+        ax.legend(loc='lower left').set_animated(BLIT)
+        ax.grid(True)
+        ax.tick_params(axis='x',labelsize=XTICK_SIZE)
+        ax.tick_params(axis='y',labelsize=YTICK_SIZE)
+    a[2].set_ylabel(('Temp *C'), fontsize = TITLE_FONT_SIZE-1)
+    a[2].xaxis.label.set_fontsize(TITLE_FONT_SIZE)
+    return lines
+
+def draw_animated():
+    '''
+    draws the changing artists of every subplot, x axis first so the grid stays under the lines
+    '''
+    for ax in a:
+        fig.draw_artist(ax.xaxis)
+        for line in ax.get_lines():
+            fig.draw_artist(line)
+        fig.draw_artist(ax.get_legend())
+        fig.draw_artist(ax.title)
+
+def on_draw(event):
+    '''
+    a full draw (first show, resize, new y range) saves the background to blit over
+    '''
+    global background
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    draw_animated()
+
+def autoscale_y(ax):
+    '''
+    sets new y limits only when the data left the current ones or uses less than half of them.
+    returns True if the limits changed
+    '''
+    ys = [line.get_ydata() for line in ax.get_lines()]
+    ys = np.concatenate(ys) if ys else np.empty(0)
+    if not np.isfinite(ys).any():
+        return False
+    low, high = np.nanmin(ys), np.nanmax(ys)
+    bottom, top = ax.get_ylim()
+    if low >= bottom and high <= top and (top - bottom) <= 2 * (high - low) + 2:
+        return False
+    margin = (high - low) * 0.05 or 1
+    ax.set_ylim(low - margin, high + margin)
+    return True
+
+def redraw():
+    '''
+    blits the changed artists, or draws the whole figure when the background is stale
+    '''
+    relimited = [autoscale_y(ax) for ax in a]
+    if not BLIT or background is None or any(relimited):
+        fig.canvas.draw()
+        return
+    fig.canvas.restore_region(background)
+    draw_animated()
+    fig.canvas.blit(fig.bbox)
+
+lines = setup_graph()
+if BLIT:
+    fig.canvas.mpl_connect('draw_event', on_draw)
+
+def reduce_series(ax, x, y):
+    '''
+    returns the x (matplotlib date numbers) and values of a series to plot,
+    cut down to about the pixel width of the axes.
+    '''
+    method = DOWNSAMPLE_METHODS[values['_downsample']]
+    if method is None:
+        return x, y
+    idx, y = downsample(y, int(ax.get_window_extent().width), method, x=x)
+    return x[idx], y
+
 def animate(start_time, end_time):
     '''
     ------------------------------------------------------
@@ -62,20 +194,11 @@ def animate(start_time, end_time):
     ------------------------------------------------------
     '''
     try:
-        # LAN Remote database
-        #conn = sqlite3.connect('//192.168.100.180/PiShare/shared_data.db')
-        # WLAN Remote database
-        #conn = sqlite3.connect('//192.168.100.181/PiShare/shared_data.db')
-        # Local database
-        conn = sqlite3.connect('Output/shared_data.db')
-        c = conn.cursor()
-    except:
-        print ('___ERROR___ Could not connect to data, check network connection\n\
-                Trying to connect to local db.')
-        #conn = sqlite3.connect('shared_data.db')
-        time.sleep(10)
-        conn = sqlite3.connect('/home/pi/temp_logger/solar_temperature_data.db')
-        c = conn.cursor()
+        replica.sync()
+    except sqlite3.Error as error:
+        print ('___ERROR___ Could not sync data, check network connection\n\
+                Showing cached data. {}'.format(error))
+    c = replica.conn.cursor()
     
     # create time string from current time
     #time_now = time.strftime('%Y-%m-%d %H:%M:%S')
@@ -99,131 +222,71 @@ def animate(start_time, end_time):
             'boiler_t_out',
             'solar_t_out']
 
-    date_l = list()
-    time_l = list()
-    glycol_in_roof = list()
-    glycol_in = list()
-    glycol_out_st = list()
-    glycol_out_he = list()
-    solar_t_high = list()
-    solar_t_mid = list()
-    solar_t_low = list()
-    boiler_t_mid = list()
-    boiler_t_out = list()
-    solar_t_out = list() 
     # sqlite call needs a tuple
     
-    # get all data between dates
-    y = (start_time,end_time)
-    c.execute('SELECT * FROM temperature WHERE Date BETWEEN ? AND ?;', y)
+    # get all data between dates, as epoch seconds
+    y = (int(start_time.timestamp()), int(end_time.timestamp()))
+    # long spans read the coarsest rollup table that still fills the plot width
+    rollup = pick_rollup((end_time - start_time).total_seconds(), fig.get_figwidth() * fig.dpi)
+    if rollup is not None:
+        try:
+            c.execute(select_rollup_sql(rollup, SENSOR_NAMES), y)
+        except sqlite3.OperationalError:
+            # the database has no rollup tables yet
+            rollup = None
+    if rollup is None:
+        c.execute('SELECT * FROM samples WHERE ts BETWEEN ? AND ?;', y)
 
     #c.execute('SELECT * FROM temperature WHERE Date_Time BETWEEN ? AND ? AND solar_high > 50;', y)
     try:
-        data = c.fetchall()
+        times, columns = fetch_columns(c)
     except:
         file = open('errors.txt', 'a+')
         file.write('{} error on fetchall comand\n'.format(datetime.now()))
         file.close()
         time.sleep(10)
-        data = c.fetchall()
-    conn.close()
+        times, columns = fetch_columns(c)
+    c.close()
     
     #t_time3 = datetime.now() # data recieved     for processing calc
     
-    # populate the lists
-    for line in data:
-        line = list(line)
-        # grab the date. we only need time for now. only the latest date is kept.
-        date = (line[0].split(' '))[0]
-        date_l.append(date)
-        # isolate time
-        line[0] = (line[0].split(' '))[1]
-        time_l.append(line[0])
-        glycol_in_roof.append(line[1])
-        glycol_in.append(line[2])
-        glycol_out_st.append(line[3])
-        glycol_out_he.append(line[4])
-        solar_t_high.append(line[5])
-        solar_t_mid.append(line[6])
-        solar_t_low.append(line[7])
-        boiler_t_mid.append(line[8])
-        boiler_t_out.append(line[9])
-        solar_t_out.append(line[10])
-
-    
-    
+    # one float array per sensor, NaN where a value is missing
+    series = {name: columns[:, i] for i, name in enumerate(SENSOR_NAMES[1:])}
+    # real dates on the x axis, spans over midnight and calendar views stay in order
+    x = mdates.date2num(times)
 
 # Graph setup
-    if len(time_l) >= 5:
+    if len(times) >= 5:
         # get the total time span for the graph        
-        t1 = '{} {}'.format(date_l[0], time_l[0])
-        dt1 = datetime.fromisoformat(t1)         # first date time in retrieved data
-        t2 = '{} {}'.format(date_l[-1], time_l[-1])
-        dt2 = datetime.fromisoformat(t2)      # last date time in retrieved data
+        dt1 = datetime.fromtimestamp(int(times[0].astype(np.int64)))         # first date time in retrieved data
+        dt2 = datetime.fromtimestamp(int(times[-1].astype(np.int64)))      # last date time in retrieved data
         span = dt2-dt1
         
         # testing print
         #print('Last Update:  {}'.format(dt2))        
-        #print('# of ticks: {}  |  Time Span: {}'.format(len(time_l),span))
+        #print('# of ticks: {}  |  Time Span: {}'.format(len(times),span))
         
 # subplot 0  , glycol in/out
-        a[0].clear()
-        a[0].set_title('Glycol Roof: {}   |   Glycol In: {}   |   Glycol Out: {}'
-         .format( round(glycol_in_roof[-1], TITLE_ROUNDING), round(glycol_in[-1], TITLE_ROUNDING), round(glycol_out_st[-1], TITLE_ROUNDING), ), fontsize=TITLE_FONT_SIZE)
-        
-        a[0].set_xticks([0, len(time_l)//5, (len(time_l)//5)*2, (len(time_l)//5)*3,(len(time_l)//5)*4, len(time_l)-1])
-        
-        #a[0].plot(ar_t,ar06, label='Panel High', color='#228B22')
-        a[0].plot(time_l, glycol_in_roof, label='Glyc In Rf', color='#81018F')
-        a[0].plot(time_l, glycol_in, label='Glyc In', color='#cc0249')
-        a[0].plot(time_l, glycol_out_st, label='Glyc Out ST', color='#029357')
-        a[0].plot(time_l, glycol_out_he, label='Glyc Out HE', color='#004e92')
-
-        a[0].legend(loc='lower left')
+        a[0].title.set_text('Glycol Roof: {}   |   Glycol In: {}   |   Glycol Out: {}'
+         .format( round(series['glycol_in_roof'][-1], TITLE_ROUNDING), round(series['glycol_in'][-1], TITLE_ROUNDING), round(series['glycol_out_st'][-1], TITLE_ROUNDING), ))
 
 # subplot 1  ,  Solar Tank Temperatures, high, mid, low, lowest
-        a[1].clear()
-        a[1].set_title('Solar Tank       High: {}   |   Mid: {}   |   Low: {}'.format(
-            round(solar_t_high[-1], TITLE_ROUNDING), round(solar_t_mid[-1], TITLE_ROUNDING), round(solar_t_low[-1], TITLE_ROUNDING)), fontsize=TITLE_FONT_SIZE)
-        
-        a[1].set_xticks([0, len(time_l)//5, (len(time_l)//5)*2, (len(time_l)//5)*3,(len(time_l)//5)*4, len(time_l)-1])
-        
-        a[1].plot(time_l,solar_t_high, label='High', color='#cc0249')
-        a[1].plot(time_l,solar_t_mid, label='Mid', color='#D84315')
-        a[1].plot(time_l,solar_t_low, label='Low', color='#0097A7')
-        
-        a[1].legend(loc='lower left')
+        a[1].title.set_text('Solar Tank       High: {}   |   Mid: {}   |   Low: {}'.format(
+            round(series['solar_t_high'][-1], TITLE_ROUNDING), round(series['solar_t_mid'][-1], TITLE_ROUNDING), round(series['solar_t_low'][-1], TITLE_ROUNDING)))
 
 # subplot 2  ,  Boiler out, solar tank out, Boiler mid, Room temp
-        a[2].clear()
         #a[2].set_title('Boiler Tank Mid: {}    |    Boiler t Out: {}    |    Solar t Out: {}'\
         #.format(round(boiler_mid[-1], TITLE_ROUNDING), round(boiler_out[-1],TITLE_ROUNDING), round(solar_out[-1],TITLE_ROUNDING)), fontsize = TITLE_FONT_SIZE)
-        a[2].set_title('Boiler Tank Mid: {}'\
-        .format(round(boiler_t_mid[-1], TITLE_ROUNDING)), fontsize = TITLE_FONT_SIZE)
-        
-        a[2].set_xticks([0, len(time_l)//5, (len(time_l)//5)*2, (len(time_l)//5)*3,(len(time_l)//5)*4, len(time_l)-1])
-        a[2].set_ylabel(('Temp *C'), fontsize = TITLE_FONT_SIZE-1)
-        a[2].set_xlabel('Time Span: {}      |     {}'.format(span, dt2.strftime('%A, %B %d, %Y')), fontsize = TITLE_FONT_SIZE)
-        
-        a[2].plot(time_l,boiler_t_mid, label='Boiler T Mid', color='#44007d')
-        a[2].plot(time_l,boiler_t_out, label='Boiler T Out', color='#704890')
-        a[2].plot(time_l,solar_t_out, label='Solar T Out', color='#F74D61')
-         
-        a[2].legend(loc='lower left')
-
-        # enable grids
-        a[0].grid(True)
-        a[1].grid(True)
-        a[2].grid(True)
-        
+        a[2].title.set_text('Boiler Tank Mid: {}'\
+        .format(round(series['boiler_t_mid'][-1], TITLE_ROUNDING)))
+        a[2].xaxis.label.set_text('Time Span: {}      |     {}'.format(span, dt2.strftime('%A, %B %d, %Y')))
+
+        # update the lines in place
+        for n, name, label, color in LINES:
+            lines[name].set_data(*reduce_series(a[n], x, series[name]))
+        for ax in a:
+            ax.set_xlim(mdates.date2num(start_time.astimezone()), mdates.date2num(end_time.astimezone()))
 
-        a[0].tick_params(axis='x',labelsize=XTICK_SIZE)
-        a[1].tick_params(axis='x',labelsize=XTICK_SIZE)
-        a[2].tick_params(axis='x',labelsize=XTICK_SIZE)
-        a[0].tick_params(axis='y',labelsize=YTICK_SIZE)
-        a[1].tick_params(axis='y',labelsize=YTICK_SIZE)
-        a[2].tick_params(axis='y',labelsize=YTICK_SIZE)
-    
    #  dt2  last date time in retrieved data
     #return t_time2,t_time3,dt2
     return dt2
@@ -238,7 +301,7 @@ def graph_refresh(start_t, end_t):
     #t_time1 = datetime.now()    # to get processing time
     #t_time2, t_time3, dt2 = animate(start_t, end_t)
     dt2 = animate(start_t, end_t)
-    fig.canvas.draw()
+    redraw()
     
     #t_time4 = datetime.now() # graphed    # to get processing time
     #time_log = open('time_log.csv', 'a+')
@@ -262,7 +325,7 @@ def show_hour(end_time):
     return dt2
 
 width = 350
-height = 350
+height = 380
 
 sg.theme('DarkAmber')   # Add a touch of color
 # Hour Slider
@@ -293,6 +356,7 @@ layout = [  [sg.Text('Select how many hours to display', key='_TEXT', size=(widt
             [sg.Text('Last update:', key='_LASTUP', size=(width,1), font=('MS Sans Serif', 11))],
             [sg.Text('                Hours:', font=('MS Sans Serif', 10)), sg.Slider(**slider1, key='_hours')],
             [sg.Text('Live Refresh Interval:', font=('MS Sans Serif', 10)), sg.Slider(**slider2, key='_refresh')],
+            [sg.Text('         Downsample:', font=('MS Sans Serif', 10)), sg.Combo(list(DOWNSAMPLE_METHODS), default_value='LTTB', key='_downsample', readonly=True, font=('MS Sans Serif', 10))],
             [sg.Button('Show Static Graph', key='_showhour', enable_events=True , font=('MS Sans Serif', 10, 'bold')),\
                 sg.Button('Show Live Graph', key='_live', enable_events=True , font=('MS Sans Serif', 10, 'bold'))], 
             [sg.Text('          ')],      
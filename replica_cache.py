@@ -0,0 +1,119 @@
+'''
+------------------------------------------------------------------------
+Local replica of the logger database for the plotter.
+The first sync copies the samples table (and any rollup tables)
+from the source, usually the Pi's SMB share, into a cache database on
+the local drive. Every sync after that only asks the source for rows
+newer than the last "ts" already cached, so a live refresh over the
+network is one small range read on the samples key. Graphs are then
+drawn from the cache.
+
+If the source can't be reached the cache keeps serving what it has.
+------------------------------------------------------------------------
+'''
+from os import path as os_path
+from sqlite3 import connect as sqlite_connect, Error as SQLiteError, OperationalError
+from time import monotonic
+
+from sqlite_storage import ROLLUPS, column_names_of, create_rollup_sql, create_schema, has_text_dates
+
+
+class ReplicaCache:
+    """
+    -------------------------------------------------------
+    Mirrors a source database into a local cache database.
+    Use: replica = ReplicaCache('//192.168.100.180/PiShare/shared_data.db', 'Output/plot_cache.db')
+         replica.sync()
+         replica.conn.execute('SELECT * FROM samples WHERE ts BETWEEN ? AND ?', (start, end))
+    -------------------------------------------------------
+    """
+    def __init__(self, source_location, cache_location):
+        """
+        -------------------------------------------------------
+        Parameters:
+            source_location - database written by the logger (str)
+            cache_location - local cache database, created if missing (str)
+        -------------------------------------------------------
+        """
+        self.source_location = source_location
+        self.cache_location = cache_location
+        self.conn = sqlite_connect(cache_location, isolation_level=None)
+        try:
+            self.last_synced = self.conn.execute("SELECT MAX(ts) FROM samples").fetchone()[0]
+        except SQLiteError:
+            # new cache, the first sync creates the tables
+            self.last_synced = None
+        self.last_rows = 0
+        self.last_duration = 0.0
+        self.last_error = None
+
+    def sync(self):
+        """
+        -------------------------------------------------------
+        Copies rows newer than the last synced "ts" from the source.
+        A cache from before epoch seconds is dropped and copied again.
+        Rollup tables are refreshed from their last cached bucket on,
+        that bucket may have grown since.
+        Raises sqlite3.Error if the source can't be read, the cache is
+        left as it was.
+        -------------------------------------------------------
+        Returns:
+            rows - temperature rows copied (int)
+        -------------------------------------------------------
+        """
+        start = monotonic()
+        try:
+            # ATTACH would create an empty database where the share should be
+            if not os_path.exists(self.source_location):
+                raise OperationalError(f"source database not found: {self.source_location}")
+            self.conn.execute("ATTACH DATABASE ? AS source", (self.source_location,))
+        except SQLiteError as error:
+            self.last_error = error
+            raise
+        try:
+            self.conn.execute("BEGIN")
+            try:
+                rows = self._copy_temperature()
+                self._copy_rollups()
+                self.conn.execute("COMMIT")
+            except SQLiteError as error:
+                # some errors already rolled the transaction back
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                self.last_error = error
+                raise
+        finally:
+            self.conn.execute("DETACH DATABASE source")
+        self.last_rows = rows
+        self.last_duration = monotonic() - start
+        self.last_error = None
+        return rows
+
+    def _copy_temperature(self):
+        column_names = [row[1] for row in self.conn.execute('PRAGMA source.table_info("temperature")')]
+        if has_text_dates(self.conn):
+            # only a copy, so it is started again from the source instead of migrated
+            self.conn.execute('DROP TABLE main."temperature"')
+            for table in ROLLUPS:
+                self.conn.execute(f'DROP TABLE IF EXISTS main."{table}"')
+        create_schema(self.conn, column_names)
+        last = self.conn.execute("SELECT MAX(ts) FROM main.samples").fetchone()[0]
+        cursor = self.conn.execute("INSERT INTO main.samples SELECT * FROM source.samples WHERE ts > ?",
+                                   (-1 if last is None else last,))
+        if cursor.rowcount:
+            self.last_synced = self.conn.execute("SELECT MAX(ts) FROM main.samples").fetchone()[0]
+        return cursor.rowcount
+
+    def _copy_rollups(self):
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM source.sqlite_master WHERE type = 'table'")}
+        column_names = column_names_of(self.conn)
+        for table in ROLLUPS:
+            if table not in tables:
+                continue
+            self.conn.execute(create_rollup_sql(table, column_names))
+            last = self.conn.execute(f'SELECT MAX("bucket") FROM main."{table}"').fetchone()[0]
+            self.conn.execute(f'INSERT OR REPLACE INTO main."{table}" SELECT * FROM source."{table}" WHERE "bucket" >= ?',
+                              (last or 0,))
+
+    def close(self):
+        self.conn.close()
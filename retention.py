@@ -0,0 +1,123 @@
+'''
+------------------------------------------------------------------------
+Retention sweeper for the Firestore hour documents.
+Hour documents older than a week are removed in pages ordered by 'hour'
+and document id, each page deleted with one batched write of up to 500
+documents (the Firestore batch limit). The next page starts after the
+last document of the one before, so documents sharing an hour across a
+page boundary are not skipped.
+
+Every sweep scans from the oldest document up to the cutoff. Deleted
+documents are gone, so this reads little more than what gets deleted,
+and an old hour document written after a sweep is still found.
+Nothing needs to be kept between sweeps.
+
+Runs on its own schedule in the logger, never inside a sample.
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# most writes Firestore accepts in one batch
+MAX_BATCH = 500
+
+
+class RetentionSweeper:
+    """
+    -------------------------------------------------------
+    Deletes expired hour documents in batched pages.
+    Use: sweeper = RetentionSweeper('test')
+         deleted = sweeper.sweep()
+    -------------------------------------------------------
+    """
+    def __init__(self, collection_name='test', retention=timedelta(weeks=1), page_size=MAX_BATCH,
+                 client=None):
+        """
+        -------------------------------------------------------
+        Parameters:
+            collection_name - collection of hour documents (str)
+            retention - how long hour documents are kept (timedelta)
+            page_size - documents read and deleted per batch, at most 500 (int)
+            client - firestore client. None uses firebase_admin_file.get_db()
+        -------------------------------------------------------
+        """
+        self.collection_name = collection_name
+        self.retention = retention
+        self.page_size = min(page_size, MAX_BATCH)
+        self._client = client
+        # cutoff of the last sweep that finished, for stats
+        self.last_cutoff = None
+        self.last_deleted = 0
+        self.last_duration = 0.0
+        self.total_deleted = 0
+        self.sweeps = 0
+
+    def _db(self):
+        if self._client is None:
+            from firebase_admin_file import get_db
+            return get_db()
+        return self._client
+
+    def sweep(self, now=None):
+        """
+        -------------------------------------------------------
+        Deletes every hour document older than the retention period.
+        Each page is committed before the next is read, so a failed
+        sweep loses nothing and the next one picks up what is left.
+        -------------------------------------------------------
+        Parameters:
+            now - time the retention is measured from, default now (datetime)
+        Returns:
+            deleted - number of documents deleted (int)
+        -------------------------------------------------------
+        """
+        start = perf_counter()
+        if now is None:
+            now = datetime.now(timezone.utc)
+        cutoff = now - self.retention
+        query = (self._db().collection(self.collection_name)
+                 .where(filter=FieldFilter('hour', '<=', cutoff))
+                 .order_by('hour')
+                 .order_by(FieldPath.document_id())
+                 .limit(self.page_size))
+        last = None
+        deleted = 0
+        try:
+            while True:
+                page = query if last is None else query.start_after(last)
+                docs = page.get()
+                if not docs:
+                    break
+
+                batch = self._db().batch()
+                for doc in docs:
+                    batch.delete(doc.reference)
+                batch.commit()
+                deleted += len(docs)
+
+                last = docs[-1]
+                if len(docs) < self.page_size:
+                    break
+            self.last_cutoff = cutoff
+        finally:
+            self.last_deleted = deleted
+            self.last_duration = perf_counter() - start
+            self.total_deleted += deleted
+            self.sweeps += 1
+        return deleted
+
+    def stats(self):
+        """
+        -------------------------------------------------------
+        Returns deleted counts and the duration of the last sweep.
+        -------------------------------------------------------
+        """
+        return {
+            'last_deleted': self.last_deleted,
+            'last_duration': self.last_duration,
+            'total_deleted': self.total_deleted,
+            'sweeps': self.sweeps,
+            'last_cutoff': self.last_cutoff.isoformat() if self.last_cutoff else None}
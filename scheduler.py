@@ -0,0 +1,69 @@
+'''
+------------------------------------------------------------------------
+Deadline driven sampling scheduler.
+Samples fire on a fixed wall clock grid (multiples of the interval since
+the epoch) instead of sleep(INTERVAL) after each cycle, so the time spent
+reading and writing does not stretch the period.
+A tick that runs past the next deadline is recorded as an overrun and
+the missed slots are skipped. The grid itself never shifts.
+------------------------------------------------------------------------
+'''
+import asyncio
+from math import floor
+from time import time
+
+
+class SampleScheduler:
+    """
+    -------------------------------------------------------
+    Calls an async sample function on fixed wall clock deadlines.
+    Use: await SampleScheduler(18.9, on_overrun).run(sample)
+    -------------------------------------------------------
+    """
+    def __init__(self, interval, on_overrun=None):
+        """
+        -------------------------------------------------------
+        Parameters:
+            interval - seconds between samples (float)
+            on_overrun - called with (deadline, duration, missed ticks)
+                         when a sample runs past the next deadline
+        -------------------------------------------------------
+        """
+        self.interval = interval
+        self.on_overrun = on_overrun
+        self.ticks = 0
+        self.overruns = 0
+        self.missed_ticks = 0
+        self.last_duration = 0.0
+
+    def next_deadline(self, now):
+        # first grid point strictly after now
+        return (floor(now / self.interval) + 1) * self.interval
+
+    async def run(self, sample):
+        """
+        -------------------------------------------------------
+        Runs forever. sample(deadline) is awaited once per tick,
+        deadline is the scheduled epoch time of the tick (float).
+        -------------------------------------------------------
+        """
+        deadline = self.next_deadline(time())
+        while True:
+            # sleep against the wall clock every tick so drift can't build up
+            await asyncio.sleep(max(0.0, deadline - time()))
+            try:
+                await sample(deadline)
+            finally:
+                finished = time()
+                self.ticks += 1
+                self.last_duration = finished - deadline
+                next_deadline = deadline + self.interval
+                if finished > next_deadline:
+                    # skip the slots that were missed, stay on the grid
+                    missed = int((finished - next_deadline) // self.interval) + 1
+                    self.overruns += 1
+                    self.missed_ticks += missed
+                    next_deadline += missed * self.interval
+                    if self.on_overrun is not None:
+                        self.on_overrun(deadline, self.last_duration, missed)
+                deadline = next_deadline
@@ -0,0 +1,78 @@
+'''
+------------------------------------------------------------------------
+Sensor registry. Which DS18B20 address is which sensor, its calibration
+offset and its group, read from sensors.json instead of being written
+into ReadingObj.
+
+Adding a sensor is a line in sensors.json. It is read, calibrated and
+stored in the long format readings table with no code or schema edits.
+Sensors in the 'solar' group are also the columns of the temperature
+table, in file order. Those columns are fixed once a database or
+ts_store exists. Changing the group makes the logger refuse to start
+(sqlite_storage.check_database, TimeSeriesStore) until it is pointed
+at a new database and store. Other groups can change freely.
+------------------------------------------------------------------------
+'''
+from collections import namedtuple
+from json import load as json_load
+from os import path as os_path
+
+SENSORS_FILE = os_path.join(os_path.dirname(os_path.abspath(__file__)), 'sensors.json')
+
+# group whose sensors are the temperature table columns
+SOLAR_GROUP = 'solar'
+
+Sensor = namedtuple('Sensor', ['address', 'name', 'offset', 'group'])
+
+
+class SensorRegistry:
+    """
+    -------------------------------------------------------
+    Ordered, read only table of the sensors.
+    Use: registry = SensorRegistry.from_file('sensors.json')
+         registry.mapping['1e37'] -> 'glycol_in'
+    -------------------------------------------------------
+    """
+    def __init__(self, sensors):
+        """
+        -------------------------------------------------------
+        Parameters:
+            sensors - Sensor tuples in storage order (list)
+        Raises ValueError on a repeated address or name, or a name
+        that can't be a column or attribute name.
+        -------------------------------------------------------
+        """
+        self.sensors = tuple(sensors)
+        self.names = tuple(s.name for s in self.sensors)
+        # maps the sensors address to its name
+        self.mapping = {s.address: s.name for s in self.sensors}
+        # calibration offset by address
+        self.offsets = {s.address: s.offset for s in self.sensors}
+        self.by_name = {s.name: s for s in self.sensors}
+        if len(self.mapping) != len(self.sensors) or len(self.by_name) != len(self.sensors):
+            raise ValueError("sensor addresses and names must be unique")
+        for name in self.names:
+            if not name.isidentifier() or name.startswith('_') or name == 'Date':
+                raise ValueError(f"sensor name {name!r} can't be used as a column name")
+
+    @classmethod
+    def from_file(cls, file_name=SENSORS_FILE):
+        """
+        -------------------------------------------------------
+        Loads the registry from a json file:
+            {"sensors": [{"address": "1e37", "name": "glycol_in",
+                          "offset": 0, "group": "solar"}, ...]}
+        -------------------------------------------------------
+        """
+        with open(file_name) as file:
+            config = json_load(file)
+        return cls(Sensor(str(s['address']), str(s['name']), float(s.get('offset', 0)), s.get('group', ''))
+                   for s in config['sensors'])
+
+    def group_names(self, group):
+        # names of the sensors in one group, in order
+        return tuple(s.name for s in self.sensors if s.group == group)
+
+
+# shared registry for the logger
+REGISTRY = SensorRegistry.from_file()
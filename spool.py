@@ -0,0 +1,163 @@
+'''
+------------------------------------------------------------------------
+Durable offline spool for Firestore uploads.
+Every hourly document line is stored here first. The replayer drains
+the spool in time order, in batches, through an upload function and
+only removes lines once they were accepted. A Firestore outage leaves
+the lines waiting on disk instead of losing them.
+
+The spool is bounded. Past max_rows the oldest lines are dropped and
+handed to on_drop so they can still be logged.
+------------------------------------------------------------------------
+'''
+from datetime import datetime
+from sqlite3 import connect as sqlite_connect
+from threading import Lock
+from time import time
+
+
+class UploadSpool:
+    """
+    -------------------------------------------------------
+    SQLite backed queue of lines waiting to be uploaded.
+    Use: spool = UploadSpool('Output/upload_spool.db')
+         spool.put(date_time_utc, line, glycol_in, glycol_in_roof)
+         spool.replay(upload)
+    -------------------------------------------------------
+    """
+    def __init__(self, db_location, max_rows=200000, on_drop=None):
+        """
+        -------------------------------------------------------
+        Parameters:
+            db_location - location of the spool sql_lite db (str)
+            max_rows - most lines kept. 200000 is about 6 weeks at 19s (int)
+            on_drop - called with each line dropped when the spool is full
+        -------------------------------------------------------
+        """
+        self.max_rows = max_rows
+        self.on_drop = on_drop
+        self._lock = Lock()
+        self._conn = sqlite_connect(db_location, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS "spool" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "hour" TEXT NOT NULL,
+            "line" TEXT NOT NULL,
+            "glycol_in" REAL NULL,
+            "glycol_in_roof" REAL NULL,
+            "enqueued" REAL NOT NULL)""")
+        self._depth = self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        self.uploaded = 0
+        self.dropped = 0
+        self.last_replay_error = None
+
+    def put(self, date_time_utc, line, glycol_in, glycol_in_roof):
+        """
+        -------------------------------------------------------
+        Adds one line for the hour document of date_time_utc.
+        -------------------------------------------------------
+        Parameters:
+            date_time_utc - hour of the document (datetime)
+            line - csv line of sensor values (str)
+            glycol_in, glycol_in_roof - values used for the daily maximums (float)
+        -------------------------------------------------------
+        """
+        with self._lock:
+            self._conn.execute("INSERT INTO spool (hour, line, glycol_in, glycol_in_roof, enqueued) VALUES (?,?,?,?,?)",
+                               (date_time_utc.isoformat(), line, glycol_in, glycol_in_roof, time()))
+            self._depth += 1
+            if self._depth > self.max_rows:
+                self._drop_oldest(self._depth - self.max_rows)
+
+    def _drop_oldest(self, count):
+        rows = self._conn.execute("SELECT id, line FROM spool ORDER BY id LIMIT ?", (count,)).fetchall()
+        self._depth -= self._conn.execute("DELETE FROM spool WHERE id <= ?", (rows[-1][0],)).rowcount
+        self.dropped += len(rows)
+        if self.on_drop is not None:
+            for _id, line in rows:
+                self.on_drop(line)
+
+    def replay(self, upload, batch_size=100):
+        """
+        -------------------------------------------------------
+        Drains the spool oldest first. Consecutive lines of the same hour
+        are sent as one batch:
+            upload(date_time_utc, lines, glycol_in_max, glycol_roof_max)
+        A batch is deleted only after upload returns. If upload raises
+        the batch stays in the spool and replay stops.
+        put() may drop lines of the batch while upload runs, those are
+        counted as dropped, not uploaded.
+        Use: uploaded = spool.replay(upload)
+        -------------------------------------------------------
+        Parameters:
+            upload - function that merges lines into an hour document
+            batch_size - most lines read from the spool at once (int)
+        Returns:
+            uploaded - number of lines uploaded (int)
+        -------------------------------------------------------
+        """
+        uploaded = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT id, hour, line, glycol_in, glycol_in_roof FROM spool ORDER BY id LIMIT ?",
+                                          (batch_size,)).fetchall()
+            if not rows:
+                self.last_replay_error = None
+                return uploaded
+
+            # only the leading run of one hour, the next hour goes in the next batch
+            hour = rows[0][1]
+            batch = rows
+            for k, row in enumerate(rows):
+                if row[1] != hour:
+                    batch = rows[:k]
+                    break
+
+            lines = [row[2] for row in batch]
+            glycol_in_max = max((row[3] for row in batch if row[3] is not None), default=None)
+            glycol_roof_max = max((row[4] for row in batch if row[4] is not None), default=None)
+            try:
+                upload(datetime.fromisoformat(hour), lines, glycol_in_max, glycol_roof_max)
+            except Exception as error:
+                self.last_replay_error = error
+                raise
+
+            with self._lock:
+                # only the rows still here, the size cap may have dropped some meanwhile
+                removed = self._conn.execute("DELETE FROM spool WHERE id <= ?", (batch[-1][0],)).rowcount
+                self._depth -= removed
+            self.uploaded += removed
+            uploaded += removed
+
+    def depth(self):
+        # number of lines waiting to be uploaded
+        return self._depth
+
+    def lag(self):
+        """
+        -------------------------------------------------------
+        Returns seconds since the oldest waiting line was spooled.
+        0 when the spool is empty.
+        -------------------------------------------------------
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT enqueued FROM spool ORDER BY id LIMIT 1").fetchone()
+        return time() - row[0] if row else 0.0
+
+    def stats(self):
+        """
+        -------------------------------------------------------
+        Returns queue depth and lag metrics.
+        -------------------------------------------------------
+        """
+        return {
+            'depth': self.depth(),
+            'lag': self.lag(),
+            'uploaded': self.uploaded,
+            'dropped': self.dropped,
+            'last_error': repr(self.last_replay_error) if self.last_replay_error else None}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,734 @@
+'''
+------------------------------------------------------------------------
+Long lived SQLite writer for the sensor samples.
+One writer per database file keeps its connection open, creates the
+schema once, reuses one prepared INSERT and can group several samples
+into one commit. Each commit is an fsync on the SD card or USB stick,
+so fewer commits means less flash wear and less time in the loop.
+
+Samples are stored in the "samples" table keyed by "ts", UTC epoch
+seconds, as the INTEGER PRIMARY KEY. That is the rowid, so the table is
+kept in time order with no separate index, a range query compares
+integers and nothing has to parse a date string. DST changes no longer
+repeat or reorder keys.
+"temperature" is now a view of samples with the old shape, "Date" as
+local time text, for old readers. An INSERT into it still works, a
+trigger converts the date.
+
+Databases with the old "temperature" table (a "Date" text column) have
+to be converted once, with the logger stopped:
+    python sqlite_storage.py migrate /path/to/shared_data.db
+The old table is kept, renamed to "temperature_text". A writer refuses
+to open a database that is not converted yet.
+
+A writer with rollups also keeps min/max/avg tables at 1 minute,
+15 minutes, 1 hour and 1 day (local days), updated by an upsert in the
+same commit as each row. The 0.01 placeholder of a solar sensor that
+was not read counts as missing there, like NULL. Long range views read those instead of every raw row.
+Build them from the existing history with:
+    python sqlite_storage.py backfill /path/to/shared_data.db
+
+A writer with a sensor registry also stores every sensor, not only the
+temperature table columns, in the long format "readings" table keyed by
+(sensor_id, ts). ts is UTC epoch seconds. The key is the index, so a range
+query on one sensor never touches the others. "sensors" holds the registry.
+Copy an existing temperature table into it with:
+    python sqlite_storage.py long /path/to/shared_data.db
+
+Note: WAL needs shared memory and does not work when the database is
+opened over a network share. Use journal_mode='DELETE' for a database
+that is read over SMB.
+
+When a commit fails the connection is dropped and the uncommitted rows
+are kept, up to max_retained, and written again on the next write or
+flush. Older rows past that are given to on_drop.
+------------------------------------------------------------------------
+'''
+from collections import deque
+from itertools import tee
+from datetime import datetime
+from os import path as os_path
+from sqlite3 import OperationalError, connect as sqlite_connect
+from sys import argv
+from threading import Lock
+from time import monotonic, mktime, strptime
+
+# format of "Date" in the temperature view and the old table
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# the old temperature table is renamed to this by migrate
+BACKUP_TABLE = 'temperature_text'
+
+
+# rows a writer keeps while its commits fail, about 5 hours of samples
+MAX_RETAINED = 1000
+
+
+# value written for a solar sensor that was not read, instead of None
+PLACEHOLDER = 0.01
+
+# Rollup tables and their bucket size in seconds, finest first.
+# A bucket is the epoch second it starts at, a multiple of its size,
+# except 1 day buckets, which start at local midnight.
+DAY = 86400
+ROLLUPS = {
+    'temperature_1m': 60,
+    'temperature_15m': 900,
+    'temperature_1h': 3600,
+    'temperature_1d': DAY}
+
+
+CREATE_SENSORS_SQL = '''CREATE TABLE IF NOT EXISTS "sensors" (
+        "id" INTEGER PRIMARY KEY,
+        "address" TEXT NOT NULL UNIQUE,
+        "name" TEXT NOT NULL UNIQUE,
+        "offset" REAL NULL,
+        "group" TEXT NULL)'''
+
+# one row per sensor per sample. WITHOUT ROWID stores the rows in key order
+CREATE_READINGS_SQL = '''CREATE TABLE IF NOT EXISTS "readings" (
+        "sensor_id" INTEGER NOT NULL,
+        "ts" INTEGER NOT NULL,
+        "value" REAL NULL,
+        PRIMARY KEY ("sensor_id", "ts")) WITHOUT ROWID'''
+
+INSERT_READING_SQL = 'INSERT OR REPLACE INTO "readings" ("sensor_id", "ts", "value") VALUES(?,?,?)'
+
+# range of one sensor by name. Parameters: name, start ts, end ts
+SELECT_SENSOR_RANGE_SQL = '''SELECT "ts", "value" FROM "readings"
+    WHERE "sensor_id" = (SELECT "id" FROM "sensors" WHERE "name" = ?) AND "ts" BETWEEN ? AND ? ORDER BY "ts"'''
+
+
+def create_table_sql(column_names):
+    """
+    -------------------------------------------------------
+    Returns the CREATE TABLE statement for the samples table.
+    column_names is the temperature shape, date first. The date
+    becomes "ts", the rest are sensor values.
+    -------------------------------------------------------
+    """
+    columns = ['"ts" INTEGER PRIMARY KEY']
+    columns.extend(f'"{name}" INTEGER NULL' for name in column_names[1:])
+    return 'CREATE TABLE IF NOT EXISTS "samples" (\n        ' + ',\n        '.join(columns) + ')'
+
+
+def create_view_sql(column_names):
+    """
+    -------------------------------------------------------
+    Returns the statements creating the "temperature" view, samples
+    in the old shape with the date as local time text, and the trigger
+    that turns an INSERT on the view into a samples row.
+    -------------------------------------------------------
+    """
+    names = ', '.join(f'"{name}"' for name in column_names[1:])
+    new_values = ', '.join(f'NEW."{name}"' for name in column_names[1:])
+    return [f'''CREATE VIEW IF NOT EXISTS "temperature" AS
+    SELECT datetime("ts", 'unixepoch', 'localtime') AS "{column_names[0]}", {names} FROM "samples"''',
+            f'''CREATE TRIGGER IF NOT EXISTS "temperature_insert" INSTEAD OF INSERT ON "temperature" BEGIN
+    INSERT OR IGNORE INTO "samples" VALUES(CAST(strftime('%s', NEW."{column_names[0]}", 'utc') AS INTEGER), {new_values});
+END''']
+
+
+def has_text_dates(conn):
+    # True while "temperature" is still the old table with a "Date" text column
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'temperature'").fetchone()
+    return row is not None and row[0] == 'table'
+
+
+def local_epochs(dates):
+    """
+    -------------------------------------------------------
+    Converts local time text, in logging order, to UTC epoch seconds.
+    When the clocks go back an hour repeats. The first pass through it
+    is daylight time. Once the local time steps backwards inside the
+    repeated hour the rows are the second pass, standard time, an hour
+    later. Yields None for an empty or unreadable date.
+    Use: epochs = list(local_epochs(['2024-11-03 01:45:00', '2024-11-03 01:30:10']))
+    -------------------------------------------------------
+    """
+    previous = None
+    second_pass = False
+    for text in dates:
+        try:
+            local = datetime.fromisoformat(text)
+        except (TypeError, ValueError):
+            yield None
+            continue
+        first = local.timestamp()
+        repeated = local.replace(fold=1).timestamp() != first
+        if not repeated:
+            second_pass = False
+        elif previous is not None and local < previous:
+            second_pass = True
+        previous = local
+        yield int(local.replace(fold=1).timestamp() if second_pass and repeated else first)
+
+
+def convert_to_epoch(conn):
+    """
+    -------------------------------------------------------
+    Copies the rows of an old "temperature" table into samples, renames
+    the old table to BACKUP_TABLE and puts the view in its place. "Date"
+    is local time, converted by local_epochs in rowid order. Rows with
+    an empty or unreadable "Date", and a second already stored, are
+    left out. They are still in the backup table.
+    Rollup tables with text buckets are rebuilt.
+    Runs in the caller's transaction.
+    -------------------------------------------------------
+    Returns:
+        copied - rows moved to samples (int)
+        dropped - rows left out (int)
+        backup - name the old table was renamed to (str)
+    -------------------------------------------------------
+    """
+    column_names = column_names_of(conn)
+    names = ', '.join(f'"{name}"' for name in column_names[1:])
+    conn.execute(create_table_sql(column_names))
+    total = conn.execute('SELECT COUNT(*) FROM "temperature"').fetchone()[0]
+    rows, dated_rows = tee(conn.execute(f'SELECT "{column_names[0]}", {names} FROM "temperature" ORDER BY rowid'))
+    converted = ((epoch,) + row[1:] for row, epoch in zip(rows, local_epochs(row[0] for row in dated_rows))
+                 if epoch is not None)
+    copied = conn.executemany(insert_sql(column_names), converted).rowcount
+    backup = BACKUP_TABLE
+    suffix = 1
+    while conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (backup,)).fetchone() is not None:
+        backup = f"{BACKUP_TABLE}_{suffix}"
+        suffix += 1
+    conn.execute(f'ALTER TABLE "temperature" RENAME TO "{backup}"')
+    for sql in create_view_sql(column_names):
+        conn.execute(sql)
+    for table in ROLLUPS:
+        bucket_type = [row[2] for row in conn.execute(f'PRAGMA table_info("{table}")') if row[1] == 'bucket']
+        if bucket_type and bucket_type[0] != 'INTEGER':
+            conn.execute(f'DROP TABLE "{table}"')
+            fill_rollup(conn, table, column_names)
+    return copied, total - copied, backup
+
+
+def check_converted(conn, db_location=''):
+    # raises when the database still has the old temperature table
+    if has_text_dates(conn):
+        raise OperationalError(f"{db_location} has the old temperature table. "
+                               f"Stop the logger and run: python sqlite_storage.py migrate {db_location}")
+
+
+def check_columns(conn, column_names, db_location=''):
+    # raises when the samples table holds other columns, i.e. the solar group in sensors.json changed
+    stored = column_names_of(conn)
+    if stored and stored != list(column_names):
+        raise ValueError(f"{db_location} stores the columns {stored}, not {list(column_names)}. "
+                         f"The 'solar' group in sensors.json doesn't match this database")
+
+
+def create_schema(conn, column_names):
+    """
+    -------------------------------------------------------
+    Creates the samples table and the temperature view.
+    Raises OperationalError on a database that still has the old
+    temperature table, see migrate, and ValueError when the table
+    has other columns. Runs in the caller's transaction.
+    -------------------------------------------------------
+    """
+    check_converted(conn)
+    check_columns(conn, column_names)
+    conn.execute(create_table_sql(column_names))
+    for sql in create_view_sql(column_names):
+        conn.execute(sql)
+
+
+def migrate(db_location):
+    """
+    -------------------------------------------------------
+    Converts a database with the old temperature table to epoch
+    seconds, keeping the old table as a backup. Does nothing to one
+    that is already converted. Run it once, with the logger stopped.
+    Going through years of rows can take a while on the Pi.
+    Use: migrate('/media/luke/USB4G/shared_data.db')
+    -------------------------------------------------------
+    Returns:
+        copied - rows moved to samples (int)
+        dropped - rows left out, see convert_to_epoch (int)
+        backup - the renamed old table, None if nothing was converted (str)
+        seconds taken (float)
+    -------------------------------------------------------
+    """
+    start = monotonic()
+    conn = sqlite_connect(db_location, isolation_level=None)
+    copied = dropped = 0
+    backup = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if has_text_dates(conn):
+                copied, dropped, backup = convert_to_epoch(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return copied, dropped, backup, monotonic() - start
+
+
+def check_database(db_location, column_names):
+    """
+    -------------------------------------------------------
+    Checks an existing database before the logger writes to it.
+    Does nothing when the file doesn't exist yet.
+    Raises OperationalError when it still has the old temperature
+    table, ValueError when it stores other sensor columns.
+    -------------------------------------------------------
+    """
+    if not os_path.exists(db_location):
+        return
+    conn = sqlite_connect(db_location)
+    try:
+        check_converted(conn, db_location)
+        check_columns(conn, column_names, db_location)
+    finally:
+        conn.close()
+
+
+def register_sensors(conn, registry):
+    """
+    -------------------------------------------------------
+    Creates the long format tables and adds or updates every sensor
+    of the registry. Ids never change once given out.
+    -------------------------------------------------------
+    Returns:
+        {sensor name: sensor id} (dict)
+    -------------------------------------------------------
+    """
+    conn.execute(CREATE_SENSORS_SQL)
+    conn.execute(CREATE_READINGS_SQL)
+    for sensor in registry.sensors:
+        conn.execute('''INSERT INTO "sensors" ("address", "name", "offset", "group") VALUES(?,?,?,?)
+            ON CONFLICT("address") DO UPDATE SET "name" = excluded."name", "offset" = excluded."offset", "group" = excluded."group"''',
+                     (sensor.address, sensor.name, sensor.offset, sensor.group))
+    return {name: sensor_id for sensor_id, name in conn.execute('SELECT "id", "name" FROM "sensors"')}
+
+
+def migrate_long(db_location, registry):
+    """
+    -------------------------------------------------------
+    Copies every value of the samples table into the readings table.
+    The database has to be migrated first.
+    Rows already in readings are kept, so it can run again.
+    Use: migrate_long('/media/luke/USB4G/shared_data.db', REGISTRY)
+    -------------------------------------------------------
+    Returns:
+        {column: rows copied} (dict)
+    -------------------------------------------------------
+    """
+    conn = sqlite_connect(db_location, isolation_level=None)
+    copied = dict()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            check_converted(conn, db_location)
+            sensor_ids = register_sensors(conn, registry)
+            for name in column_names_of(conn)[1:]:
+                if name not in sensor_ids:
+                    continue
+                cursor = conn.execute(f'''INSERT OR IGNORE INTO "readings" ("sensor_id", "ts", "value")
+                    SELECT ?, "ts", "{name}" FROM "samples" WHERE "{name}" IS NOT NULL''', (sensor_ids[name],))
+                copied[name] = cursor.rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return copied
+
+
+def insert_sql(column_names):
+    # one placeholder per column. A second that is already stored is skipped
+    return f'INSERT OR IGNORE INTO "samples" VALUES({",".join("?" * len(column_names))})'
+
+
+def bucket_start(epoch, seconds):
+    """
+    -------------------------------------------------------
+    Returns the start of the rollup bucket holding an epoch second.
+    A day starts at local midnight, 23 or 25 hours long over DST.
+    Use: bucket_start(1717238232, 900) -> 1717237800
+    -------------------------------------------------------
+    """
+    if seconds == DAY:
+        midnight = datetime.fromtimestamp(int(epoch)).replace(hour=0, minute=0, second=0)
+        return int(mktime(midnight.timetuple()))
+    return int(epoch) // seconds * seconds
+
+
+def bucket_sql(seconds):
+    # the same as bucket_start, as an sql expression on "ts"
+    if seconds == DAY:
+        return "CAST(strftime('%s', \"ts\", 'unixepoch', 'localtime', 'start of day', 'utc') AS INTEGER)"
+    return f'"ts" / {seconds} * {seconds}'
+
+
+def rollup_value(value):
+    # the placeholder is a missing value, not a reading
+    return None if value == PLACEHOLDER else value
+
+
+def create_rollup_sql(table, column_names):
+    """
+    -------------------------------------------------------
+    Returns the CREATE TABLE statement for one rollup table.
+    Each sensor keeps min, max, sum and a count of non missing values,
+    so two partial buckets merge exactly and avg is sum / n.
+    Placeholders are missing values.
+    -------------------------------------------------------
+    """
+    columns = ['"bucket" INTEGER PRIMARY KEY', '"rows" INTEGER NOT NULL']
+    for name in column_names[1:]:
+        columns.extend([f'"{name}_min" REAL NULL', f'"{name}_max" REAL NULL',
+                        f'"{name}_sum" REAL NULL', f'"{name}_n" INTEGER NOT NULL DEFAULT 0'])
+    return f'CREATE TABLE IF NOT EXISTS "{table}" (\n        ' + ',\n        '.join(columns) + ')'
+
+
+def upsert_rollup_sql(table, column_names):
+    """
+    -------------------------------------------------------
+    Returns the statement that merges one row into its bucket.
+    Missing (NULL) values leave min, max and sum of that sensor alone.
+    Parameters: bucket, then min, max, sum, n for each sensor.
+    -------------------------------------------------------
+    """
+    names = ['"bucket"', '"rows"']
+    updates = ['"rows" = "rows" + excluded."rows"']
+    for name in column_names[1:]:
+        names.extend([f'"{name}_min"', f'"{name}_max"', f'"{name}_sum"', f'"{name}_n"'])
+        updates.extend([
+            f'"{name}_min" = min(coalesce("{name}_min", excluded."{name}_min"), coalesce(excluded."{name}_min", "{name}_min"))',
+            f'"{name}_max" = max(coalesce("{name}_max", excluded."{name}_max"), coalesce(excluded."{name}_max", "{name}_max"))',
+            f'"{name}_sum" = CASE WHEN excluded."{name}_sum" IS NULL THEN "{name}_sum" ELSE coalesce("{name}_sum", 0) + excluded."{name}_sum" END',
+            f'"{name}_n" = "{name}_n" + excluded."{name}_n"'])
+    return (f'INSERT INTO "{table}" ({", ".join(names)}) VALUES(?,1{",?" * (4 * (len(column_names) - 1))})\n'
+            f'    ON CONFLICT("bucket") DO UPDATE SET ' + ',\n        '.join(updates))
+
+
+def rollup_params(epoch, sensor_values, seconds):
+    # parameters of upsert_rollup_sql for one sample, sensor_values date first
+    params = [bucket_start(epoch, seconds)]
+    for value in map(rollup_value, sensor_values[1:]):
+        params.extend((value, value, value, 0 if value is None else 1))
+    return params
+
+
+def select_rollup_sql(table, column_names):
+    """
+    -------------------------------------------------------
+    Returns a range query on a rollup table shaped like the
+    samples table: bucket start, then the avg of each sensor.
+    Parameters: start, end epoch seconds
+    -------------------------------------------------------
+    """
+    averages = [f'"{name}_sum" / NULLIF("{name}_n", 0)' for name in column_names[1:]]
+    return f'SELECT "bucket", {", ".join(averages)} FROM "{table}" WHERE "bucket" BETWEEN ? AND ? ORDER BY "bucket"'
+
+
+def pick_rollup(span_seconds, points):
+    """
+    -------------------------------------------------------
+    Returns the coarsest rollup table that still gives at least
+    points buckets over the span, or None when raw rows are needed.
+    Use: table = pick_rollup((end - start).total_seconds(), 1000)
+    -------------------------------------------------------
+    """
+    best = None
+    for table, seconds in ROLLUPS.items():
+        if span_seconds / seconds >= points:
+            best = table
+    return best
+
+
+def column_names_of(conn):
+    # column names of the temperature view (or old table), "Date" first
+    return [row[1] for row in conn.execute('PRAGMA table_info("temperature")')]
+
+
+def fill_rollup(conn, table, column_names):
+    """
+    -------------------------------------------------------
+    Rebuilds one rollup table from every row of samples.
+    Runs in the caller's transaction.
+    -------------------------------------------------------
+    Returns:
+        buckets written (int)
+    -------------------------------------------------------
+    """
+    aggregates = ['COUNT(*)']
+    for name in column_names[1:]:
+        value = f'NULLIF("{name}", {PLACEHOLDER})'
+        aggregates.extend([f'MIN({value})', f'MAX({value})', f'SUM({value})', f'COUNT({value})'])
+    conn.execute(create_rollup_sql(table, column_names))
+    conn.execute(f'DELETE FROM "{table}"')
+    cursor = conn.execute(f'INSERT INTO "{table}" SELECT {bucket_sql(ROLLUPS[table])}, {", ".join(aggregates)} '
+                          f'FROM "samples" GROUP BY 1')
+    return cursor.rowcount
+
+
+def backfill(db_location, tables=None):
+    """
+    -------------------------------------------------------
+    Rebuilds rollup tables from every row in the samples table.
+    Safe to run again, and while the logger is writing: each table
+    is replaced in one transaction. The database has to be
+    migrated first.
+    Use: backfill('/home/luke/Desktop/Script/Output/shared_data.db')
+    -------------------------------------------------------
+    Returns:
+        {table: buckets written} (dict)
+    -------------------------------------------------------
+    """
+    conn = sqlite_connect(db_location, isolation_level=None)
+    written = dict()
+    try:
+        column_names = column_names_of(conn)
+        for table in (tables or ROLLUPS):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                check_converted(conn, db_location)
+                written[table] = fill_rollup(conn, table, column_names)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+    return written
+
+
+class SQLiteWriter:
+    """
+    -------------------------------------------------------
+    Keeps one connection per database open for the life of the logger.
+    Use: writer = SQLiteWriter(db_location, ReadingObj.SENSOR_NAMES)
+         writer.write(sensor_values)
+         writer.close()
+    -------------------------------------------------------
+    """
+    def __init__(self, db_location, column_names, journal_mode='WAL', synchronous='NORMAL',
+                 commit_every=1, commit_interval=0.0, rollups=(), registry=None, max_retained=MAX_RETAINED, on_drop=None):
+        """
+        -------------------------------------------------------
+        Parameters:
+            db_location - location of sql_lite db (str)
+            column_names - ordered column names, date first (list)
+            journal_mode - sqlite journal mode. WAL avoids rewriting the
+                           rollback journal on every commit (str)
+            synchronous - sqlite synchronous level. NORMAL is safe with WAL,
+                          a power cut can only lose the last commits (str)
+            commit_every - commit after this many rows (int)
+            commit_interval - also commit once the oldest pending row is
+                              this many seconds old. 0 disables it (float)
+            rollups - names of ROLLUPS tables kept up to date with each row (list)
+            registry - sensor_registry.SensorRegistry. Given, every sensor
+                       is also stored in the long format readings table
+            max_retained - rows kept for the next try while commits fail (int)
+            on_drop - called with the number of rows given up on, past
+                      max_retained or still uncommitted at close
+        -------------------------------------------------------
+        """
+        self.db_location = db_location
+        self.column_names = list(column_names)
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.commit_every = max(1, commit_every)
+        self.commit_interval = commit_interval
+        # the same sql string every time lets sqlite3 reuse the prepared statement
+        self._insert_sql = insert_sql(self.column_names)
+        self._rollups = [(table, ROLLUPS[table], upsert_rollup_sql(table, self.column_names)) for table in rollups]
+        self.registry = registry
+        self._sensor_ids = dict()
+        self._conn = None
+        self._lock = Lock()
+        self.max_retained = max_retained
+        self.on_drop = on_drop
+        # rows not committed yet, (epoch, sensor_values, readings). Kept when a
+        # commit fails and written again in the next transaction
+        self._rows = list()
+        # how many of _rows are in the open transaction
+        self._written = 0
+        self._first_pending = 0.0
+        self.dropped = 0
+        # seconds taken by recent commits
+        self.commit_latencies = deque(maxlen=100)
+        self.commit_count = 0
+
+    def _connect(self):
+        # opened on first use so a missing USB stick does not stop the logger from starting
+        conn = sqlite_connect(self.db_location, isolation_level=None, check_same_thread=False)
+        try:
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self.ensure_schema(conn)
+        except Exception:
+            conn.close()
+            raise
+        self._conn = conn
+
+    def ensure_schema(self, conn):
+        """
+        -------------------------------------------------------
+        Creates the tables. Called once when the connection is opened.
+        Raises OperationalError on a database that isn't migrated.
+        -------------------------------------------------------
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            check_converted(conn, self.db_location)
+            create_schema(conn, self.column_names)
+            for table, _seconds, _sql in self._rollups:
+                conn.execute(create_rollup_sql(table, self.column_names))
+            if self.registry is not None:
+                self._sensor_ids = register_sensors(conn, self.registry)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def write(self, sensor_values, epoch=None, readings=()):
+        """
+        -------------------------------------------------------
+        Inserts one row. Commits when the group is full or old enough.
+        Use: writer.write(readingObj.get_solar_tuple())
+             writer.write(readingObj.get_solar_tuple(), deadline, zip(ReadingObj.FIELDS, readingObj.as_tuple()))
+        -------------------------------------------------------
+        Parameters:
+            sensor_values - (tuple) Sensor values, date first
+            epoch - sample time, seconds since the epoch (float).
+                    Default the date of sensor_values, read as local time
+            readings - (sensor name, value) of every sensor. Only stored
+                       with a registry. None values and unknown names are skipped.
+        -------------------------------------------------------
+        """
+        if epoch is None:
+            epoch = mktime(strptime(sensor_values[0], DATE_FORMAT))
+        with self._lock:
+            if not self._rows:
+                self._first_pending = monotonic()
+            self._rows.append((int(epoch), tuple(sensor_values), tuple(readings)))
+            self._write_rows(len(self._rows) >= self.commit_every
+                             or (self.commit_interval and monotonic() - self._first_pending >= self.commit_interval))
+
+    def _write_rows(self, commit):
+        # writes the rows not in the open transaction yet, then commits if asked.
+        # on an error the connection is dropped, the rows are kept for the next try
+        try:
+            if self._conn is None:
+                self._connect()
+            if self._written == 0:
+                self._conn.execute("BEGIN")
+            for epoch, sensor_values, readings in self._rows[self._written:]:
+                self._insert(epoch, sensor_values, readings)
+                self._written += 1
+            if commit:
+                self._commit()
+        except Exception:
+            self._reset()
+            raise
+
+    def _insert(self, epoch, sensor_values, readings):
+        cursor = self._conn.execute(self._insert_sql, (epoch,) + sensor_values[1:])
+        # a repeated second is not stored, so it isn't counted in the rollups either
+        if cursor.rowcount:
+            for _table, seconds, sql in self._rollups:
+                self._conn.execute(sql, rollup_params(epoch, sensor_values, seconds))
+        if self._sensor_ids:
+            self._conn.executemany(INSERT_READING_SQL, [(self._sensor_ids[name], epoch, value)
+                                                        for name, value in readings
+                                                        if value is not None and name in self._sensor_ids])
+
+    def _commit(self):
+        start = monotonic()
+        self._conn.execute("COMMIT")
+        self.commit_latencies.append(monotonic() - start)
+        self.commit_count += 1
+        self._rows = list()
+        self._written = 0
+
+    def _reset(self, keep=None):
+        # drops the connection, its open transaction is rolled back.
+        # keeps the newest rows up to max_retained (keep) for the next try
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+        self._written = 0
+        keep = self.max_retained if keep is None else keep
+        if len(self._rows) > keep:
+            dropped = len(self._rows) - keep
+            self._rows = self._rows[dropped:]
+            self.dropped += dropped
+            if self.on_drop is not None:
+                self.on_drop(dropped)
+
+    def flush(self):
+        """
+        -------------------------------------------------------
+        Writes and commits any pending rows, also the ones kept
+        from a failed commit. Call on shutdown.
+        -------------------------------------------------------
+        """
+        with self._lock:
+            if self._rows:
+                self._write_rows(commit=True)
+
+    def close(self):
+        """
+        -------------------------------------------------------
+        Flushes and closes the connection. Rows that still can't
+        be committed are given to on_drop.
+        -------------------------------------------------------
+        """
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._reset(keep=0)
+
+    def stats(self):
+        """
+        -------------------------------------------------------
+        Returns commit latency stats in seconds.
+        -------------------------------------------------------
+        """
+        latencies = list(self.commit_latencies)
+        return {
+            'commits': self.commit_count,
+            'pending': len(self._rows),
+            'dropped': self.dropped,
+            'last': latencies[-1] if latencies else None,
+            'avg': sum(latencies) / len(latencies) if latencies else None,
+            'max': max(latencies) if latencies else None}
+
+
+if __name__ == '__main__':
+    if len(argv) < 3 or argv[1] not in ('migrate', 'backfill', 'long'):
+        print('Use: python sqlite_storage.py migrate <db> [<db> ...]\n'
+              '     python sqlite_storage.py backfill <db> [<db> ...]\n'
+              '     python sqlite_storage.py long <db> [<db> ...]')
+        raise SystemExit(1)
+    for db_location in argv[2:]:
+        if argv[1] == 'migrate':
+            copied, dropped, backup, seconds = migrate(db_location)
+            if backup is None:
+                print(f"{db_location} is already migrated")
+            else:
+                print(f"{db_location} migrated in {seconds:.1f}s  {copied} rows to epoch seconds, {dropped} left out. "
+                      f'old table kept as "{backup}"')
+        elif argv[1] == 'long':
+            from sensor_registry import REGISTRY
+            start = monotonic()
+            copied = migrate_long(db_location, REGISTRY)
+            print(f"{db_location} copied to readings in {monotonic() - start:.1f}s  {copied}")
+        else:
+            start = monotonic()
+            written = backfill(db_location)
+            print(f"{db_location} backfilled in {monotonic() - start:.1f}s  {written}")
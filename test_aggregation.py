@@ -0,0 +1,52 @@
+'''
+------------------------------------------------------------------------
+Tests of the running hour/day/week stats: the 0.01 placeholder of a
+missed read is a missing value, and the state survives a save and load.
+
+Run: python -m pytest test_aggregation.py
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timezone
+
+import pytest
+
+from aggregation import MISSING_VALUE, PeriodAggregator
+
+HOUR = int(datetime(2024, 6, 1, 12, tzinfo=timezone.utc).timestamp())
+
+
+def test_placeholder_is_missing():
+    aggregator = PeriodAggregator()
+    aggregator.update(HOUR, [40.0, 20.0])
+    # the first sensor missed a read
+    aggregator.update(HOUR + 19, [MISSING_VALUE, 22.0])
+    aggregator.update(HOUR + 38, [44.0, None])
+    summary = aggregator.current['hour'][1].summary()
+    assert summary['min'].tolist() == [40.0, 20.0]
+    assert summary['mean'].tolist() == [42.0, 21.0]
+    assert summary['count'].tolist() == [2, 2]
+    assert aggregator.current_max('day', 0) == 44.0
+
+
+def test_hour_line_of_a_sensor_never_read():
+    aggregator = PeriodAggregator()
+    aggregator.update(HOUR, [40.0, MISSING_VALUE])
+    aggregator.update(HOUR + 3600, [41.0, MISSING_VALUE])
+    line = aggregator.hour_line(datetime.fromtimestamp(HOUR, timezone.utc))
+    assert line.split(',')[1:] == ['40.0', '40.0', '40.0', '0.01', '0.01', '0.01']
+
+
+def test_save_and_load(tmp_path):
+    state_file = str(tmp_path / 'aggregator.json')
+    aggregator = PeriodAggregator(state_file, save_interval=300)
+    aggregator.update(HOUR, [40.0, 20.0])
+    aggregator.update(HOUR + 19, [42.0, MISSING_VALUE])
+    # inside the save interval, nothing was written yet
+    assert not (tmp_path / 'aggregator.json').exists()
+    aggregator.save()
+
+    restored = PeriodAggregator(state_file)
+    summary = restored.current['hour'][1].summary()
+    assert summary['mean'].tolist() == [41.0, 20.0]
+    assert summary['count'].tolist() == [2, 1]
+    assert restored.current_max('day', 0) == pytest.approx(42.0)
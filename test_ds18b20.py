@@ -0,0 +1,229 @@
+'''
+------------------------------------------------------------------------
+Tests of the DS18B20 reads against the fake sysfs tree in fake_w1.py.
+The driver's sleeps are patched out and the fake bus converts
+instantly, so the whole sweep runs in milliseconds.
+
+Run: python -m pytest test_ds18b20.py
+------------------------------------------------------------------------
+'''
+from os import path as os_path, remove
+
+import pytest
+
+import ds18b20
+from ds18b20 import read_sensors
+from fake_w1 import DEFAULT_MASTERS, FakeDS18B20, FakeW1Bus, w1_slave_text
+from metrics import METRICS
+from sensor_registry import REGISTRY
+
+ROUNDING = 2
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    # the retry and settle sleeps of the driver, not the fake bus timing
+    monkeypatch.setattr(ds18b20, 'sleep', lambda seconds: None)
+
+
+@pytest.fixture(autouse=True)
+def notifications(monkeypatch):
+    # kept here instead of going to the shared dispatcher
+    sent = list()
+    monkeypatch.setattr(ds18b20, 'send_notification', lambda *message, **options: sent.append((message, options)))
+    return sent
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    # last known values are shared by every reader in the process
+    monkeypatch.setattr(ds18b20, 'last_known_values', ds18b20.LastKnownValues())
+
+
+class Clock:
+    # stands in for ds18b20.monotonic
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ds18b20, 'monotonic', clock)
+    # one read per sample, no retries within it
+    monkeypatch.setattr(ds18b20, 'RETRY_BUDGET', 0.0)
+    return clock
+
+
+def make_flaky(monkeypatch, sensor_obj, index=0):
+    # the sensor at index fails its CRC while state['failing'], the reads of it are counted
+    state = {'failing': True, 'reads': 0}
+    read_temp = sensor_obj._read_temp
+
+    def flaky_read_temp(i):
+        if i != index:
+            return read_temp(i)
+        state['reads'] += 1
+        return w1_slave_text(85.0, crc_ok=False).splitlines(True) if state['failing'] else read_temp(i)
+
+    monkeypatch.setattr(sensor_obj, '_read_temp', flaky_read_temp)
+    return state
+
+
+def make_bus(tmp_path, **settings):
+    settings.setdefault('conversion_time', 0.0)
+    settings.setdefault('drift', 0.0)
+    return FakeW1Bus(str(tmp_path / 'w1'), **settings)
+
+
+def expected_values(bus):
+    # {sensor name: calibrated, rounded value} of every device on the bus
+    return {REGISTRY.mapping[address[-4:]]: round(temp_c + REGISTRY.offsets[address[-4:]], ROUNDING)
+            for devices in bus.masters.values() for address, temp_c in devices.items()}
+
+
+def read_values(sensor_obj, **options):
+    reading = read_sensors(sensor_obj, None, '2024-06-01 12:00:00', sensor_obj.device_count(), ROUNDING, **options)
+    return dict(zip(reading.FIELDS, reading.as_tuple()))
+
+
+def counter(name, **labels):
+    key = ','.join(f'{k}="{v}"' for k, v in labels.items())
+    values = METRICS.snapshot()['counters'].get(name, {})
+    return values.get('{' + key + '}' if key else 'total', 0)
+
+
+def test_one_by_one(tmp_path, fresh_cache):
+    bus = make_bus(tmp_path)
+    sensor_obj = FakeDS18B20(bus)
+    assert sensor_obj.device_count() == sum(len(devices) for devices in DEFAULT_MASTERS.values())
+    values = read_values(sensor_obj)
+    for name, value in expected_values(bus).items():
+        assert values[name] == value
+    assert bus.conversions == sensor_obj.device_count()
+
+
+def test_worker_pool_matches_one_by_one(tmp_path, fresh_cache):
+    bus = make_bus(tmp_path)
+    sensor_obj = FakeDS18B20(bus)
+    assert read_values(sensor_obj, max_workers=4) == read_values(sensor_obj)
+
+
+def test_bulk_read(tmp_path, fresh_cache):
+    bus = make_bus(tmp_path)
+    sensor_obj = FakeDS18B20(bus)
+    prefetched = sensor_obj.bulk_read()
+    assert sorted(prefetched) == list(range(sensor_obj.device_count()))
+    # one conversion per device, started by the trigger, none by a w1_slave read
+    assert bus.conversions == sensor_obj.device_count()
+
+    values = read_values(sensor_obj, bulk=True)
+    for name, value in expected_values(bus).items():
+        assert values[name] == value
+
+
+def test_crc_failures_are_retried(tmp_path, fresh_cache):
+    bus = make_bus(tmp_path, crc_fail_rate=0.3, seed=7)
+    sensor_obj = FakeDS18B20(bus)
+    before = counter('read_retries', kind='crc')
+    values = read_values(sensor_obj)
+    assert bus.crc_failures > 0
+    # every 'NO' read was read again, and the retry got the value
+    assert counter('read_retries', kind='crc') - before == bus.crc_failures
+    for name, value in expected_values(bus).items():
+        assert values[name] == value
+
+
+def test_missing_device(tmp_path, fresh_cache):
+    missing = '28-0000000a9e0f'
+    bus = make_bus(tmp_path, missing=[missing])
+    sensor_obj = FakeDS18B20(bus)
+    assert missing not in [os_path.basename(folder) for folder in sensor_obj.device_folder]
+    assert sensor_obj.device_count() == sum(len(devices) for devices in DEFAULT_MASTERS.values()) - 1
+    values = read_values(sensor_obj)
+    # not read, so it keeps the solar default
+    assert values[REGISTRY.mapping[missing[-4:]]] == 0.01
+    for name, value in expected_values(bus).items():
+        assert values[name] == value
+
+
+def test_unplugged_device_requests_rescan(tmp_path, fresh_cache):
+    bus = make_bus(tmp_path)
+    sensor_obj = FakeDS18B20(bus)
+    count = sensor_obj.device_count()
+    address = os_path.basename(sensor_obj.device_folder[0])
+    bus.unplug(address)
+    # the failed read asks for a rescan before the next sweep
+    assert sensor_obj._read_temp(0) == []
+    assert sensor_obj.refresh() is True
+    assert sensor_obj.device_count() == count - 1
+    values = read_values(sensor_obj)
+    assert values[REGISTRY.mapping[address[-4:]]] == 0.01
+    for name, value in expected_values(bus).items():
+        assert values[name] == value
+
+
+def test_bulk_falls_back_without_therm_bulk_read(tmp_path, fresh_cache):
+    bus = make_bus(tmp_path)
+    remove(os_path.join(bus.root, 'w1_bus_master2', 'therm_bulk_read'))
+    sensor_obj = FakeDS18B20(bus)
+    master1 = [i for i, folder in enumerate(sensor_obj.device_folder)
+               if os_path.basename(folder) in DEFAULT_MASTERS['w1_bus_master1']]
+    assert sorted(sensor_obj.bulk_read()) == master1
+    assert sensor_obj._bulk_supported[os_path.join(bus.base_dir, 'w1_bus_master2')] is False
+
+    before = counter('bulk_misses')
+    values = read_values(sensor_obj, bulk=True)
+    # master2's sensors were read one by one
+    assert counter('bulk_misses') - before == sensor_obj.device_count() - len(master1)
+    for name, value in expected_values(bus).items():
+        assert values[name] == value
+
+
+def test_failing_sensor_backs_off(tmp_path, fresh_cache, clock, monkeypatch, notifications):
+    bus = make_bus(tmp_path)
+    sensor_obj = FakeDS18B20(bus)
+    good = read_values(sensor_obj)
+    s_name = sensor_obj.get_device_name(0)
+    name = REGISTRY.mapping[s_name]
+    flaky = make_flaky(monkeypatch, sensor_obj)
+
+    # answered from memory at once, one read and no retry
+    assert read_values(sensor_obj)[name] == good[name]
+    assert flaky['reads'] == 1
+    assert [options for _message, options in notifications] == [{'key': s_name}]
+    # read again on the next sample
+    clock.now += 19
+    read_values(sensor_obj)
+    assert flaky['reads'] == 2
+    # then backed off for 20s, the sample after is not read
+    clock.now += 19
+    assert read_values(sensor_obj)[name] == good[name]
+    assert flaky['reads'] == 2
+    clock.now += 19
+    read_values(sensor_obj)
+    assert flaky['reads'] == 3
+
+    flaky['failing'] = False
+    clock.now += 40
+    assert read_values(sensor_obj)[name] == expected_values(bus)[name]
+    assert not ds18b20.last_known_values.backing_off(s_name)
+
+
+def test_reboot_after_failing_too_long(tmp_path, fresh_cache, clock, monkeypatch, notifications):
+    reboots = list()
+    monkeypatch.setattr(ds18b20, 'subprocess_call', lambda command, shell: reboots.append(clock.now))
+    monkeypatch.setattr(ds18b20, 'stop_logging', lambda: None)
+    bus = make_bus(tmp_path)
+    sensor_obj = FakeDS18B20(bus)
+    make_flaky(monkeypatch, sensor_obj)
+    start = clock.now
+    while not reboots and clock.now - start < 3600:
+        read_values(sensor_obj)
+        clock.now += 19
+    assert reboots
+    assert ds18b20.REBOOT_AFTER <= reboots[0] - start <= ds18b20.REBOOT_AFTER + ds18b20.BACKOFF_MAX + 19
+    assert notifications[-1][1] == {'key': 'reboot'}
@@ -0,0 +1,72 @@
+'''
+------------------------------------------------------------------------
+Tests of the hour document writes against the in memory Firestore in
+fake_firestore.py: the stored glycol maximums survive a batch that has
+no value for them, like a replayed spool batch.
+
+Run: python -m pytest test_firebase_admin_file.py
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timezone
+
+import pytest
+
+import firebase_admin_file
+from aggregation import PeriodAggregator
+from fake_firestore import FakeFirestore
+
+HOUR = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeFirestore()
+    monkeypatch.setattr(firebase_admin_file, 'db', db)
+    monkeypatch.setattr(firebase_admin_file, 'current_hour', dict(firebase_admin_file.current_hour))
+    return db
+
+
+def forget_current_hour():
+    # like a restart, the next write queries the hour document again
+    firebase_admin_file.current_hour.update({'hour': None, 'ref': None})
+
+
+def maximums(db):
+    (doc,) = db.collection('test').get()
+    return doc.get('glycol_in_max'), doc.get('glycol_roof_max')
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_batch_without_maximums_keeps_them(db, cached):
+    aggregator = PeriodAggregator()
+    ref = firebase_admin_file.write_lines(HOUR, ['12:00:00,50'], None, 50.0, 60.0, aggregator)
+    assert maximums(db) == (50.0, 60.0)
+
+    if not cached:
+        forget_current_hour()
+    firebase_admin_file.write_lines(HOUR, ['12:00:19,51'], ref, None, None, aggregator)
+    assert maximums(db) == (50.0, 60.0)
+
+    # one value given, the other one kept
+    if not cached:
+        forget_current_hour()
+    firebase_admin_file.write_lines(HOUR, ['12:00:38,52'], ref, 52.0, None, aggregator)
+    assert maximums(db) == (52.0, 60.0)
+    (doc,) = db.collection('test').get()
+    assert doc.get('lines') == ['12:00:00,50', '12:00:19,51', '12:00:38,52']
+
+
+def test_daily_maximum_replaces_the_stored_one(db):
+    # the aggregator's daily max restarts at 5, so a lower one is written as is
+    aggregator = PeriodAggregator()
+    ref = firebase_admin_file.write_lines(HOUR, ['12:00:00,50'], None, 80.0, 90.0, aggregator)
+    forget_current_hour()
+    firebase_admin_file.write_lines(HOUR, ['12:00:19,51'], ref, 40.0, 45.0, aggregator)
+    assert maximums(db) == (40.0, 45.0)
+
+
+def test_without_aggregator_the_maximum_only_grows(db):
+    ref = firebase_admin_file.write_lines(HOUR, ['12:00:00,50'], None, 50.0, 60.0)
+    forget_current_hour()
+    firebase_admin_file.write_lines(HOUR, ['12:00:19,51'], ref, 40.0, None)
+    assert maximums(db) == (50.0, 60.0)
@@ -0,0 +1,137 @@
+'''
+------------------------------------------------------------------------
+Tests of the notification dispatcher, sending through FakeMessaging
+from fake_firestore.py: bursts are coalesced into one message per topic
+and title, repeats are rate limited per key, flush waits for the queue.
+The rate limit clock is patched, so nothing waits on a real window.
+
+Run: python -m pytest test_notifier.py
+------------------------------------------------------------------------
+'''
+import pytest
+
+import notifier
+from fake_firestore import FakeMessaging
+from notifier import NotificationDispatcher, coalesce
+
+
+class Clock:
+    # stands in for notifier.monotonic
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(notifier, 'monotonic', clock)
+    return clock
+
+
+@pytest.fixture
+def messaging():
+    return FakeMessaging()
+
+
+def make_dispatcher(messaging, **settings):
+    settings.setdefault('coalesce_window', 0.05)
+    return NotificationDispatcher(sender=messaging.send_notifications, **settings)
+
+
+def sent(messaging):
+    return [(message.topic, message.notification.title, message.notification.body)
+            for message in messaging.sent]
+
+
+def test_coalesce():
+    batch = [('debug', 'error', 'a'), ('hot', 'limit', 'x'), ('debug', 'error', 'b'),
+             ('debug', 'error', 'a')]
+    assert coalesce(batch) == [('debug', 'error', 'a\nb'), ('hot', 'limit', 'x')]
+
+
+def test_burst_is_one_message(clock, messaging):
+    dispatcher = make_dispatcher(messaging, coalesce_window=0.5)
+    for name in ('glycol_in', 'glycol_out', 'roof'):
+        assert dispatcher.notify('hot', 'Temperature limit exceeded', f'{name} reported 92 C', key=name)
+    assert dispatcher.flush(5)
+    assert sent(messaging) == [('hot', 'Temperature limit exceeded',
+                                'glycol_in reported 92 C\nglycol_out reported 92 C\nroof reported 92 C')]
+    # one request for the whole burst
+    assert messaging.sends == 1
+    assert dispatcher.sent == 1
+
+
+def test_rate_limit_per_key(clock, messaging):
+    dispatcher = make_dispatcher(messaging, rate_limits={'hot': 900})
+    assert dispatcher.notify('hot', 'limit', 'glycol_in 92 C', key='1e37')
+    assert not dispatcher.notify('hot', 'limit', 'glycol_in 93 C', key='1e37')
+    assert not dispatcher.notify('hot', 'limit', 'glycol_in 94 C', key='1e37')
+    # another sensor has its own window
+    assert dispatcher.notify('hot', 'limit', 'roof 95 C', key='9e0f')
+    dispatcher.flush(5)
+
+    clock.now += 900
+    assert dispatcher.notify('hot', 'limit', 'glycol_in 96 C', key='1e37')
+    dispatcher.flush(5)
+    bodies = [body for _topic, _title, body in sent(messaging)]
+    assert bodies == ['glycol_in 92 C\nroof 95 C', 'glycol_in 96 C (+2 suppressed)']
+
+
+def test_unkeyed_messages_limit_only_repeats(clock, messaging):
+    dispatcher = make_dispatcher(messaging)
+    assert dispatcher.notify('debug', 'error', 'NULL got through')
+    # same title, unrelated error
+    assert dispatcher.notify('debug', 'error', 'Sensor Failed to read.')
+    assert not dispatcher.notify('debug', 'error', 'NULL got through')
+    dispatcher.flush(5)
+    assert sent(messaging) == [('debug', 'error', 'NULL got through\nSensor Failed to read.')]
+
+
+def test_topics_are_sent_apart(clock, messaging):
+    dispatcher = make_dispatcher(messaging)
+    dispatcher.notify('debug', 'error', 'REBOOTING', key='reboot')
+    dispatcher.notify('hot', 'error', 'roof 95 C', key='reboot')
+    dispatcher.flush(5)
+    assert sent(messaging) == [('debug', 'error', 'REBOOTING'), ('hot', 'error', 'roof 95 C')]
+
+
+def test_flush_before_anything_queued(messaging):
+    assert make_dispatcher(messaging).flush(0) is True
+    assert messaging.sends == 0
+
+
+def test_failed_send_is_counted(clock):
+    def sender(messages):
+        raise ConnectionError('no network')
+
+    dispatcher = NotificationDispatcher(sender=sender, coalesce_window=0.05)
+    assert dispatcher.notify('debug', 'error', 'REBOOTING', key='reboot')
+    assert dispatcher.flush(5)
+    assert dispatcher.failed == 1
+    assert dispatcher.sent == 0
+
+
+def test_reboot_is_never_rate_limited(clock, messaging):
+    dispatcher = make_dispatcher(messaging)
+    assert dispatcher.notify('debug', 'error', 'Rebooting @ Sat 12:00 PM', key='reboot')
+    assert dispatcher.notify('debug', 'error', 'REBOOTING @ Sat 12:00 PM', key='reboot')
+    dispatcher.flush(5)
+    assert sent(messaging) == [('debug', 'error', 'Rebooting @ Sat 12:00 PM\nREBOOTING @ Sat 12:00 PM')]
+    assert dispatcher._last_sent == {}
+
+
+def test_expired_keys_are_forgotten(clock, messaging):
+    dispatcher = make_dispatcher(messaging, rate_limits={'debug': 60}, maxsize=1000)
+    for minute in range(100):
+        # a body with the time in it, never the same twice
+        assert dispatcher.notify('debug', 'error', f'NULL got through {minute}')
+        assert dispatcher.notify('debug', 'error', 'NULL got through', key='null')
+        assert not dispatcher.notify('debug', 'error', f'NULL got through {minute}')
+        clock.now += 60
+    dispatcher.flush(5)
+    # only the keys of the last window are left
+    assert len(dispatcher._last_sent) == 2
+    assert dispatcher._suppressed == {('debug', 'error', 'NULL got through 99'): 1}
@@ -0,0 +1,94 @@
+'''
+------------------------------------------------------------------------
+Tests of the retention sweeper against the in memory Firestore in
+fake_firestore.py: pages split inside one hour, old documents written
+after a sweep, and a sweep that fails part way.
+
+Run: python -m pytest test_retention.py
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from fake_firestore import FakeFirestore
+from retention import RetentionSweeper
+
+NOW = datetime(2024, 6, 15, 12, tzinfo=timezone.utc)
+COLLECTION = 'test'
+
+
+@pytest.fixture
+def db():
+    return FakeFirestore()
+
+
+def add_hours(db, first, count, per_hour=1):
+    # per_hour documents for each of count hours, like replayed duplicates
+    collection = db.collection(COLLECTION)
+    for h in range(count):
+        for _ in range(per_hour):
+            collection.add({'hour': first + timedelta(hours=h), 'lines': []})
+
+
+def hours_left(db):
+    return sorted(doc.get('hour') for doc in db.collection(COLLECTION).get())
+
+
+def test_deletes_only_expired(db):
+    add_hours(db, NOW - timedelta(days=10), 24 * 10)
+    sweeper = RetentionSweeper(COLLECTION, page_size=50, client=db)
+    deleted = sweeper.sweep(now=NOW)
+    cutoff = NOW - timedelta(weeks=1)
+    assert deleted == 24 * 3 + 1
+    assert min(hours_left(db)) > cutoff
+    assert sweeper.last_cutoff == cutoff
+    # one batched write per page
+    assert db.commits == -(-deleted // 50)
+
+
+def test_same_hour_across_a_page_boundary(db):
+    old = NOW - timedelta(days=8)
+    add_hours(db, old, 3, per_hour=4)
+    sweeper = RetentionSweeper(COLLECTION, page_size=3, client=db)
+    assert sweeper.sweep(now=NOW) == 12
+    assert hours_left(db) == []
+
+
+def test_old_document_written_after_a_sweep(db):
+    add_hours(db, NOW - timedelta(days=9), 24)
+    sweeper = RetentionSweeper(COLLECTION, client=db)
+    assert sweeper.sweep(now=NOW) == 24
+
+    # a spooled hour from before the last cutoff arrives late
+    add_hours(db, NOW - timedelta(days=12), 1)
+    assert sweeper.sweep(now=NOW + timedelta(hours=1)) == 1
+    assert hours_left(db) == []
+
+
+def test_failed_sweep_keeps_its_progress(db, monkeypatch):
+    add_hours(db, NOW - timedelta(days=9), 10)
+    sweeper = RetentionSweeper(COLLECTION, page_size=4, client=db)
+
+    batch = db.batch
+    pages = list()
+
+    def offline_from_second_page():
+        pages.append(batch())
+        db.offline = len(pages) > 1
+        return pages[-1]
+
+    monkeypatch.setattr(db, 'batch', offline_from_second_page)
+    with pytest.raises(Exception):
+        sweeper.sweep(now=NOW)
+    monkeypatch.undo()
+    db.offline = False
+    # the first page went, the cutoff was not reached
+    assert sweeper.last_deleted == 4
+    assert len(hours_left(db)) == 6
+    assert sweeper.last_cutoff is None
+
+    # the next sweep starts from the oldest document left
+    assert sweeper.sweep(now=NOW) == 6
+    assert hours_left(db) == []
+    assert sweeper.last_cutoff == NOW - timedelta(weeks=1)
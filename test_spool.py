@@ -0,0 +1,198 @@
+'''
+------------------------------------------------------------------------
+Tests of the upload spool against the in memory Firestore in
+fake_firestore.py: lines survive an outage and arrive once, in order,
+after it; the size cap drops the oldest lines; consecutive lines of
+one hour go up as one batch.
+
+Run: python -m pytest test_spool.py
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from fake_firestore import ArrayUnion, FakeFirestore
+from spool import UploadSpool
+
+HOUR = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+COLLECTION = 'test'
+
+
+class HourUploader:
+    """
+    -------------------------------------------------------
+    Upload function for UploadSpool.replay. Merges each batch into
+    its hour document like firebase_admin_file.write_lines, and
+    keeps every batch it was called with.
+    -------------------------------------------------------
+    """
+    def __init__(self, db):
+        self.db = db
+        self.batches = list()
+
+    def __call__(self, date_time_utc, lines, glycol_in_max, glycol_roof_max):
+        ref = self.db.collection(COLLECTION).document(date_time_utc.isoformat())
+        if ref.get().exists:
+            ref.update({'lines': ArrayUnion(lines)})
+        else:
+            ref.set({'lines': list(lines)})
+        self.batches.append((date_time_utc, list(lines), glycol_in_max, glycol_roof_max))
+
+    def lines(self, date_time_utc):
+        snapshot = self.db.collection(COLLECTION).document(date_time_utc.isoformat()).get()
+        return snapshot.get('lines') if snapshot.exists else []
+
+
+@pytest.fixture
+def db():
+    return FakeFirestore()
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = UploadSpool(str(tmp_path / 'spool.db'))
+    yield spool
+    spool.close()
+
+
+def put_lines(spool, hour, count, first=0):
+    lines = [f"{hour:%Y-%m-%d %H}:{first + i:02d},{20 + i}" for i in range(count)]
+    for i, line in enumerate(lines):
+        spool.put(hour, line, 20.0 + i, 30.0 + i)
+    return lines
+
+
+def test_replay_uploads_in_order(db, spool):
+    upload = HourUploader(db)
+    first = put_lines(spool, HOUR, 3)
+    second = put_lines(spool, HOUR + timedelta(hours=1), 2)
+    assert spool.depth() == 5
+
+    assert spool.replay(upload) == 5
+    assert upload.lines(HOUR) == first
+    assert upload.lines(HOUR + timedelta(hours=1)) == second
+    assert spool.depth() == 0
+    assert spool.lag() == 0.0
+
+
+def test_outage_then_recovery(db, spool):
+    upload = HourUploader(db)
+    db.offline = True
+    lines = put_lines(spool, HOUR, 4)
+    with pytest.raises(Exception):
+        spool.replay(upload)
+    # nothing was lost or uploaded
+    assert spool.depth() == 4
+    assert spool.last_replay_error is not None
+    assert upload.batches == []
+
+    # more lines come in during the outage
+    lines += put_lines(spool, HOUR, 2, first=4)
+    db.offline = False
+    assert spool.replay(upload) == 6
+    assert upload.lines(HOUR) == lines
+    assert spool.depth() == 0
+    assert spool.last_replay_error is None
+
+
+def test_outage_mid_replay_keeps_the_rest(db, spool):
+    upload = HourUploader(db)
+    first = put_lines(spool, HOUR, 2)
+    second = put_lines(spool, HOUR + timedelta(hours=1), 2)
+
+    def fails_on_second_hour(date_time_utc, lines, glycol_in_max, glycol_roof_max):
+        db.offline = date_time_utc != HOUR
+        upload(date_time_utc, lines, glycol_in_max, glycol_roof_max)
+
+    with pytest.raises(Exception):
+        spool.replay(fails_on_second_hour)
+    # the first hour was accepted and removed, the second waits
+    assert spool.depth() == 2
+    db.offline = False
+    assert upload.lines(HOUR) == first
+
+    assert spool.replay(upload) == 2
+    assert upload.lines(HOUR + timedelta(hours=1)) == second
+    # the accepted hour was not sent again
+    assert [batch[0] for batch in upload.batches] == [HOUR, HOUR + timedelta(hours=1)]
+
+
+def test_size_cap_drops_oldest(db, tmp_path):
+    dropped = list()
+    spool = UploadSpool(str(tmp_path / 'spool.db'), max_rows=5, on_drop=dropped.append)
+    try:
+        lines = put_lines(spool, HOUR, 8)
+        assert spool.depth() == 5
+        assert spool.dropped == 3
+        assert dropped == lines[:3]
+
+        upload = HourUploader(db)
+        assert spool.replay(upload) == 5
+        assert upload.lines(HOUR) == lines[3:]
+    finally:
+        spool.close()
+
+
+def test_same_hour_lines_are_one_batch(db, spool):
+    upload = HourUploader(db)
+    put_lines(spool, HOUR, 3)
+    put_lines(spool, HOUR + timedelta(hours=1), 2)
+    put_lines(spool, HOUR, 1, first=3)
+    spool.replay(upload)
+    # one batch per run of an hour, never mixing hours
+    assert [(hour, len(lines)) for hour, lines, _in, _roof in upload.batches] == [
+        (HOUR, 3), (HOUR + timedelta(hours=1), 2), (HOUR, 1)]
+    # the glycol maximums of each batch
+    assert upload.batches[0][2:] == (22.0, 32.0)
+    assert upload.batches[1][2:] == (21.0, 31.0)
+
+
+def test_batch_size_splits_an_hour(db, spool):
+    upload = HourUploader(db)
+    lines = put_lines(spool, HOUR, 5)
+    spool.replay(upload, batch_size=2)
+    assert [len(batch[1]) for batch in upload.batches] == [2, 2, 1]
+    assert upload.lines(HOUR) == lines
+    # one document write per batch, not per line
+    assert db.writes == 3
+
+
+def test_spool_survives_a_restart(db, tmp_path):
+    location = str(tmp_path / 'spool.db')
+    spool = UploadSpool(location)
+    lines = put_lines(spool, HOUR, 3)
+    spool.close()
+
+    spool = UploadSpool(location)
+    try:
+        assert spool.depth() == 3
+        upload = HourUploader(db)
+        spool.replay(upload)
+        assert upload.lines(HOUR) == lines
+    finally:
+        spool.close()
+
+
+def test_drop_during_upload(db, tmp_path):
+    dropped = list()
+    spool = UploadSpool(str(tmp_path / 'spool.db'), max_rows=4, on_drop=dropped.append)
+    try:
+        lines = put_lines(spool, HOUR, 4)
+        upload = HourUploader(db)
+
+        def put_while_uploading(date_time_utc, batch, glycol_in_max, glycol_roof_max):
+            upload(date_time_utc, batch, glycol_in_max, glycol_roof_max)
+            if len(upload.batches) == 1:
+                # the cap drops 3 lines of the batch in flight
+                lines.extend(put_lines(spool, HOUR + timedelta(hours=1), 3))
+
+        # the first batch is the 4 lines, 3 of them dropped before the delete
+        assert spool.replay(put_while_uploading) == 1 + 3
+        assert dropped == lines[:3]
+        assert spool.dropped == 3
+        assert spool.uploaded == 4
+        assert spool.depth() == 0
+        assert spool._conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0] == 0
+    finally:
+        spool.close()
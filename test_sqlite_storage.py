@@ -0,0 +1,71 @@
+'''
+------------------------------------------------------------------------
+Tests of the rollup tables: the upsert of each row and fill_rollup give
+the same buckets, 1 day buckets are local days, and the 0.01
+placeholder is a missing value.
+
+Run: python -m pytest test_sqlite_storage.py
+------------------------------------------------------------------------
+'''
+from datetime import datetime
+from sqlite3 import connect as sqlite_connect
+from time import tzset
+
+import pytest
+
+from sqlite_storage import (PLACEHOLDER, ROLLUPS, create_rollup_sql, fill_rollup,
+                            rollup_params, upsert_rollup_sql)
+
+NAMES = ['Date', 'roof', 'tank']
+
+
+@pytest.fixture
+def toronto(monkeypatch):
+    monkeypatch.setenv('TZ', 'America/Toronto')
+    tzset()
+    yield
+    monkeypatch.undo()
+    tzset()
+
+
+def make_samples(start, count, step=1800):
+    # every 5th roof value is the placeholder, the roof goes below zero
+    conn = sqlite_connect(':memory:')
+    conn.execute('CREATE TABLE "samples" ("ts" INTEGER PRIMARY KEY, "roof" REAL, "tank" REAL)')
+    rows = [(start + k * step, PLACEHOLDER if k % 5 == 0 else -3.0 + k * 0.1, 40.0) for k in range(count)]
+    conn.executemany('INSERT INTO "samples" VALUES(?,?,?)', rows)
+    return conn, rows
+
+
+@pytest.mark.parametrize('table', list(ROLLUPS))
+def test_upsert_matches_fill(toronto, table):
+    conn, rows = make_samples(int(datetime(2024, 11, 2, 20).timestamp()), 96)
+    fill_rollup(conn, table, NAMES)
+    conn.execute(create_rollup_sql('upserted', NAMES))
+    sql = upsert_rollup_sql('upserted', NAMES)
+    for ts, *values in rows:
+        conn.execute(sql, rollup_params(ts, [None] + values, ROLLUPS[table]))
+    assert conn.execute('SELECT * FROM "upserted"').fetchall() == conn.execute(f'SELECT * FROM "{table}"').fetchall()
+
+
+def test_days_are_local(toronto):
+    # over the end of DST, 2024-11-03 is 25 hours long
+    conn, rows = make_samples(int(datetime(2024, 11, 2, 20).timestamp()), 96)
+    fill_rollup(conn, 'temperature_1d', NAMES)
+    days = conn.execute('SELECT "bucket", "rows" FROM "temperature_1d"').fetchall()
+    assert [datetime.fromtimestamp(bucket) for bucket, _rows in days] == [
+        datetime(2024, 11, 2), datetime(2024, 11, 3), datetime(2024, 11, 4)]
+    assert [count for _bucket, count in days] == [8, 50, 38]
+
+
+def test_placeholder_is_missing(toronto):
+    conn, rows = make_samples(int(datetime(2024, 1, 10).timestamp()), 10, step=6)
+    fill_rollup(conn, 'temperature_1m', NAMES)
+    count, roof_min, roof_max, roof_sum, roof_n = conn.execute(
+        'SELECT "rows", "roof_min", "roof_max", "roof_sum", "roof_n" FROM "temperature_1m"').fetchone()
+    real = [roof for _ts, roof, _tank in rows if roof != PLACEHOLDER]
+    assert (count, roof_n) == (10, 8)
+    assert roof_min == min(real)
+    # below zero all minute, the placeholder is not the max
+    assert roof_max == max(real) < 0
+    assert roof_sum == pytest.approx(sum(real))
@@ -0,0 +1,63 @@
+'''
+------------------------------------------------------------------------
+Tests of the buffered text archive: buffered lines reach the file once
+they are flush_interval old without another write, and on close.
+The buffer clock is patched, so nothing waits on a real interval.
+
+Run: python -m pytest test_text_archive.py
+------------------------------------------------------------------------
+'''
+from datetime import datetime
+
+import pytest
+
+import text_archive
+from text_archive import TextArchive
+
+NOON = datetime(2024, 6, 1, 12).timestamp()
+
+
+class Clock:
+    # stands in for text_archive.monotonic
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(text_archive, 'monotonic', clock)
+    return clock
+
+
+def lines(location):
+    with open(location) as f:
+        return f.read().splitlines()
+
+
+def test_old_lines_are_flushed_without_a_write(tmp_path, clock):
+    location = str(tmp_path / 'output.txt')
+    archive = TextArchive(location, 'Date,roof', flush_interval=300)
+    archive.write('12:00:00,40.0', NOON)
+    archive.write('12:00:19,40.5', NOON + 19)
+    assert not archive.flush_due()
+    assert '12:00:00,40.0' not in lines(location)
+
+    # the oldest line has waited long enough, no new sample came
+    clock.now += 300
+    assert archive.flush_due()
+    assert lines(location) == ['Date,roof', '12:00:00,40.0', '12:00:19,40.5']
+    assert not archive.flush_due()
+    assert archive.flushes == 1
+    archive.close()
+
+
+def test_close_flushes(tmp_path, clock):
+    location = str(tmp_path / 'output.txt')
+    archive = TextArchive(location, 'Date,roof', flush_interval=300)
+    archive.write('12:00:00,40.0', NOON)
+    archive.close()
+    assert lines(location) == ['Date,roof', '12:00:00,40.0']
@@ -0,0 +1,38 @@
+'''
+------------------------------------------------------------------------
+Tests of the binary sample store: missing reads, the 0.01 placeholder
+among them, come back as NaN and real values round trip.
+
+Run: python -m pytest test_ts_store.py
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timezone
+
+import numpy as np
+
+from sqlite_storage import PLACEHOLDER
+from ts_store import MISSING, TimeSeriesStore, decode, encode
+
+NAMES = ['Date', 'roof', 'tank', 'outside']
+START = int(datetime(2024, 1, 10, 12, tzinfo=timezone.utc).timestamp())
+
+
+def test_encode_missing_values():
+    stored = encode([PLACEHOLDER, None, float('nan'), 400.0])
+    assert stored.tolist() == [MISSING] * 4
+    # small real values are not the placeholder
+    assert encode([-0.01, 0.02, 0.0]).tolist() == [-1, 2, 0]
+
+
+def test_placeholder_reads_back_as_missing(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'ts'), NAMES)
+    store.append(START, (PLACEHOLDER, 41.25, -3.5))
+    store.append(START + 19, (12.5, None, -3.75))
+    store.close()
+
+    times, values = TimeSeriesStore(str(tmp_path / 'ts')).read_columns(START, START + 19)
+    assert times.astype(np.int64).tolist() == [START, START + 19]
+    assert np.isnan(values[0, 0]) and np.isnan(values[1, 1])
+    assert values[0, 1:].tolist() == [41.25, -3.5]
+    assert values[1, [0, 2]].tolist() == [12.5, -3.75]
+    assert decode(encode([21.37])).tolist() == [21.37]
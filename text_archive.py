@@ -0,0 +1,206 @@
+'''
+------------------------------------------------------------------------
+Buffered, daily rotating text archive of the sample lines.
+The live file (output.txt) stays open. Lines are buffered and written
+once the buffer holds flush_bytes or its oldest line is flush_interval
+seconds old, instead of an open, write and close for every sample.
+flush_due() writes old lines when no new sample comes to do it, call it
+every so often. close() writes whatever is left.
+
+At the first sample of a new day the live file is renamed to
+output-YYYY-MM-DD.txt and compressed in the background to
+output-YYYY-MM-DD.txt.gz (.zst when the zstandard package is
+installed). Every file starts with the header line.
+
+A power cut loses at most the buffered lines. The same samples are
+in the SQLite databases.
+------------------------------------------------------------------------
+'''
+import gzip
+from glob import glob
+from os import path as os_path, remove, rename, replace
+from shutil import copyfileobj
+from threading import Lock, Thread
+from time import localtime, monotonic, strftime, time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def compress_file(source, method='gzip'):
+    """
+    -------------------------------------------------------
+    Compresses a closed file next to itself and removes the original.
+    The compressed file only appears once it is complete.
+    Use: compress_file('Output/output-2024-06-01.txt')
+    -------------------------------------------------------
+    Returns:
+        location of the compressed file (str)
+    -------------------------------------------------------
+    """
+    if method == 'zstd':
+        target = source + '.zst'
+        with open(source, 'rb') as f_in, open(target + '.tmp', 'wb') as f_out:
+            zstandard.ZstdCompressor(level=10).copy_stream(f_in, f_out)
+    else:
+        target = source + '.gz'
+        with open(source, 'rb') as f_in, gzip.open(target + '.tmp', 'wb') as f_out:
+            copyfileobj(f_in, f_out)
+    replace(target + '.tmp', target)
+    remove(source)
+    return target
+
+
+class TextArchive:
+    """
+    -------------------------------------------------------
+    Use: archive = TextArchive('Output/output.txt', ','.join(ReadingObj.SENSOR_NAMES))
+         archive.write(line, epoch)
+         archive.close()
+    -------------------------------------------------------
+    """
+    def __init__(self, location, header, flush_interval=60.0, flush_bytes=65536, compression='auto', on_error=None):
+        """
+        -------------------------------------------------------
+        Parameters:
+            location - live file, rotated files go next to it (str)
+            header - first line of every file (str)
+            flush_interval - longest a line waits in the buffer, seconds (float)
+            flush_bytes - buffered bytes that trigger a write (int)
+            compression - 'gzip', 'zstd' or 'auto' for zstd when installed (str)
+            on_error - called with the exception when a background compression fails
+        -------------------------------------------------------
+        """
+        self.location = location
+        self.header = header
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        if compression == 'auto':
+            compression = 'zstd' if zstandard is not None else 'gzip'
+        self.compression = compression
+        self.on_error = on_error
+        self._lock = Lock()
+        self._file = None
+        self._day = None
+        self._buffer = list()
+        self._buffered = 0
+        self._first_buffered = 0.0
+        self._compressors = list()
+        self.flushes = 0
+        self.rotations = 0
+
+        base, ext = os_path.splitext(location)
+        self._archive_pattern = base + '-{}' + ext
+        # rotated files a crash left uncompressed
+        for leftover in sorted(glob(base + '-????-??-??' + ext)) + sorted(glob(base + '-????-??-??-*' + ext)):
+            self._compress_in_background(leftover)
+
+    def write(self, line, epoch=None):
+        """
+        -------------------------------------------------------
+        Adds one line. Rotates first if the sample is on a new day.
+        -------------------------------------------------------
+        Parameters:
+            line - csv line without the newline (str)
+            epoch - sample time, decides the day. Default now (float)
+        -------------------------------------------------------
+        """
+        day = strftime('%Y-%m-%d', localtime(time() if epoch is None else epoch))
+        with self._lock:
+            if day != self._day:
+                self._open(day)
+            if not self._buffer:
+                self._first_buffered = monotonic()
+            self._buffer.append(line + '\n')
+            self._buffered += len(line) + 1
+            if self._buffered >= self.flush_bytes or monotonic() - self._first_buffered >= self.flush_interval:
+                self._flush()
+
+    def _open(self, day):
+        if self._file is not None:
+            # the live file holds the previous day
+            self._flush()
+            self._file.close()
+            self._file = None
+            self._rotate(self._day)
+        elif os_path.exists(self.location):
+            # left from before a restart. keep appending if it is from today
+            file_day = strftime('%Y-%m-%d', localtime(os_path.getmtime(self.location)))
+            if file_day != day:
+                self._rotate(file_day)
+        self._file = open(self.location, 'a')
+        if self._file.tell() == 0:
+            self._file.write(self.header + '\n')
+        self._day = day
+
+    def _rotate(self, day):
+        archive = self._archive_pattern.format(day)
+        suffix = 1
+        while any(os_path.exists(archive + ext) for ext in ('', '.gz', '.zst')):
+            archive = self._archive_pattern.format(f"{day}-{suffix}")
+            suffix += 1
+        rename(self.location, archive)
+        self.rotations += 1
+        self._compress_in_background(archive)
+
+    def _compress_in_background(self, source):
+        def run():
+            try:
+                compress_file(source, self.compression)
+            except Exception as error:
+                if self.on_error is not None:
+                    self.on_error(error)
+        thread = Thread(target=run, name='text_archive', daemon=False)
+        thread.start()
+        self._compressors = [t for t in self._compressors if t.is_alive()] + [thread]
+
+    def _flush(self):
+        if self._buffer and self._file is not None:
+            self._file.write(''.join(self._buffer))
+            self._file.flush()
+            self.flushes += 1
+        self._buffer = list()
+        self._buffered = 0
+
+    def flush(self):
+        """
+        -------------------------------------------------------
+        Writes any buffered lines.
+        -------------------------------------------------------
+        """
+        with self._lock:
+            self._flush()
+
+    def flush_due(self):
+        """
+        -------------------------------------------------------
+        Writes the buffered lines if the oldest one has waited
+        flush_interval seconds. Lines are otherwise only written
+        by the next write, which may be a long time coming.
+        -------------------------------------------------------
+        Returns:
+            True if lines were written (bool)
+        -------------------------------------------------------
+        """
+        with self._lock:
+            if not self._buffer or monotonic() - self._first_buffered < self.flush_interval:
+                return False
+            self._flush()
+            return True
+
+    def close(self, timeout=None):
+        """
+        -------------------------------------------------------
+        Flushes, closes the live file and waits for running compressions.
+        -------------------------------------------------------
+        """
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            self._day = None
+        for thread in self._compressors:
+            thread.join(timeout)
@@ -0,0 +1,268 @@
+'''
+------------------------------------------------------------------------
+Compact append-only binary store for the sensor samples.
+Each sample is one fixed width record:
+    uint32 epoch seconds (UTC), then one int16 per sensor in
+    hundredths of a degree. MISSING (-32768) marks a failed read,
+    also one written as the 0.01 placeholder of the solar sensors.
+10 sensors take 24 bytes a sample, about 110 kB a day.
+
+Records go into one segment file per UTC day:
+    <root>/<YYYY>/<YYYY-MM-DD>.ts
+and <root>/meta.json holds the column names. Segments are only ever
+appended to, in time order, so a reader can memory map them and find
+a time range with a binary search. The records it returns are views
+of the mapped file, nothing is copied until they are converted.
+
+Use:
+    store = TimeSeriesStore('Output/ts', ReadingObj.SENSOR_NAMES)
+    store.append(epoch, sensor_values)
+    for records in store.read(start_epoch, end_epoch): ...
+    times, values = store.read_columns(start_epoch, end_epoch)
+
+Existing history: python ts_store.py import <sqlite db> <root>
+------------------------------------------------------------------------
+'''
+from datetime import datetime, timedelta, timezone
+from json import dump as json_dump, load as json_load
+from os import makedirs, path as os_path, walk
+from sqlite3 import connect as sqlite_connect
+from sys import argv
+from threading import Lock
+from time import monotonic
+
+import numpy as np
+
+from sqlite_storage import PLACEHOLDER
+
+MISSING = -32768
+# stored value = round(degrees * SCALE)
+SCALE = 100
+SEGMENT_SUFFIX = '.ts'
+
+
+def record_dtype(sensor_count):
+    """
+    -------------------------------------------------------
+    Returns the numpy dtype of one record. Packed, little endian.
+    -------------------------------------------------------
+    """
+    return np.dtype([('t', '<u4'), ('v', '<i2', (sensor_count,))])
+
+
+def encode(values):
+    """
+    -------------------------------------------------------
+    Converts degrees to stored int16 values. None, NaN, the 0.01
+    placeholder and values outside the int16 range are stored as MISSING.
+    -------------------------------------------------------
+    """
+    degrees = np.array(values, dtype=float)
+    scaled = np.round(degrees * SCALE)
+    bad = ~np.isfinite(scaled) | (scaled <= MISSING) | (scaled > 32767) | (degrees == PLACEHOLDER)
+    scaled[bad] = MISSING
+    return scaled.astype('<i2')
+
+
+def decode(stored):
+    """
+    -------------------------------------------------------
+    Converts stored int16 values to degrees, NaN where MISSING.
+    Returns a new float array.
+    -------------------------------------------------------
+    """
+    degrees = stored.astype(float) / SCALE
+    degrees[stored == MISSING] = np.nan
+    return degrees
+
+
+def segment_day(epoch):
+    # UTC date of the segment holding this time
+    return datetime.fromtimestamp(epoch, timezone.utc).date()
+
+
+class TimeSeriesStore:
+    """
+    -------------------------------------------------------
+    Daily segment files of fixed width records.
+    One writer at a time, any number of readers.
+    -------------------------------------------------------
+    """
+    def __init__(self, root, column_names=None):
+        """
+        -------------------------------------------------------
+        Parameters:
+            root - folder holding the segments (str)
+            column_names - ordered column names, date first (list).
+                           None reads them from an existing store.
+        -------------------------------------------------------
+        """
+        self.root = root
+        meta_file = os_path.join(root, 'meta.json')
+        if os_path.exists(meta_file):
+            with open(meta_file) as file:
+                stored_names = json_load(file)['columns']
+            if column_names is not None and list(column_names) != stored_names:
+                raise ValueError(f"{root} holds columns {stored_names}, not {list(column_names)}")
+            column_names = stored_names
+        elif column_names is None:
+            raise ValueError(f"{root} is not a store and no column names were given")
+        else:
+            makedirs(root, exist_ok=True)
+            with open(meta_file, 'w') as file:
+                json_dump({'columns': list(column_names), 'scale': SCALE, 'missing': MISSING}, file)
+        self.column_names = list(column_names)
+        self.dtype = record_dtype(len(self.column_names) - 1)
+        self._lock = Lock()
+        self._file = None
+        self._day = None
+        self._last_epoch = 0
+        self.out_of_order = 0
+
+    def segment_path(self, day):
+        return os_path.join(self.root, f"{day.year:04d}", f"{day.isoformat()}{SEGMENT_SUFFIX}")
+
+    def append(self, epoch, sensor_values):
+        """
+        -------------------------------------------------------
+        Appends one sample to the segment of its day.
+        Samples must arrive in time order. One that doesn't
+        (clock stepped back) is skipped and counted.
+        Use: store.append(deadline, sensor_vals_tuple[1:])
+        -------------------------------------------------------
+        Parameters:
+            epoch - sample time, seconds since the epoch (float)
+            sensor_values - degrees per sensor, None when missing (sequence)
+        Returns:
+            written - False if the sample was out of order (bool)
+        -------------------------------------------------------
+        """
+        record = np.zeros(1, dtype=self.dtype)
+        record['t'] = int(epoch)
+        record['v'] = encode(sensor_values)
+        with self._lock:
+            day = segment_day(int(epoch))
+            if day != self._day:
+                self._open_segment(day)
+            if int(epoch) <= self._last_epoch:
+                self.out_of_order += 1
+                return False
+            # one write call per record, a reader never sees half of one it maps
+            self._file.write(record.tobytes())
+            self._last_epoch = int(epoch)
+        return True
+
+    def _open_segment(self, day):
+        self.close()
+        path = self.segment_path(day)
+        makedirs(os_path.dirname(path), exist_ok=True)
+        self._file = open(path, 'ab', buffering=0)
+        # a power cut can leave half a record at the end. drop it so the next one lines up
+        size = self._file.tell()
+        if size % self.dtype.itemsize:
+            self._file.truncate(size - size % self.dtype.itemsize)
+        self._day = day
+        # continue after the last whole record of an existing segment
+        segment = self._map(path)
+        self._last_epoch = int(segment['t'][-1]) if segment is not None and len(segment) else 0
+
+    def _map(self, path):
+        # whole records of a segment as a read only memory map, None if empty
+        try:
+            count = os_path.getsize(path) // self.dtype.itemsize
+        except OSError:
+            return None
+        if count == 0:
+            return None
+        return np.memmap(path, dtype=self.dtype, mode='r', shape=(count,))
+
+    def read(self, start_epoch, end_epoch):
+        """
+        -------------------------------------------------------
+        Returns the records with start_epoch <= t <= end_epoch,
+        one array per day segment. Each is a view of the mapped
+        file, not a copy.
+        Use: for records in store.read(start, end):
+                 records['t'], records['v']
+        -------------------------------------------------------
+        """
+        views = list()
+        day = segment_day(int(start_epoch))
+        last_day = segment_day(int(end_epoch))
+        while day <= last_day:
+            segment = self._map(self.segment_path(day))
+            if segment is not None:
+                first = np.searchsorted(segment['t'], int(start_epoch), side='left')
+                last = np.searchsorted(segment['t'], int(end_epoch), side='right')
+                if last > first:
+                    views.append(segment[first:last])
+            day += timedelta(days=1)
+        return views
+
+    def read_columns(self, start_epoch, end_epoch):
+        """
+        -------------------------------------------------------
+        Returns the range as (times, values) like plot_data.fetch_columns:
+        datetime64[s] times (UTC) and a 2-D float array in degrees, NaN
+        where missing. This copies, once, into the result arrays.
+        -------------------------------------------------------
+        """
+        views = self.read(start_epoch, end_epoch)
+        if not views:
+            return np.empty(0, dtype='datetime64[s]'), np.empty((0, len(self.column_names) - 1))
+        times = np.concatenate([v['t'] for v in views]).astype('datetime64[s]')
+        values = decode(np.concatenate([v['v'] for v in views]))
+        return times, values
+
+    def disk_usage(self):
+        # bytes used by every segment
+        total = 0
+        for folder, _dirs, files in walk(self.root):
+            total += sum(os_path.getsize(os_path.join(folder, f)) for f in files if f.endswith(SEGMENT_SUFFIX))
+        return total
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._day = None
+
+
+def import_sqlite(db_location, root):
+    """
+    -------------------------------------------------------
+    Appends every row of a samples table to a store.
+    Its "ts" key is already epoch seconds.
+    Rows at or before the last stored time of a day are skipped,
+    so running it again only adds what is new.
+    -------------------------------------------------------
+    Returns:
+        rows written (int)
+    -------------------------------------------------------
+    """
+    conn = sqlite_connect(db_location)
+    try:
+        column_names = [row[1] for row in conn.execute('PRAGMA table_info("temperature")')]
+        store = TimeSeriesStore(root, column_names)
+        written = 0
+        cursor = conn.execute("SELECT * FROM samples ORDER BY ts")
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            for row in rows:
+                written += store.append(row[0], row[1:])
+        store.close()
+    finally:
+        conn.close()
+    return written
+
+
+if __name__ == '__main__':
+    if len(argv) != 4 or argv[1] != 'import':
+        print('Use: python ts_store.py import <sqlite db> <store folder>')
+        raise SystemExit(1)
+    start = monotonic()
+    rows = import_sqlite(argv[2], argv[3])
+    print(f"{rows} rows imported in {monotonic() - start:.1f}s, "
+          f"{TimeSeriesStore(argv[3]).disk_usage() / 1e6:.1f} MB on disk vs {os_path.getsize(argv[2]) / 1e6:.1f} MB sqlite")